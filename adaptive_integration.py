@@ -0,0 +1,211 @@
+"""Adaptive time step integration with exact handling of the collisions with the walls of the box"""
+
+import numpy as np
+from rocket_simulation import (FORCE_TYPES, acceleration_function, random_force_parameters, random_initial_pos,
+                               trajectory_info)
+from box_with_different_forces_simulation import force_lookup_tables, region_index
+
+
+# Dormand-Prince 5(4) coefficients (the forces don't depend on time explicitly, so the nodes are not needed):
+DP_A = [[],
+        [1 / 5],
+        [3 / 40, 9 / 40],
+        [44 / 45, -56 / 15, 32 / 9],
+        [19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729],
+        [9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656],
+        [35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84]]
+DP_B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+DP_E = DP_B - np.array([5179 / 57600, 0, 7571 / 16695, 393 / 640, -92097 / 339200, 187 / 2100, 1 / 40])
+
+
+def _derivative(acceleration, state):
+    """Time derivative of the state [x, y, v_x, v_y]"""
+    a_x, a_y = acceleration(state[0], state[1], state[2], state[3])
+    return np.array([state[2], state[3], a_x, a_y])
+
+
+def dormand_prince_step(acceleration, state, step):
+    """
+    The function makes a single Dormand-Prince 5(4) step.
+    :param acceleration: function (x, y, v_x, v_y) -> (a_x, a_y)
+    :param np.ndarray state: [x, y, v_x, v_y]
+    :param float step: the time step
+    :return: the new state (5th order) and the estimate of its error
+    """
+
+    k = np.empty((7, 4))
+    for i in range(7):
+        k[i] = _derivative(acceleration, state + step * np.dot(DP_A[i], k[:i]) if i else state)
+
+    return state + step * np.dot(DP_B, k), step * np.dot(DP_E, k)
+
+
+def _hermite_position(state_0, state_1, step, theta):
+    """Position at time t + theta * step from the cubic Hermite interpolation of the step"""
+    h_00 = 2 * theta ** 3 - 3 * theta ** 2 + 1
+    h_10 = theta ** 3 - 2 * theta ** 2 + theta
+    h_01 = -2 * theta ** 3 + 3 * theta ** 2
+    h_11 = theta ** 3 - theta ** 2
+    return (h_00 * state_0[:2] + h_10 * step * state_0[2:] + h_01 * state_1[:2] + h_11 * step * state_1[2:])
+
+
+def _wall_crossing(state_0, state_1, step, box_size, tolerance=1e-12):
+    """
+    The function finds the first crossing of a wall within the step by bisection on the Hermite interpolation.
+    :return: fraction of the step (theta) at which the wall is crossed and the axis of the wall
+    """
+
+    crossing_theta, crossing_axis = 1., None
+    for axis in range(2):
+        for level, inside in ((0, 1), (box_size, -1)):
+            # inside * (position - level) is positive inside the box:
+            if inside * (state_1[axis] - level) >= 0:
+                continue
+            low, high = 0., 1.
+            while high - low > tolerance:
+                middle = (low + high) / 2
+                if inside * (_hermite_position(state_0, state_1, step, middle)[axis] - level) > 0:
+                    low = middle
+                else:
+                    high = middle
+            if crossing_axis is None or high < crossing_theta:
+                crossing_theta, crossing_axis = high, axis
+
+    return crossing_theta, crossing_axis
+
+
+def adaptive_integrate(acceleration, position_0, velocity_0, t_max, box_size, wall_event='terminate', rtol=1e-6,
+                       atol=1e-9, first_step=0.01, max_step=np.inf, max_steps=1000000):
+    """
+    The function integrates the movement of a body with the Dormand-Prince 5(4) method with adaptive time step. The
+    step is chosen so that the estimated local error stays below atol + rtol * |state|, so the step is large where the
+    movement is smooth and small near strong fields. The crossing of a wall is handled as an event: its time is found by
+    root-finding on the interpolation of the step, the body is moved exactly to the wall and then either the simulation
+    is terminated or the body bounces off the wall.
+    :param acceleration: function (x, y, v_x, v_y) -> (a_x, a_y), e.g. rocket_simulation.acceleration_function
+    :param np.ndarray position_0: initial position of the body, shape (2,)
+    :param np.ndarray velocity_0: initial velocity of the body, shape (2,)
+    :param float t_max: time at which the simulation ends
+    :param float box_size: size of the box the body is moving in
+    :param str wall_event: 'terminate' to finish the simulation at the wall or 'reflect' to bounce off it
+    :param float rtol: relative tolerance of the local error
+    :param float atol: absolute tolerance of the local error
+    :param float first_step: the first time step
+    :param float max_step: the largest allowed time step
+    :param int max_steps: the largest number of accepted steps
+    :return: times - np.array of shape (n,), positions - np.array of shape (n, 2), velocities - np.array of shape (n, 2)
+    and events - list of (time, axis) tuples of the wall crossings
+    """
+
+    if wall_event not in ('terminate', 'reflect'):
+        raise ValueError("wall_event must be 'terminate' or 'reflect'")
+
+    state = np.concatenate([np.asarray(position_0, dtype=float).ravel(), np.asarray(velocity_0, dtype=float).ravel()])
+    t, step = 0., min(first_step, max_step)
+    times, states, events = [t], [state], []
+
+    while t < t_max and len(times) < max_steps:
+        step = min(step, t_max - t)
+        new_state, error = dormand_prince_step(acceleration, state, step)
+
+        scale = atol + rtol * np.maximum(np.abs(state), np.abs(new_state))
+        error_norm = np.sqrt(np.mean((error / scale) ** 2))
+        if error_norm > 1:
+            step *= max(0.2, 0.9 * error_norm ** -0.2)
+            continue
+
+        theta, axis = _wall_crossing(state, new_state, step, box_size)
+        if axis is not None:
+            # moving exactly to the wall with a shorter step:
+            step_to_wall = theta * step
+            new_state, _ = dormand_prince_step(acceleration, state, step_to_wall)
+            new_state[axis] = 0. if new_state[axis] < box_size / 2 else float(box_size)
+            t += step_to_wall
+            events.append((t, axis))
+            if wall_event == 'reflect':
+                new_state[2 + axis] = - new_state[2 + axis]
+            times.append(t)
+            states.append(new_state)
+            state = new_state
+            if wall_event == 'terminate':
+                break
+            continue
+
+        t += step
+        times.append(t)
+        states.append(new_state)
+        state = new_state
+        step = min(max_step, step * min(5., 0.9 * max(error_norm, 1e-10) ** -0.2))
+
+    states = np.array(states)
+
+    return np.array(times), states[:, :2], states[:, 2:], events
+
+
+def generate_trajectories_adaptive(force_type, t_max=30., box_size=1000, body_mass=1, rtol=1e-6, atol=1e-9,
+                                   max_step=np.inf, time_step=0.01, rng=None):
+    """
+    The function generates a trajectory of a movement of a rocket with adaptive time step. The random parameters are
+    drawn in the same way as in rocket_simulation.generate_trajectories_fast. The rocket without force bounces off the
+    walls, for the other force types the simulation ends exactly at the wall.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param float t_max: time at which the simulation ends
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param float rtol: relative tolerance of the local error
+    :param float atol: absolute tolerance of the local error
+    :param float max_step: the largest allowed time step
+    :param float time_step: time step used only to draw the initial positions (see random_initial_pos)
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :return: x and y np.arrays of the trajectory (np.array of shape (2, number of steps)), np.array of times of the
+    steps and dictionary with information about generated trajectory
+    """
+
+    assert force_type in FORCE_TYPES and ('force_type has to be one of (\'no_force\', \'gravity\', '
+                                          '\'magnetic_field\', \'harmonic_oscillator\')')
+
+    params = random_force_parameters(box_size, rng=rng)
+    position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
+                                  high_starting_position_limit=0.6, low_starting_velocity_limit=-1,
+                                  high_starting_velocity_limit=1, time_step=time_step, rng=rng)
+    info_dict = trajectory_info(force_type, position, *params)
+
+    acceleration = acceleration_function(force_type, body_mass, *params)
+    times, positions, _, _ = adaptive_integrate(acceleration, position[1], (position[1] - position[0]) / time_step,
+                                                t_max, box_size,
+                                                wall_event='reflect' if force_type == 'no_force' else 'terminate',
+                                                rtol=rtol, atol=atol, max_step=max_step)
+
+    return positions.T.copy(), times, info_dict
+
+
+def simulate_movement_adaptive(t_max, velocity_0, box_size, rtol=1e-6, atol=1e-9, max_step=np.inf):
+    """
+    Function simulates movement of a ball inside the box of box_with_different_forces_simulation with adaptive time
+    step and exact bouncing off the walls. The forces are taken from force_lookup_tables, the Lorentz force uses the
+    instantaneous velocity of the ball.
+    :param t_max: time at which the simulation ends (float)
+    :param velocity_0: starting velocity of the ball in form of a numpy array of shape (1,2)
+    :param box_size: size of the square box the ball is moving in (float)
+    :param rtol: relative tolerance of the local error (float)
+    :param atol: absolute tolerance of the local error (float)
+    :param max_step: the largest allowed time step (float)
+    :return: x and y np.arrays which are ball coordinates and np.array of times of the steps
+    """
+
+    if not isinstance(velocity_0, np.ndarray):
+        raise TypeError("velovity_0 must be a numpy array")
+    assert velocity_0.shape == (1, 2)
+
+    constant, spring, center, magnetic = force_lookup_tables(box_size)
+
+    def acceleration(x, y, v_x, v_y):
+        region = region_index(np.array([x, y]), box_size)
+        return (constant[region, 0] - spring[region] * (x - center[region, 0]) + magnetic[region] * v_y,
+                constant[region, 1] - spring[region] * (y - center[region, 1]) - magnetic[region] * v_x)
+
+    position_0 = 0.1 * box_size + np.random.random(2) * 0.8 * box_size  # starting position is random
+    times, positions, _, _ = adaptive_integrate(acceleration, position_0, velocity_0[0], t_max, box_size,
+                                                wall_event='reflect', rtol=rtol, atol=atol, max_step=max_step)
+
+    return positions[:, 0], positions[:, 1], times
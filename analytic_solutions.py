@@ -0,0 +1,227 @@
+"""Analytic solutions of the movement of the rocket for all the force types of rocket_simulation"""
+
+import numpy as np
+from rocket_simulation import FORCE_TYPES, random_force_parameters, random_initial_pos, trajectory_info
+
+
+def _cosine_axis(force_type, axis, r, v, body_mass, B_z, r_0, spring_constant):
+    """
+    The function writes the movement along one axis as a + c * cos(omega * t + phi) (cyclotron motion and harmonic
+    oscillator).
+    :return: a, c, omega, phi
+    """
+
+    if force_type == 'magnetic_field':
+        omega = B_z / body_mass
+        if axis == 0:
+            # x(t) = x + (v_x * sin(omega * t) + v_y * (1 - cos(omega * t))) / omega
+            return r[0] + v[1] / omega, np.hypot(v[0], v[1]) / omega, omega, np.arctan2(-v[0], -v[1])
+        # y(t) = y + (v_y * sin(omega * t) - v_x * (1 - cos(omega * t))) / omega
+        return r[1] - v[0] / omega, np.hypot(v[0], v[1]) / omega, omega, np.arctan2(-v[1], v[0])
+
+    omega = np.sqrt(spring_constant[axis] / body_mass)
+    displacement = r[axis] - r_0[axis]
+    return r_0[axis], np.hypot(displacement, v[axis] / omega), omega, np.arctan2(-v[axis] / omega, displacement)
+
+
+def _uses_cosine(force_type, axis, B_z, spring_constant):
+    """Checks whether the movement along the axis is described by _cosine_axis (non-zero frequency)"""
+    if force_type == 'magnetic_field':
+        return B_z != 0
+    if force_type == 'harmonic_oscillator':
+        return spring_constant[axis] > 0
+    return False
+
+
+def _parameters(force_type, g_acc_norm, B_z, r_0, spring_constant):
+    """Converts the parameters drawn by rocket_simulation.random_force_parameters to flat floats/arrays"""
+    g = np.zeros(2) if force_type != 'gravity' else np.asarray(g_acc_norm, dtype=float).ravel()
+    B_z = float(B_z) if B_z is not None else 0.
+    r_0 = np.zeros(2) if r_0 is None else np.asarray(r_0, dtype=float).ravel()
+    spring_constant = np.zeros(2) if spring_constant is None else np.asarray(spring_constant, dtype=float).ravel()
+    return g, B_z, r_0, spring_constant
+
+
+def analytic_positions(force_type, r, v, times, box_size, body_mass=1, g_acc_norm=None, B_z=None, r_0=None,
+                       spring_constant=None):
+    """
+    The function evaluates the analytic solution of the movement at arbitrary times in one vectorized expression. The
+    rocket is at position r with velocity v at time 0. For 'no_force' the rocket bounces off the walls of the box,
+    for the other force types the solution is not limited by the box (see first_wall_crossing_time).
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray r: position of the rocket at time 0, shape (2,)
+    :param np.ndarray v: velocity of the rocket at time 0, shape (2,)
+    :param np.ndarray times: times at which the positions are evaluated, shape (n,)
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :return: np.array of shape (n, 2) with the positions of the rocket
+    """
+
+    assert force_type in FORCE_TYPES and ('force_type has to be one of (\'no_force\', \'gravity\', '
+                                          '\'magnetic_field\', \'harmonic_oscillator\')')
+
+    g, B_z, r_0, spring_constant = _parameters(force_type, g_acc_norm, B_z, r_0, spring_constant)
+    r, v = np.asarray(r, dtype=float).ravel(), np.asarray(v, dtype=float).ravel()
+    times = np.asarray(times, dtype=float)
+
+    positions = np.empty((len(times), 2))
+    for axis in range(2):
+        if _uses_cosine(force_type, axis, B_z, spring_constant):
+            a, c, omega, phi = _cosine_axis(force_type, axis, r, v, body_mass, B_z, r_0, spring_constant)
+            positions[:, axis] = a + c * np.cos(omega * times + phi)
+        else:
+            positions[:, axis] = r[axis] + v[axis] * times + 0.5 * g[axis] * times ** 2
+
+    if force_type == 'no_force':
+        # Bouncing off the walls is the same as folding the straight line into the box:
+        folded = np.mod(positions, 2 * box_size)
+        positions = box_size - np.abs(box_size - folded)
+
+    return positions
+
+
+def _first_quadratic_crossing(x, v, a, level):
+    """The smallest t > 0 for which x + v * t + a * t ** 2 / 2 = level (np.inf if there is none)"""
+    if a == 0:
+        t = (level - x) / v if v != 0 else np.inf
+        return t if t > 0 else np.inf
+
+    discriminant = v ** 2 - 2 * a * (x - level)
+    if discriminant < 0:
+        return np.inf
+
+    roots = [t for t in ((-v - np.sqrt(discriminant)) / a, (-v + np.sqrt(discriminant)) / a) if t > 0]
+    return min(roots) if roots else np.inf
+
+
+def _first_cosine_crossing(a, c, omega, phi, level):
+    """The smallest t > 0 for which a + c * cos(omega * t + phi) = level (np.inf if there is none)"""
+    if c == 0 or abs((level - a) / c) > 1:
+        return np.inf
+    if omega < 0:
+        omega, phi = -omega, -phi
+
+    alpha = np.arccos((level - a) / c)
+    period = 2 * np.pi / omega
+    candidates = np.mod(np.array([alpha - phi, -alpha - phi]), 2 * np.pi) / omega
+    candidates[candidates <= 0] += period
+    return candidates.min()
+
+
+def first_wall_crossing_time(force_type, r, v, box_size, body_mass=1, g_acc_norm=None, B_z=None, r_0=None,
+                             spring_constant=None):
+    """
+    The function calculates in closed form the first time at which the rocket leaves the box. The rocket without force
+    bounces off the walls, so it never leaves the box.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray r: position of the rocket at time 0, shape (2,)
+    :param np.ndarray v: velocity of the rocket at time 0, shape (2,)
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :return: float time of the first crossing of a wall (np.inf if the rocket never leaves the box)
+    """
+
+    if force_type == 'no_force':
+        return np.inf
+
+    g, B_z, r_0, spring_constant = _parameters(force_type, g_acc_norm, B_z, r_0, spring_constant)
+    r, v = np.asarray(r, dtype=float).ravel(), np.asarray(v, dtype=float).ravel()
+
+    crossing_time = np.inf
+    for axis in range(2):
+        for level in (0, box_size):
+            if _uses_cosine(force_type, axis, B_z, spring_constant):
+                a, c, omega, phi = _cosine_axis(force_type, axis, r, v, body_mass, B_z, r_0, spring_constant)
+                crossing_time = min(crossing_time, _first_cosine_crossing(a, c, omega, phi, level))
+            else:
+                crossing_time = min(crossing_time, _first_quadratic_crossing(r[axis], v[axis], g[axis], level))
+
+    return float(crossing_time)
+
+
+def reference_trajectory(force_type, position, time_step, max_simul_steps, box_size, body_mass, g_acc_norm, B_z, r_0,
+                         spring_constant):
+    """
+    The function evaluates the analytic solution on the same time grid as rocket_simulation.verlet_integration (step i
+    is at time (i - 1) * time_step) and truncates it in the same way - after the first step outside the box. It can be
+    used as a reference for validating the numeric integrators.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body, np.array of shape (2, 2) (see random_initial_pos)
+    :param float time_step: the time step of the numeric integration
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :return: np.array of shape (number of steps, 2) with the positions of the rocket
+    """
+
+    r = position[1]
+    v = (position[1] - position[0]) / time_step
+    crossing_time = first_wall_crossing_time(force_type, r, v, box_size, body_mass, g_acc_norm, B_z, r_0,
+                                             spring_constant)
+
+    n_steps = max_simul_steps if np.isinf(crossing_time) else min(max_simul_steps,
+                                                                  int(np.floor(crossing_time / time_step)) + 3)
+    times = (np.arange(n_steps) - 1) * time_step
+
+    positions = analytic_positions(force_type, r, v, times, box_size, body_mass, g_acc_norm, B_z, r_0,
+                                   spring_constant)
+    positions[:2] = position[:2]
+
+    return positions
+
+
+def generate_trajectories_analytic(force_type, time_step=0.01, max_simul_steps=30, box_size=1000, body_mass=1,
+                                   frames_number=None, rng=None):
+    """
+    The function generates a trajectory of a movement of a rocket from the analytic solution. The random parameters are
+    drawn in the same way as in rocket_simulation.generate_trajectories_fast, so for the same random state both
+    functions describe the same movement. No stepping loop is used - the time of leaving the box is calculated in
+    closed form and the positions are evaluated only at the required times.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param float time_step: the time step of the corresponding numeric simulation
+    :param int max_simul_steps: maximum number of steps of the corresponding numeric simulation
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param None or int frames_number: if None the positions are evaluated at every time step (as in
+    generate_trajectories_fast), otherwise at frames_number times evenly spread between 0 and the time of leaving the
+    box (or the end of the simulation)
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :return: x and y np.arrays of the trajectory (np.array of shape (2, number of positions)) and dictionary with
+    information about generated trajectory
+    """
+
+    assert force_type in FORCE_TYPES and ('force_type has to be one of (\'no_force\', \'gravity\', '
+                                          '\'magnetic_field\', \'harmonic_oscillator\')')
+
+    g_acc_norm, B_z, r_0, spring_constant = random_force_parameters(box_size, rng=rng)
+    position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
+                                  high_starting_position_limit=0.6, low_starting_velocity_limit=-1,
+                                  high_starting_velocity_limit=1, time_step=time_step, rng=rng)
+    info_dict = trajectory_info(force_type, position, g_acc_norm, B_z, r_0, spring_constant)
+
+    if frames_number is None:
+        positions = reference_trajectory(force_type, position, time_step, max_simul_steps, box_size, body_mass,
+                                         g_acc_norm, B_z, r_0, spring_constant)
+        return positions.T.copy(), info_dict
+
+    r = position[1]
+    v = (position[1] - position[0]) / time_step
+    crossing_time = first_wall_crossing_time(force_type, r, v, box_size, body_mass, g_acc_norm, B_z, r_0,
+                                             spring_constant)
+    times = np.linspace(0, min(crossing_time, (max_simul_steps - 2) * time_step), frames_number)
+    positions = analytic_positions(force_type, r, v, times, box_size, body_mass, g_acc_norm, B_z, r_0,
+                                   spring_constant)
+
+    return positions.T.copy(), info_dict
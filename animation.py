@@ -1,8 +1,5 @@
-import matplotlib
-import matplotlib.pyplot as plt
-import matplotlib.animation as animation
+import os
 import numpy as np
-matplotlib.use('TkAgg')
 
 
 def animate_movement(x, y, box_size, interval=20, save=False, save_path=None):
@@ -17,6 +14,13 @@ def animate_movement(x, y, box_size, interval=20, save=False, save_path=None):
         raise TypeError("Both x_values and y_values must be numpy arrays")
     assert x.shape == y.shape and 'x and y shapes don\'t match!'
 
+    # matplotlib is imported and the GUI backend is set only here, so that importing the module is fast and works
+    # without a display:
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
+    import matplotlib.animation as animation
+
     # Set up the figure, the axis, and the plot element we want to animate
     fig, ax = plt.subplots()
 
@@ -47,15 +51,90 @@ def animate_movement(x, y, box_size, interval=20, save=False, save_path=None):
 
     if save:
         if not save_path:
-            ani.save('animation.gif', writer='pillow')
+            export_animation(x, y, box_size, 'animation.gif', fps=1000 / interval)
         elif isinstance(save_path, str):
-            ani.save(save_path + r'\animation.gif', writer='pillow')
+            export_animation(x, y, box_size, os.path.join(save_path, 'animation.gif'), fps=1000 / interval)
         else:
             print('Gif wasn\'t saved, because save_path is not a string')
 
     plt.show()
 
 
+def export_animation(x, y, box_size, save_path, frame_step=1, fps=50, figsize=(4, 4), dpi=100):
+    """
+    A function saving the animation of a point given x and y coordinate arrays without displaying it, so it works on
+    machines without a display. The figure is drawn with the Agg canvas directly (no pyplot window). The trail is drawn
+    incrementally: every frame only the new segment of the trail is drawn on top of the saved image of the previous
+    frame, so the time of the export grows linearly with the number of points. The frames are streamed to an imageio
+    writer, so they are never kept in memory at once.
+    :param np.ndarray x: array of x coordinates of the point
+    :param np.ndarray y: array of y coordinates of the point
+    :param float box_size: size of the box the point is moving in
+    :param str save_path: path of the output file, the format is chosen by the extension (.gif, or .mp4 which needs
+    the imageio-ffmpeg plugin)
+    :param int frame_step: only every frame_step-th point is a frame (the trail still goes through all the points)
+    :param float fps: frames per second of the output
+    :param tuple figsize: size of the figure in inches
+    :param int dpi: resolution of the figure
+    :return: number of written frames
+    """
+
+    # Checking the data:
+    if not isinstance(x, np.ndarray) or not isinstance(y, np.ndarray):
+        raise TypeError("Both x_values and y_values must be numpy arrays")
+    assert x.shape == y.shape and 'x and y shapes don\'t match!'
+    if not isinstance(save_path, str):
+        raise TypeError('save_path must be a string')
+    if not isinstance(frame_step, int) or frame_step < 1:
+        raise TypeError('frame_step must be a positive integer')
+
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import imageio.v2 as imageio
+
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    ax.set_xlim(0, box_size)
+    ax.set_ylim(0, box_size)
+
+    ax.set_aspect('equal')
+
+    point, = ax.plot([], [], 'ro', animated=True)
+    line, = ax.plot([], [], 'b-', animated=True)
+
+    # The empty axes are the background the trail is accumulated on:
+    canvas.draw()
+    background = canvas.copy_from_bbox(ax.bbox)
+
+    # GIF frame durations are given in milliseconds, the video writers take fps:
+    if save_path.lower().endswith('.gif'):
+        writer = imageio.get_writer(save_path, duration=1000 / fps, loop=0)
+    else:
+        writer = imageio.get_writer(save_path, fps=fps)
+
+    frames = list(range(0, len(x), frame_step))
+    if frames and frames[-1] != len(x) - 1:
+        frames.append(len(x) - 1)
+
+    previous = 0
+    with writer:
+        for i in frames:
+            canvas.restore_region(background)
+            # only the new piece of the trail (starting at the previous frame, so the segments are connected):
+            line.set_data(x[previous:i + 1], y[previous:i + 1])
+            ax.draw_artist(line)
+            background = canvas.copy_from_bbox(ax.bbox)
+            previous = i
+
+            point.set_data([x[i]], [y[i]])
+            ax.draw_artist(point)
+            writer.append_data(np.asarray(canvas.buffer_rgba())[:, :, :3].copy())
+
+    return len(frames)
+
+
 def test_circle(x_0, y_0, r, pts_density):
     """
     The function returns an np.arrays of length equal to pts_density of x and y values that represents points on the
@@ -74,4 +153,13 @@ def test():
     """
     x_values, y_values = test_circle(5, 3, 5, 100)
 
-    animate_movement(x_values, y_values)
+    animate_movement(x_values, y_values, 10)
+
+
+def test_export(save_path='animation.gif'):
+    """
+    Function testing the headless export on a circular trajectory
+    """
+    x_values, y_values = test_circle(5, 3, 5, 100)
+
+    export_animation(x_values, y_values, 10, save_path, frame_step=2)
@@ -0,0 +1,234 @@
+"""Per-process cache of the sprite and background images, pre-scaled to the output resolution"""
+
+import os
+import numpy as np
+
+
+_images = {}
+_scaled = {}
+
+
+class Sprite:
+    """
+    RGBA sprite ready to be blended (see rocket_simulation.blend_sprite): the color channels are kept premultiplied by
+    the alpha and the inverse alpha (255 - alpha) is kept separately, so blending a pixel needs a single multiplication.
+    """
+
+    def __init__(self, rgba):
+        """
+        :param np.ndarray rgba: uint8 array of shape (height, width, 4) with the RGBA sprite
+        """
+
+        if not isinstance(rgba, np.ndarray) or rgba.ndim != 3 or rgba.shape[2] != 4:
+            raise TypeError('rgba must be a numpy array of shape (height, width, 4)')
+
+        alpha = rgba[..., 3:4].astype(np.uint16)
+        self.rgba = rgba
+        # all the 4 channels are premultiplied, so the sprite blends the same way into RGB and RGBA frames:
+        self.premultiplied = rgba.astype(np.uint16) * alpha
+        self.inverse_alpha = 255 - alpha
+
+    @property
+    def shape(self):
+        return self.rgba.shape
+
+    @property
+    def width(self):
+        return self.rgba.shape[1]
+
+    @property
+    def height(self):
+        return self.rgba.shape[0]
+
+
+def _read_only(array):
+    array.setflags(write=False)
+    return array
+
+
+def load_image(img_path, mode='RGBA'):
+    """
+    The function loads an image once per process, later calls return the same (read-only) array until the file
+    changes.
+    :param str img_path: path to the image
+    :param str mode: PIL mode the image is converted to, e.g. 'RGBA' or 'RGB'
+    :return: uint8 np.array of shape (height, width, channels)
+    """
+
+    if not isinstance(img_path, str):
+        raise TypeError('img_path must be a string')
+
+    key = (os.path.abspath(img_path), os.path.getmtime(img_path), mode)
+    if key not in _images:
+        # PIL is imported here, so that generating trajectories doesn't need the imaging libraries:
+        from PIL import Image
+
+        with Image.open(img_path) as img:
+            _images[key] = _read_only(np.asarray(img.convert(mode)).copy())
+
+    return _images[key]
+
+
+def resize_image(image, size):
+    """
+    The function resizes an image with bilinear filtering (the RGBA images are filtered with premultiplied alpha).
+    :param np.ndarray image: uint8 array of shape (height, width, channels)
+    :param tuple size: (width, height) of the resized image
+    :return: uint8 np.array of shape (height, width, channels), the image itself if it already has the size
+    """
+
+    if (image.shape[1], image.shape[0]) == tuple(size):
+        return image
+
+    from PIL import Image
+
+    return np.asarray(Image.fromarray(image).resize(size, Image.BILINEAR)).copy()
+
+
+def simulation_assets(background_img_path, rocket_img_path, image_size, rocket_width=100, rocket_height=50,
+                      mode='RGBA'):
+    """
+    The function returns the background scaled to image_size and the rocket scaled by the same factor. Both are loaded
+    and scaled once per process and arguments, so the frames can be rendered directly at the output (e.g. training)
+    resolution instead of being rendered at the full resolution and resized afterwards.
+    :param str background_img_path: the path to the image of the background
+    :param str rocket_img_path: the path to the image of the rocket
+    :param int image_size: size of the (square) rendered frames in pixels
+    :param int rocket_width: the width of the rocket in pixels of the full size background
+    :param int rocket_height: the height of the rocket in pixels of the full size background
+    :param str mode: 'RGBA' or 'RGB', the mode of the background (and of the rendered frames)
+    :return: background - read-only uint8 np.array of shape (image_size, image_size, channels), rocket - Sprite
+    """
+
+    if not isinstance(image_size, int) or image_size < 1:
+        raise TypeError('image_size must be a positive integer')
+    if mode not in ('RGBA', 'RGB'):
+        raise ValueError("mode must be 'RGBA' or 'RGB'")
+
+    key = (background_img_path, rocket_img_path, image_size, rocket_width, rocket_height, mode)
+    background = load_image(background_img_path, mode)
+    rocket = load_image(rocket_img_path, 'RGBA')
+    # the cached images are checked, so a changed file is scaled again:
+    if key not in _scaled or _scaled[key][0] is not background or _scaled[key][1] is not rocket:
+        scale = image_size / background.shape[1]
+        rocket_size = (max(1, round(rocket_width * scale)), max(1, round(rocket_height * scale)))
+        scaled_background = _read_only(resize_image(background, (image_size, image_size)))
+        scaled_rocket = Sprite(_read_only(resize_image(rocket, rocket_size)))
+        _scaled[key] = (background, rocket, scaled_background, scaled_rocket)
+
+    return _scaled[key][2:]
+
+
+class SpriteAtlas:
+    """
+    Sprites of a rocket rotated by n_angles angles and shifted by subpixels x subpixels sub-pixel offsets, rendered
+    once, so a rocket at any position and orientation is drawn by a lookup and a blend instead of a per-frame rotation.
+    The rocket of the source image points along the +x axis.
+    """
+
+    def __init__(self, rgba, scale=1., n_angles=32, subpixels=4):
+        """
+        :param np.ndarray rgba: uint8 array of shape (height, width, 4) with the RGBA rocket at the full resolution
+        :param float scale: factor the rotated rocket is scaled by (size of the frames / size of the full background)
+        :param int n_angles: number of the orientations over the full circle
+        :param int subpixels: number of the sub-pixel offsets along every axis
+        """
+
+        if not isinstance(n_angles, int) or n_angles < 1:
+            raise TypeError('n_angles must be a positive integer')
+        if not isinstance(subpixels, int) or subpixels < 1:
+            raise TypeError('subpixels must be a positive integer')
+
+        from PIL import Image
+
+        self.n_angles = n_angles
+        self.subpixels = subpixels
+        # sprites[angle][y offset][x offset] and the position of the center of the rocket in every sprite:
+        self.sprites = []
+        self.centers = []
+
+        # the premultiplied mode keeps the transparent pixels from bleeding into the edges of the rocket:
+        rocket = Image.fromarray(rgba).convert('RGBa')
+        for angle in range(n_angles):
+            rotated = rocket.rotate(360 * angle / n_angles, resample=Image.BICUBIC, expand=True)
+            width, height = rotated.size
+            # transparent margin, so the shifted boxes of resize stay inside the image:
+            margin = int(np.ceil(3 / scale)) + 1
+            padded = Image.new('RGBa', (width + 2 * margin, height + 2 * margin))
+            padded.paste(rotated, (margin, margin))
+
+            size = (int(np.ceil(width * scale)) + 2, int(np.ceil(height * scale)) + 2)
+            angle_sprites = []
+            for y_offset in np.arange(subpixels) / subpixels:
+                row = []
+                for x_offset in np.arange(subpixels) / subpixels:
+                    # the upper left corner of the rotated rocket lands at (x_offset, y_offset) of the sprite:
+                    left, top = margin - x_offset / scale, margin - y_offset / scale
+                    box = (left, top, left + size[0] / scale, top + size[1] / scale)
+                    sprite = padded.resize(size, Image.BILINEAR, box=box).convert('RGBA')
+                    row.append(Sprite(_read_only(np.asarray(sprite).copy())))
+                angle_sprites.append(row)
+            self.sprites.append(angle_sprites)
+            self.centers.append((width * scale / 2, height * scale / 2))
+
+    def lookup(self, x_center, y_center, angle):
+        """
+        The function chooses the sprite of the rocket at a position and orientation.
+        :param float x_center: x coordinate of the center of the rocket in pixels
+        :param float y_center: y coordinate of the center of the rocket in pixels
+        :param float angle: orientation of the rocket in radians, counterclockwise from the +x axis (as seen in the frame)
+        :return: sprite - Sprite, x_pos and y_pos - integer coordinates of the upper left corner of the sprite
+        """
+
+        index = int(round(angle * self.n_angles / (2 * np.pi))) % self.n_angles
+        x_center_offset, y_center_offset = self.centers[index]
+
+        x_corner = round((x_center - x_center_offset) * self.subpixels)
+        y_corner = round((y_center - y_center_offset) * self.subpixels)
+        x_pos, x_offset = divmod(x_corner, self.subpixels)
+        y_pos, y_offset = divmod(y_corner, self.subpixels)
+
+        return self.sprites[index][y_offset][x_offset], int(x_pos), int(y_pos)
+
+
+def simulation_atlas(background_img_path, rocket_img_path, image_size, rocket_width=100, rocket_height=50, n_angles=32,
+                     subpixels=4):
+    """
+    The function returns the SpriteAtlas of the rocket scaled the same way as by simulation_assets, it is built once
+    per process and arguments.
+    :param str background_img_path: the path to the image of the background
+    :param str rocket_img_path: the path to the image of the rocket
+    :param int image_size: size of the (square) rendered frames in pixels
+    :param int rocket_width: the width of the rocket in pixels of the full size background
+    :param int rocket_height: the height of the rocket in pixels of the full size background
+    :param int n_angles: number of the orientations over the full circle
+    :param int subpixels: number of the sub-pixel offsets along every axis
+    :return: SpriteAtlas
+    """
+
+    if not isinstance(image_size, int) or image_size < 1:
+        raise TypeError('image_size must be a positive integer')
+
+    key = ('atlas', background_img_path, rocket_img_path, image_size, rocket_width, rocket_height, n_angles, subpixels)
+    background = load_image(background_img_path, 'RGBA')
+    rocket = load_image(rocket_img_path, 'RGBA')
+    if key not in _scaled or _scaled[key][0] is not background or _scaled[key][1] is not rocket:
+        atlas = SpriteAtlas(resize_image(rocket, (rocket_width, rocket_height)), scale=image_size / background.shape[1],
+                            n_angles=n_angles, subpixels=subpixels)
+        _scaled[key] = (background, rocket, atlas)
+
+    return _scaled[key][2]
+
+
+def clear_cache():
+    """The function removes all the cached images"""
+
+    _images.clear()
+    _scaled.clear()
+
+
+'Usage example:'
+# background, rocket = simulation_assets('images/background.png', 'images/rocket.png', image_size=64, mode='RGB')
+# print(background.shape, rocket.shape)  # (64, 64, 3) (3, 6, 4)
+# atlas = simulation_atlas('images/background.png', 'images/rocket.png', image_size=64)
+# sprite, x_pos, y_pos = atlas.lookup(31.3, 20.7, angle=np.pi / 4)
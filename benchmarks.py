@@ -0,0 +1,387 @@
+"""Benchmarks of the simulation code"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from rocket_simulation import (FORCE_TYPES, INTEGRATORS, random_force_parameters, random_initial_pos, verlet_integration,
+                               state_integration, generate_trajectories, generate_trajectories_fast,
+                               generate_simulation_from_trajectory)
+from visualization import total_energy
+from trajectory_store import force_params
+from energy_diagnostics import energy_terms, drift_statistics
+from box_with_different_forces_simulation import simulate_movement, simulate_movement_fast
+from jit_kernels import NUMBA_AVAILABLE
+
+
+def best_time(function, repeats=3):
+    """
+    The function calls the function repeats times and measures the time of every call.
+    :param function: function without arguments
+    :param int repeats: number of timed calls
+    :return: the shortest time in seconds and the result of the last call
+    """
+
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), result
+
+
+def benchmark_integrators(integrators=INTEGRATORS, force_types=('gravity', 'magnetic_field', 'harmonic_oscillator'),
+                          time_steps=(0.1, 0.03, 0.01, 0.003), total_time=30, n_trajectories=5, box_size=10, seed=0,
+                          verbose=True):
+    """
+    The function measures the wall time of every integrator and the drift of the total energy of the generated
+    trajectories (the max_drift of energy_diagnostics.drift_statistics, the velocities are the central differences,
+    which are the velocities of the Verlet integrator) for every time step. All the integrators get the same initial
+    conditions and force parameters.
+    :param tuple integrators: integrators to compare (see rocket_simulation.INTEGRATORS)
+    :param tuple force_types: force types of the trajectories
+    :param tuple time_steps: time steps to check
+    :param float total_time: simulated time, every trajectory has total_time / time_step steps (unless the rocket
+    leaves the box earlier)
+    :param int n_trajectories: number of trajectories per force type
+    :param int box_size: size of the box the rocket is contained
+    :param int seed: seed of the initial conditions
+    :param bool verbose: if True print the results as a table
+    :return: list of dictionaries with integrator, force_type, time_step, seconds and median_drift
+    """
+
+    results = []
+    for force_type in force_types:
+        for time_step in time_steps:
+            max_simul_steps = int(round(total_time / time_step))
+
+            # The same parameters for all the integrators:
+            initial_conditions = []
+            for n in range(n_trajectories):
+                rng = np.random.default_rng([seed, n])
+                params = random_force_parameters(box_size, rng=rng)
+                position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
+                                              high_starting_position_limit=0.6, low_starting_velocity_limit=-1,
+                                              high_starting_velocity_limit=1, time_step=time_step, rng=rng)
+                initial_conditions.append((position, params))
+
+            for integrator in integrators:
+                seconds, drifts = 0., []
+                for position, params in initial_conditions:
+                    start_time = time.perf_counter()
+                    if integrator == 'verlet':
+                        trajectory = verlet_integration(force_type, position, time_step, max_simul_steps, box_size,
+                                                        1, *params)
+                    else:
+                        trajectory = state_integration(force_type, position, time_step, max_simul_steps, box_size,
+                                                       1, *params, integrator=integrator)
+                    seconds += time.perf_counter() - start_time
+
+                    record = force_params(force_type, position, *params, time_step=time_step, box_size=box_size)[None]
+                    _, _, energy = energy_terms(trajectory, [len(trajectory)], record)
+                    drifts.append(drift_statistics(energy, [len(trajectory)], record)['max_drift'][0])
+
+                results.append({'integrator': integrator, 'force_type': force_type, 'time_step': time_step,
+                                'seconds': seconds, 'median_drift': float(np.nanmedian(drifts))})
+
+    if verbose:
+        print(f"{'integrator':<16}{'force_type':<21}{'time_step':>10}{'seconds':>10}{'median_drift':>14}")
+        for result in results:
+            print(f"{result['integrator']:<16}{result['force_type']:<21}{result['time_step']:>10}"
+                  f"{result['seconds']:>10.4f}{result['median_drift']:>14.3e}")
+
+    return results
+
+
+def benchmark_jit(max_simul_steps=100000, num_iterations=100000, repeats=3, seed=0, verbose=True):
+    """
+    The function compares the numba compiled step kernels with their pure Python versions (see jit_kernels) on
+    rocket_simulation.verlet_integration for every force type and box_with_different_forces_simulation
+    .simulate_movement_fast. The first (compiling or loading from cache) call of the numba kernels is not timed.
+    :param int max_simul_steps: number of steps of the rocket trajectories
+    :param int num_iterations: number of steps of the box simulation
+    :param int repeats: number of timed repeats, the best time is reported
+    :param int seed: seed of the initial conditions
+    :param bool verbose: if True print the results as a table
+    :return: list of dictionaries with the name of the case, python_seconds, jit_seconds and identical (True if both
+    paths gave the same result)
+    """
+
+    if not NUMBA_AVAILABLE:
+        raise ImportError('numba is not installed, there is no jit path to compare with')
+
+    rng = np.random.default_rng(seed)
+    params = random_force_parameters(1000, rng=rng)
+    # a large box, so that the rockets don't leave it before the end of the simulation:
+    position = random_initial_pos(box_size=1000, low_starting_position_limit=0.3, high_starting_position_limit=0.6,
+                                  low_starting_velocity_limit=-1, high_starting_velocity_limit=1, time_step=0.01,
+                                  rng=rng)
+
+    cases = {}
+    for force_type in FORCE_TYPES:
+        cases[force_type] = lambda use_jit, force_type=force_type: verlet_integration(
+            force_type, position, 0.01, max_simul_steps, 1000, 1, *params, use_jit=use_jit)
+
+    velocity_0 = 4 * np.array([[5, 1]])
+
+    def box_case(use_jit):
+        np.random.seed(seed)
+        return np.stack(simulate_movement_fast(num_iterations, velocity_0, 10, 0.01, use_jit=use_jit))
+
+    cases['box_simulate_movement'] = box_case
+
+    results = []
+    for name, case in cases.items():
+        case(True)
+        python_seconds, python_result = best_time(lambda: case(False), repeats)
+        jit_seconds, jit_result = best_time(lambda: case(True), repeats)
+        results.append({'name': name, 'python_seconds': python_seconds, 'jit_seconds': jit_seconds,
+                        'identical': bool(np.array_equal(python_result, jit_result))})
+
+    if verbose:
+        print(f"{'case':<24}{'python [s]':>12}{'jit [s]':>12}{'speedup':>10}{'identical':>11}")
+        for result in results:
+            print(f"{result['name']:<24}{result['python_seconds']:>12.4f}{result['jit_seconds']:>12.5f}"
+                  f"{result['python_seconds'] / result['jit_seconds']:>10.1f}{str(result['identical']):>11}")
+
+    return results
+
+
+# Dependencies which should be imported only by the functions that need them:
+HEAVY_MODULES = ('numba', 'matplotlib', 'torch', 'torchvision', 'imageio', 'PIL', 'tkinter')
+
+
+def benchmark_imports(modules=('rocket_simulation', 'box_with_different_forces_simulation', 'dataset_generation',
+                               'trajectory_store', 'animation', 'visualization', 'datasets'), repeats=3,
+                      verbose=True):
+    """
+    The function measures the time of importing every module in a fresh Python interpreter (so nothing is imported
+    already) and lists the heavy dependencies (HEAVY_MODULES) the import pulled in.
+    :param tuple modules: names of the modules to import
+    :param int repeats: number of timed imports of every module, the best time is reported
+    :param bool verbose: if True print the results as a table
+    :return: list of dictionaries with module, seconds and heavy_modules
+    """
+
+    script = ('import sys, time; start_time = time.perf_counter(); import {module}; '
+              'seconds = time.perf_counter() - start_time; '
+              'print(seconds, *[m for m in {heavy} if m in sys.modules])')
+
+    results = []
+    for module in modules:
+        times, heavy_modules = [], []
+        for _ in range(repeats):
+            output = subprocess.run([sys.executable, '-c', script.format(module=module, heavy=HEAVY_MODULES)],
+                                    capture_output=True, text=True, check=True).stdout.split()
+            times.append(float(output[0]))
+            heavy_modules = output[1:]
+        results.append({'module': module, 'seconds': min(times), 'heavy_modules': heavy_modules})
+
+    if verbose:
+        print(f"{'module':<40}{'import [s]':>12}  heavy dependencies")
+        for result in results:
+            print(f"{result['module']:<40}{result['seconds']:>12.3f}  {', '.join(result['heavy_modules']) or '-'}")
+
+    return results
+
+
+def benchmark_suite(repeats=3, seed=0, step_counts=(300, 3000, 30000), legacy_max_steps=3000, frames_number=30,
+                    verbose=True):
+    """
+    The function measures the hot paths of the project: generating trajectories (generate_trajectories and
+    generate_trajectories_fast for every force type and number of steps), simulate_movement (and simulate_movement_fast)
+    of box_with_different_forces_simulation, rendering simulations with generate_simulation_from_trajectory,
+    loading samples with datasets.ImageDataset (skipped if torch is not installed) and total_energy. All the inputs
+    are generated from fixed seeds, so the results of different commits can be compared (see compare_results).
+    :param int repeats: number of timed repeats of every case (after one untimed call), the best time is reported
+    :param int seed: seed of the inputs
+    :param tuple step_counts: numbers of steps of the generated trajectories
+    :param int legacy_max_steps: largest number of steps timed for generate_trajectories (it grows the trajectory with
+    np.append, so its time is quadratic in the number of steps and the longer runs would take most of the suite)
+    :param int frames_number: number of frames of the rendered simulation
+    :param bool verbose: if True print the results as a table
+    :return: dictionary {case name: {'seconds': best time, 'items': number of processed items, 'unit': name of the
+    items, 'per_second': items per second}}
+    """
+
+    results = {}
+
+    def record(name, function, items, unit):
+        # an untimed call first, so that loading the compiled kernels and the caches is not measured:
+        function()
+        seconds, result = best_time(function, repeats)
+        results[name] = {'seconds': seconds, 'items': items, 'unit': unit,
+                         'per_second': items / seconds if seconds > 0 else float('inf')}
+        return result
+
+    # A large box, so that the rockets don't leave it before the end of the simulation:
+    for force_type in FORCE_TYPES:
+        for steps in step_counts:
+            if steps <= legacy_max_steps:
+                def generate(force_type=force_type, steps=steps):
+                    np.random.seed(seed)
+                    return generate_trajectories(force_type, time_step=0.01, max_simul_steps=steps, box_size=100000)
+                record(f'generate_trajectories/{force_type}/{steps}', generate, steps, 'steps')
+
+            record(f'generate_trajectories_fast/{force_type}/{steps}',
+                   lambda force_type=force_type, steps=steps: generate_trajectories_fast(
+                       force_type, time_step=0.01, max_simul_steps=steps, box_size=100000,
+                       rng=np.random.default_rng(seed)), steps, 'steps')
+
+    velocity_0 = 4 * np.array([[5, 1]])
+
+    def box_simulation(function, num_iterations):
+        np.random.seed(seed)
+        return function(num_iterations, velocity_0, 10, 0.01)
+
+    record('simulate_movement/1000', lambda: box_simulation(simulate_movement, 1000), 1000, 'steps')
+    record('simulate_movement_fast/100000', lambda: box_simulation(simulate_movement_fast, 100000), 100000, 'steps')
+
+    # total_energy of a trajectory of every force type:
+    for force_type in FORCE_TYPES:
+        (x, y), info_dict = generate_trajectories_fast(force_type, time_step=0.01, max_simul_steps=step_counts[-1],
+                                                       box_size=100000, rng=np.random.default_rng(seed))
+        record(f'total_energy/{force_type}', lambda info_dict=info_dict, x=x, y=y: total_energy(info_dict, x, y),
+               len(x), 'steps')
+
+    # Rendering, the simulation directories are made in a temporary directory:
+    (x, y), info_dict = generate_trajectories_fast('harmonic_oscillator', time_step=0.01, max_simul_steps=3000,
+                                                   box_size=10, rng=np.random.default_rng(seed))
+    with tempfile.TemporaryDirectory() as save_path:
+        counter = iter(range(10 ** 6))
+
+        def render(**kwargs):
+            return generate_simulation_from_trajectory(x, y, 10, save_path, 'harmonic', f'harmonic_{next(counter)}',
+                                                       frames_number=frames_number, info_dict=info_dict, **kwargs)
+
+        frames = render(save_frames=False)
+        record('render/in_memory', lambda: render(save_frames=False, return_frames=True), frames, 'frames')
+        record('render/png', lambda: render(save_frames=True), frames, 'frames')
+        record('render/gif', lambda: render(save_frames=False, make_gif=True), frames, 'frames')
+
+        try:
+            from torchvision import transforms
+            from datasets import ImageDataset
+        except ImportError:
+            transforms = None
+        if transforms is not None:
+            directory = os.path.join(save_path, 'harmonic_dataset')
+            generate_simulation_from_trajectory(x, y, 10, save_path, 'harmonic', 'harmonic_dataset',
+                                                frames_number=frames_number, info_dict=info_dict)
+            directory = os.path.join(directory, 'simulation_snapshots')
+            transform = transforms.Compose([transforms.Resize((64, 64)), transforms.ToTensor()])
+
+            def load_all(dataset):
+                return [dataset[i] for i in range(len(dataset))]
+
+            dataset = ImageDataset(directory, transform=transform)
+            record('image_dataset/decode', lambda: load_all(dataset), len(dataset), 'samples')
+            dataset = ImageDataset(directory, transform=transform, cache=True)
+            record('image_dataset/cached', lambda: load_all(dataset), len(dataset), 'samples')
+
+    if verbose:
+        print(f"{'case':<56}{'seconds':>12}{'per second':>14}  unit")
+        for name, result in results.items():
+            print(f"{name:<56}{result['seconds']:>12.5f}{result['per_second']:>14.1f}  {result['unit']}")
+
+    return results
+
+
+def environment_info():
+    """
+    The function describes the environment of a benchmark run, so that the saved results can be compared fairly.
+    :return: dictionary with the git commit, the versions of Python and numpy, the platform and the time of the run
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+            'numba': NUMBA_AVAILABLE, 'platform': platform.platform(), 'processor': platform.processor(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def save_results(results, path):
+    """
+    The function saves the results of benchmark_suite with the description of the environment as a JSON file.
+    :param dict results: the results of benchmark_suite
+    :param str path: path of the JSON file
+    """
+
+    with open(path, 'w') as json_file:
+        json.dump({'environment': environment_info(), 'results': results}, json_file, indent=2)
+
+
+def compare_results(baseline_path, path, threshold=0.1, verbose=True):
+    """
+    The function compares two JSON files saved by save_results (e.g. of two commits). A case is a regression if its
+    time grew by more than the threshold and an improvement if it dropped by more than the threshold.
+    :param str baseline_path: path of the results of the baseline
+    :param str path: path of the new results
+    :param float threshold: relative change of time treated as significant
+    :param bool verbose: if True print the comparison as a table
+    :return: list of dictionaries with name, baseline_seconds, seconds, ratio (new time / baseline time) and status
+    ('regression', 'improvement' or 'same')
+    """
+
+    with open(baseline_path, 'r') as json_file:
+        baseline = json.load(json_file)
+    with open(path, 'r') as json_file:
+        new = json.load(json_file)
+
+    comparison = []
+    for name, result in new['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['seconds'] / max(baseline['results'][name]['seconds'], 1e-12)
+        status = 'regression' if ratio > 1 + threshold else 'improvement' if ratio < 1 - threshold else 'same'
+        comparison.append({'name': name, 'baseline_seconds': baseline['results'][name]['seconds'],
+                           'seconds': result['seconds'], 'ratio': ratio, 'status': status})
+
+    if verbose:
+        print(f"baseline: {baseline['environment']['commit']}, new: {new['environment']['commit']}")
+        print(f"{'case':<56}{'baseline [s]':>14}{'new [s]':>12}{'ratio':>8}  status")
+        for result in comparison:
+            print(f"{result['name']:<56}{result['baseline_seconds']:>14.5f}{result['seconds']:>12.5f}"
+                  f"{result['ratio']:>8.2f}  {result['status']}")
+
+    return comparison
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks of the simulation code')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    suite = subparsers.add_parser('suite', help='benchmark the hot paths and optionally save the results')
+    suite.add_argument('-o', '--output', default=None, help='path of the JSON file with the results')
+    suite.add_argument('--repeats', type=int, default=3)
+    suite.add_argument('--seed', type=int, default=0)
+    compare = subparsers.add_parser('compare', help='compare two JSON files saved by the suite')
+    compare.add_argument('baseline')
+    compare.add_argument('new')
+    compare.add_argument('--threshold', type=float, default=0.1)
+    subparsers.add_parser('integrators', help='time and energy drift of the integrators')
+    subparsers.add_parser('jit', help='numba kernels against the pure Python ones')
+    subparsers.add_parser('imports', help='import time of the modules')
+    args = parser.parse_args()
+
+    if args.command == 'suite':
+        suite_results = benchmark_suite(repeats=args.repeats, seed=args.seed)
+        if args.output:
+            save_results(suite_results, args.output)
+    elif args.command == 'compare':
+        compare_results(args.baseline, args.new, threshold=args.threshold)
+    elif args.command == 'integrators':
+        benchmark_integrators()
+    elif args.command == 'jit':
+        benchmark_jit()
+    else:
+        benchmark_imports()
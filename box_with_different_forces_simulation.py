@@ -1,4 +1,5 @@
 import numpy as np
+from jit_kernels import NUMBA_AVAILABLE, box_kernel, box_kernel_py
 
 
 dimension = 2  # we work in 2D
@@ -94,6 +95,189 @@ def simulate_movement(num_iterations, velocity_0, box_size, dt):
     return position[:, 0], position[:, 1]
 
 
+def force_lookup_tables(box_size):
+    """
+    The function precomputes the parameters of the forces of the four quadrants of the box (the same forces as in the
+    force function) into lookup tables. The force acting on a ball in the region i is:
+    constant[i] - spring[i] * (position - center[i]) + magnetic[i] * [velocity[1], - velocity[0]]
+    The regions are numbered: 0 - left lower corner, 1 - right lower corner, 2 - left upper corner, 3 - right upper
+    corner (see region_index).
+    :param box_size: size of the square box the ball is moving in (float)
+    :return: constant - np.array of shape (4, dimension), spring - np.array of shape (4,), center - np.array of shape
+    (4, dimension), magnetic - np.array of shape (4,)
+    """
+    global dimension, m, q
+
+    constant = np.zeros((4, dimension))
+    spring = np.zeros(4)
+    center = np.zeros((4, dimension))
+    magnetic = np.zeros(4)
+
+    # left lower corner: Lorentz force with B_z = 1 and E = [5, -10]
+    constant[0] = q * np.array([5, -10])
+    magnetic[0] = q * 1
+
+    # left upper corner: gravity with g = [10, -5]
+    constant[2] = m * np.array([10, -5])
+
+    # right upper corner: spring with k = 1 centered at the right upper corner of the box
+    spring[3] = 1
+    center[3] = [box_size, box_size]
+
+    return constant, spring, center, magnetic
+
+
+def region_index(position, box_size):
+    """
+    The function finds the quadrant of the box the ball (or balls) is in. The points lying exactly on the borders of the
+    quadrants (for which force returns None) belong to the quadrant with the larger coordinate, i.e. x = box_size / 2
+    belongs to the right half and y = box_size / 2 to the upper half.
+    :param position: np.array of shape (..., dimension) with the positions of the balls
+    :param box_size: size of the square box the ball is moving in (float)
+    :return: np.array of shape (...) with indices of the regions (see force_lookup_tables)
+    """
+
+    return (position[..., 0] >= box_size / 2).astype(int) + 2 * (position[..., 1] >= box_size / 2)
+
+
+def simulate_movement_batch(num_iterations, velocities_0, box_size, dt, rng=None):
+    """
+    Function simulates movement of many balls inside a box at once. It gives the same results as simulate_movement
+    (for every ball), but the forces are taken from the lookup tables of force_lookup_tables and all the balls are
+    moved in one numpy operation per step.
+
+    :param num_iterations: number of simulation iterations (int)
+    :param velocities_0: starting velocities of the balls in form of a numpy array of shape (number of balls, 2)
+    :param box_size: size of the square box the ball is moving in (float)
+    :param dt: time step between each simulation iteration (float)
+    :param rng: np.random.Generator used to draw the starting positions, if None the global np.random is used
+    :return: np.array of shape (number of balls, num_iterations, dimension) with the coordinates of the balls
+    """
+
+    global dimension, m
+
+    # checking whether the variables given are correct
+    if not isinstance(velocities_0, np.ndarray):
+        raise TypeError("velocities_0 must be a numpy array")
+    assert velocities_0.ndim == 2 and velocities_0.shape[1] == dimension and 'velocities_0 must be of shape (n, 2)'
+    if not isinstance(num_iterations, int):
+        raise TypeError("num_iterations must be an integer")
+    if not isinstance(box_size, float) and not isinstance(box_size, int):
+        raise TypeError("box_size must be a float or an integer")
+    if not isinstance(dt, float):
+        raise TypeError("dt must be a float")
+
+    if rng is None:
+        rng = np.random
+
+    constant, spring, center, magnetic = force_lookup_tables(box_size)
+    balls = np.arange(len(velocities_0))
+
+    # generating starting postions and position array:
+    position = np.zeros((len(velocities_0), num_iterations, dimension))
+    position[:, 1] = 0.1 * box_size + rng.random((len(velocities_0), dimension)) * 0.8 * box_size
+    position[:, 0] = position[:, 1] - velocities_0 * dt
+
+    # simulating the movement:
+    for i in range(0, num_iterations - 2):
+        current, previous = position[:, i + 1], position[:, i]
+        region = region_index(current, box_size)
+        velocity = (current - previous) / (2 * dt)
+        force = (constant[region] - spring[region][:, None] * (current - center[region]) +
+                 magnetic[region][:, None] * np.stack([velocity[:, 1], - velocity[:, 0]], axis=1))
+        position[:, i + 2] = 2 * current - previous + force * dt ** 2 / m
+
+        # checking for collisions of the balls with the boundaries of the box
+        collision = (position[:, i + 2] < 0) | (position[:, i + 2] > box_size)
+        if collision.any():
+            position[:, i + 2] = np.where(collision, current - velocity * dt, position[:, i + 2])
+
+    return position
+
+
+def simulate_movement_fast(num_iterations, velocity_0, box_size, dt, use_jit=None):
+    """
+    Function simulates movement of a ball inside a box in the same way as simulate_movement, but the stepping loop runs
+    in jit_kernels.box_kernel (compiled with numba if it is installed) with the forces taken from force_lookup_tables.
+
+    :param num_iterations: number of simulation iterations (int)
+    :param velocity_0: starting velocity of the ball in form of a numpy array of shape (1,2)
+    :param box_size: size of the square box the ball is moving in (float)
+    :param dt: time step between each simulation iteration (float)
+    :param use_jit: if None the numba kernel is used when numba is installed, if False the pure Python kernel is used,
+    if True the numba kernel is required
+    :return: x and y np.arrays which are ball coordinates
+    """
+
+    global dimension, m
+
+    # checking whether the variables given are correct
+    if not isinstance(velocity_0, np.ndarray):
+        raise TypeError("velovity_0 must be a numpy array")
+    assert velocity_0.shape == (1, 2)
+    if not isinstance(num_iterations, int):
+        raise TypeError("num_iterations must be an integer")
+    if not isinstance(box_size, float) and not isinstance(box_size, int):
+        raise TypeError("box_size must be a float or an integer")
+    if not isinstance(dt, float):
+        raise TypeError("dt must be a float")
+    if use_jit and not NUMBA_AVAILABLE:
+        raise ImportError('use_jit=True requires numba to be installed')
+
+    # generating starting postions and position array:
+    position = np.zeros((num_iterations, dimension))
+    position[1] = 0.1 * box_size + np.random.random(dimension) * 0.8 * box_size  # starting position is random
+    position[0] = position[1] - velocity_0 * dt
+
+    kernel = box_kernel if (use_jit is None or use_jit) else box_kernel_py
+    kernel(position, float(box_size), dt, float(m), *force_lookup_tables(box_size))
+
+    return position[:, 0], position[:, 1]
+
+
+def iter_movement_chunks(num_iterations, position, box_size, dt, chunk_size=65536, resume=False, use_jit=None):
+    """
+    Generator simulating movement of a ball inside a box in the same way as simulate_movement_fast, but yielding the
+    coordinates in chunks of at most chunk_size steps, so the memory used doesn't depend on the length of the run. An
+    interrupted run can be continued by passing the last two yielded positions as position with resume=True.
+
+    :param num_iterations: number of simulation iterations after the two given positions (int)
+    :param position: two first positions of the ball (or the last two positions of the interrupted run) in form of a
+    numpy array of shape (2, 2)
+    :param box_size: size of the square box the ball is moving in (float)
+    :param dt: time step between each simulation iteration (float)
+    :param chunk_size: maximum number of steps in a chunk (int)
+    :param resume: if False the first chunk starts with the two given positions, if True they are not yielded again
+    :param use_jit: see simulate_movement_fast
+    :return: generator of np.arrays of shape (k, dimension) with consecutive positions of the ball
+    """
+
+    global m
+
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise TypeError("chunk_size must be a positive integer")
+    if use_jit and not NUMBA_AVAILABLE:
+        raise ImportError('use_jit=True requires numba to be installed')
+
+    kernel = box_kernel if (use_jit is None or use_jit) else box_kernel_py
+    tables = force_lookup_tables(box_size)
+
+    if not resume:
+        yield np.array(position[:2], dtype=float)
+
+    last_positions = np.array(position[:2], dtype=float)
+    steps_left = num_iterations
+    while steps_left > 0:
+        steps = min(chunk_size, steps_left)
+        buffer = np.empty((steps + 2, dimension))
+        buffer[:2] = last_positions
+        kernel(buffer, float(box_size), dt, float(m), *tables)
+        yield buffer[2:]
+
+        last_positions = buffer[-2:].copy()
+        steps_left -= steps
+
+
 '''Example code:
 import time as time
 from animation import animate_movement
@@ -107,4 +291,8 @@ end_time = time.time()
 print(f"Execution time: {round(end_time - start_time, 3)} seconds")
 
 animate_movement(x, y)
+
+# sweeping many initial velocities at once:
+velocities_0 = 20 * np.random.random((1000, 2)) - 10
+positions = simulate_movement_batch(1000, velocities_0, box_size=10, dt=0.01)
 '''
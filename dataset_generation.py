@@ -0,0 +1,388 @@
+"""Scripts for generating whole datasets of simulations in parallel"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import numpy as np
+import profiling
+from rocket_simulation import (FORCE_TYPES, INTEGRATORS, ROCKET_IMG_PATH, BACKGROUND_IMG_PATH,
+                               generate_trajectories_fast, generate_simulation_from_trajectory, is_simulation_complete)
+from trajectory_store import TrajectoryStore, force_params, params_to_info_dict
+
+
+def simulation_tasks(n_simulations, force_types=FORCE_TYPES, master_seed=0):
+    """
+    The function creates the list of independent simulation tasks. Every task gets its own seed spawned from the
+    master_seed, so the result of a task does not depend on which worker runs it or in which order.
+    :param int n_simulations: number of simulations in the dataset
+    :param tuple force_types: force types of the simulations, the simulations cycle through them
+    :param int master_seed: seed from which the seeds of all the tasks are derived
+    :return: list of (index, force_type, seed) tuples where seed is np.random.SeedSequence
+    """
+
+    # Checking whether the variables given are correct
+    if not isinstance(n_simulations, int) or n_simulations < 0:
+        raise TypeError('n_simulations must be a non-negative integer')
+    if not isinstance(master_seed, int):
+        raise TypeError('master_seed must be an int')
+    for force_type in force_types:
+        assert force_type in FORCE_TYPES and ('force_types have to be from (\'no_force\', \'gravity\', '
+                                              '\'magnetic_field\', \'harmonic_oscillator\')')
+
+    seeds = np.random.SeedSequence(master_seed).spawn(n_simulations)
+
+    return [(index, force_types[index % len(force_types)], seeds[index]) for index in range(n_simulations)]
+
+
+def profiled_task(worker, task, trace=True):
+    """
+    The function runs the worker on a task in a worker process with the profiling enabled.
+    :param bool trace: if True the trace events are recorded too (profiling.TRACE of the main process)
+    :return: the result of the worker and the profiling data recorded while it was running (see profiling.snapshot)
+    """
+
+    profiling.enable(trace=trace)
+    profiling.reset()
+    result = worker(task)
+    return result, profiling.snapshot()
+
+
+def iter_tasks(worker, tasks, n_workers=None, chunk_size=8, progress_every=0, name='simulations'):
+    """
+    The generator runs the worker on every task using a pool of processes (or in the current process if n_workers is 1)
+    and yields the results in the order of the tasks as soon as they are ready. It prints the progress and the
+    throughput every progress_every finished tasks.
+    :param worker: picklable function of a single task
+    :param list tasks: the tasks
+    :param None or int n_workers: number of worker processes, if None os.cpu_count() is used
+    :param int chunk_size: number of tasks sent to a worker at once
+    :param int progress_every: print the progress every progress_every finished tasks, 0 - never
+    :param str name: name of the tasks used in the progress messages
+    :return: generator of the results of the worker in the order of the tasks
+    """
+
+    if n_workers is not None and (not isinstance(n_workers, int) or n_workers < 1):
+        raise TypeError('n_workers must be a positive integer or None')
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise TypeError('chunk_size must be a positive integer')
+
+    start_time = time.perf_counter()
+
+    def with_progress(results):
+        for done, result in enumerate(results, 1):
+            yield result
+            if progress_every and (done % progress_every == 0 or done == len(tasks)):
+                elapsed_time = time.perf_counter() - start_time
+                rate = done / elapsed_time if elapsed_time > 0 else float('inf')
+                print(f'{done}/{len(tasks)} {name}, {rate:.1f} {name}/s, eta {(len(tasks) - done) / rate:.0f} s',
+                      flush=True)
+
+    if n_workers == 1:
+        yield from with_progress(map(worker, tasks))
+    elif profiling.ENABLED:
+        # the profiling data of the workers are merged into the data of this process:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for result, data in with_progress(executor.map(partial(profiled_task, worker, trace=profiling.TRACE), tasks,
+                                                           chunksize=chunk_size)):
+                profiling.merge(data)
+                yield result
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            yield from with_progress(executor.map(worker, tasks, chunksize=chunk_size))
+
+
+def run_tasks(worker, tasks, n_workers=None, chunk_size=8, progress_every=0, name='simulations'):
+    """
+    The function runs the worker on every task (see iter_tasks) and collects the results.
+    :return: list of the results of the worker in the order of the tasks
+    """
+
+    return list(iter_tasks(worker, tasks, n_workers=n_workers, chunk_size=chunk_size, progress_every=progress_every,
+                           name=name))
+
+
+def run_simulation_task(task, save_path, time_step=0.01, max_simul_steps=3000, box_size=10, frames_number=30,
+                        image_size=1000, oriented=False, make_gif=False, save_frames=True, save_array=False,
+                        save_indexed=False, save_video=False, resume=False, rocket_img_path=ROCKET_IMG_PATH,
+                        background_img_path=BACKGROUND_IMG_PATH):
+    """
+    The function generates a single trajectory with its own random generator and saves its simulation in the
+    directory save_path/<force_type>_<index>.
+    :param tuple task: (index, force_type, seed) tuple created by simulation_tasks
+    :param str save_path: the path to the folder where the simulation directories are created
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param int frames_number: number of frames of the simulation
+    :param int image_size: size of the (square) frames in pixels
+    :param bool oriented: if True the rocket is rotated along its velocity with a sub-pixel placement
+    :param bool make_gif: if True make also a gif of each simulation
+    :param bool save_frames: if True save every frame as a png
+    :param bool save_array: if True save all the frames as a single .npy array
+    :param bool save_indexed: if True save all the frames as a compact palette-indexed .npz array
+    :param bool save_video: if True make also an .mp4 video of the simulation
+    :param bool resume: if True skip the simulation if its directory is already complete (see
+    rocket_simulation.generate_simulation_from_trajectory)
+    :param str rocket_img_path: the path to the image of the rocket
+    :param str background_img_path: the path to the image of the background
+    :return: number of frames of the simulation
+    """
+
+    index, force_type, seed = task
+    rng = np.random.default_rng(seed)
+
+    (x, y), info_dict = generate_trajectories_fast(force_type, time_step=time_step, max_simul_steps=max_simul_steps,
+                                                   box_size=box_size, rng=rng)
+
+    return generate_simulation_from_trajectory(x, y, box_size, save_path, force_type, f'{force_type}_{index}',
+                                               background_img_size=image_size, oriented=oriented, make_gif=make_gif,
+                                               frames_number=frames_number, info_dict=info_dict,
+                                               save_frames=save_frames, save_array=save_array,
+                                               save_indexed=save_indexed, save_video=save_video, resume=resume,
+                                               rocket_img_path=rocket_img_path,
+                                               background_img_path=background_img_path)
+
+
+def generate_dataset(save_path, n_simulations, force_types=FORCE_TYPES, master_seed=0, n_workers=None, chunk_size=8,
+                     time_step=0.01, max_simul_steps=3000, box_size=10, frames_number=30, image_size=1000,
+                     oriented=False, make_gif=False, save_frames=True, save_array=False, save_indexed=False,
+                     save_video=False, resume=False, progress_every=0, verbose=True, rocket_img_path=ROCKET_IMG_PATH,
+                     background_img_path=BACKGROUND_IMG_PATH):
+    """
+    The function generates a dataset of n_simulations simulations using a pool of processes. The output is identical
+    regardless of n_workers and chunk_size, because every simulation has its own seed derived from master_seed.
+    :param str save_path: the path to the folder where the simulation directories are created
+    :param int n_simulations: number of simulations in the dataset
+    :param tuple force_types: force types of the simulations, the simulations cycle through them
+    :param int master_seed: seed from which the seeds of all the simulations are derived
+    :param None or int n_workers: number of worker processes, if None os.cpu_count() is used, if 1 the simulations are
+    generated in the current process
+    :param int chunk_size: number of simulations sent to a worker at once
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param int frames_number: number of frames of each simulation
+    :param int image_size: size of the (square) frames in pixels, e.g. the training resolution
+    :param bool oriented: if True the rocket is rotated along its velocity with a sub-pixel placement
+    :param bool make_gif: if True make also a gif of each simulation
+    :param bool save_frames: if True save every frame as a png
+    :param bool save_array: if True save all the frames of a simulation as a single .npy array
+    :param bool save_indexed: if True save all the frames of a simulation as a compact palette-indexed .npz array
+    :param bool save_video: if True make also an .mp4 video of each simulation
+    :param bool resume: if True the simulations whose directories are already complete are skipped, so an interrupted
+    run can be continued (the seeds don't depend on the run, so the result is the same as of an uninterrupted run)
+    :param int progress_every: print the progress every progress_every simulations, 0 - never
+    :param bool verbose: if True print the throughput after the dataset is generated
+    :param str rocket_img_path: the path to the image of the rocket
+    :param str background_img_path: the path to the image of the background
+    :return: dictionary with the number of generated and skipped simulations and frames, time and throughput
+    """
+
+    # Checking whether the variables given are correct
+    if not isinstance(save_path, str):
+        raise TypeError('save_path must be a string')
+
+    tasks = simulation_tasks(n_simulations, force_types=force_types, master_seed=master_seed)
+    n_tasks = len(tasks)
+    if resume:
+        tasks = [task for task in tasks
+                 if not is_simulation_complete(os.path.join(save_path, f'{task[1]}_{task[0]}'))]
+    worker = partial(run_simulation_task, save_path=save_path, time_step=time_step, max_simul_steps=max_simul_steps,
+                     box_size=box_size, frames_number=frames_number, image_size=image_size, oriented=oriented,
+                     make_gif=make_gif, save_frames=save_frames, save_array=save_array, save_indexed=save_indexed,
+                     save_video=save_video, resume=resume, rocket_img_path=rocket_img_path,
+                     background_img_path=background_img_path)
+
+    os.makedirs(save_path, exist_ok=True)
+
+    start_time = time.perf_counter()
+    frames = run_tasks(worker, tasks, n_workers=n_workers, chunk_size=chunk_size, progress_every=progress_every)
+    elapsed_time = time.perf_counter() - start_time
+
+    stats = {'simulations': len(tasks), 'skipped': n_tasks - len(tasks), 'frames': int(sum(frames)),
+             'seconds': elapsed_time,
+             'trajectories_per_s': len(tasks) / elapsed_time if elapsed_time > 0 else float('inf'),
+             'frames_per_s': sum(frames) / elapsed_time if elapsed_time > 0 else float('inf')}
+
+    if verbose:
+        print(f"Generated {stats['simulations']} simulations ({stats['frames']} frames) in {elapsed_time:.2f} s: "
+              f"{stats['trajectories_per_s']:.1f} trajectories/s, {stats['frames_per_s']:.1f} frames/s"
+              + (f", skipped {stats['skipped']} complete simulations" if stats['skipped'] else ''))
+
+    return stats
+
+
+def generate_trajectory_task(task, time_step=0.01, max_simul_steps=3000, box_size=10, integrator='verlet'):
+    """
+    The function generates a single trajectory with its own random generator (see simulation_tasks).
+    :param tuple task: (index, force_type, seed) tuple created by simulation_tasks
+    :param float time_step: the time step used in the integration
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param str integrator: one of rocket_simulation.INTEGRATORS
+    :return: np.array of shape (2, number of steps) with the trajectory and its trajectory_store.PARAMS_DTYPE record
+    (made from the float parameters, see trajectory_store.force_params)
+    """
+
+    index, force_type, seed = task
+    rng = np.random.default_rng(seed)
+
+    position, _, params = generate_trajectories_fast(force_type, time_step=time_step, max_simul_steps=max_simul_steps,
+                                                     box_size=box_size, rng=rng, integrator=integrator,
+                                                     return_params=True)
+
+    return position, force_params(force_type, *params, time_step=time_step, box_size=box_size)
+
+
+def generate_store(store_directory, n_trajectories, force_types=FORCE_TYPES, master_seed=0, n_workers=1,
+                   chunk_size=64, time_step=0.01, max_simul_steps=3000, box_size=10, integrator='verlet',
+                   progress_every=0, verbose=True):
+    """
+    The function generates n_trajectories trajectories (without rendering) into a trajectory_store.TrajectoryStore.
+    The trajectories are appended in the order of their indices, so if the store already has some trajectories (e.g.
+    from an interrupted run with the same arguments) the generation resumes after them.
+    :param str store_directory: the directory of the store (created if it doesn't exist)
+    :param int n_trajectories: total number of trajectories in the store
+    :param tuple force_types: force types of the trajectories, the trajectories cycle through them
+    :param int master_seed: seed from which the seeds of all the trajectories are derived
+    :param None or int n_workers: number of worker processes, if None os.cpu_count() is used
+    :param int chunk_size: number of trajectories sent to a worker at once
+    :param float time_step: the time step used in the integration
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param str integrator: one of rocket_simulation.INTEGRATORS
+    :param int progress_every: print the progress every progress_every trajectories, 0 - never
+    :param bool verbose: if True print the throughput after the trajectories are generated
+    :return: dictionary with the number of generated and skipped trajectories, steps, time and throughput
+    """
+
+    assert integrator in INTEGRATORS and f'integrator has to be one of {INTEGRATORS}'
+
+    store = TrajectoryStore(store_directory, mode='a')
+    tasks = simulation_tasks(n_trajectories, force_types=force_types, master_seed=master_seed)[len(store):]
+    worker = partial(generate_trajectory_task, time_step=time_step, max_simul_steps=max_simul_steps,
+                     box_size=box_size, integrator=integrator)
+
+    start_time = time.perf_counter()
+    steps = 0
+    # the trajectories are appended as soon as they are ready, so an interrupted run keeps everything generated so far:
+    try:
+        for position, params in iter_tasks(worker, tasks, n_workers=n_workers, chunk_size=chunk_size,
+                                           progress_every=progress_every, name='trajectories'):
+            store.append(position[0], position[1], params)
+            steps += position.shape[1]
+    finally:
+        store.close()
+    elapsed_time = time.perf_counter() - start_time
+
+    stats = {'trajectories': len(tasks), 'skipped': n_trajectories - len(tasks), 'steps': steps,
+             'seconds': elapsed_time,
+             'trajectories_per_s': len(tasks) / elapsed_time if elapsed_time > 0 else float('inf'),
+             'steps_per_s': steps / elapsed_time if elapsed_time > 0 else float('inf')}
+
+    if verbose:
+        print(f"Generated {stats['trajectories']} trajectories ({steps} steps) in {elapsed_time:.2f} s: "
+              f"{stats['trajectories_per_s']:.1f} trajectories/s, {stats['steps_per_s']:.3g} steps/s"
+              + (f", {stats['skipped']} were already in the store" if stats['skipped'] else ''))
+
+    return stats
+
+
+def render_store_task(index, store_directory, save_path, frames_number=30, image_size=1000, oriented=False,
+                      make_gif=False, save_frames=True, save_array=False, save_indexed=False, save_video=False,
+                      resume=False, rocket_img_path=ROCKET_IMG_PATH, background_img_path=BACKGROUND_IMG_PATH):
+    """
+    The function renders the simulation of a single trajectory of a TrajectoryStore into the directory
+    save_path/<force_type>_<index>.
+    :param int index: index of the trajectory in the store
+    :param str store_directory: the directory of the store
+    :param str save_path: the path to the folder where the simulation directories are created
+    :param int frames_number: number of frames of the simulation
+    :param int image_size: size of the (square) frames in pixels
+    :param bool oriented: if True the rocket is rotated along its velocity with a sub-pixel placement
+    :param bool make_gif: if True make also a gif of the simulation
+    :param bool save_frames: if True save every frame as a png
+    :param bool save_array: if True save all the frames as a single .npy array
+    :param bool save_indexed: if True save all the frames as a compact palette-indexed .npz array
+    :param bool save_video: if True make also an .mp4 video of the simulation
+    :param bool resume: if True skip the simulation if its directory is already complete
+    :param str rocket_img_path: the path to the image of the rocket
+    :param str background_img_path: the path to the image of the background
+    :return: number of frames of the simulation
+    """
+
+    store = TrajectoryStore(store_directory)
+    x, y = store.xy(index)
+    info_dict = params_to_info_dict(store.params[index])
+    force_type = info_dict['force_type']
+
+    return generate_simulation_from_trajectory(np.array(x), np.array(y), int(store.params[index]['box_size']),
+                                               save_path, force_type, f'{force_type}_{index}',
+                                               background_img_size=image_size, oriented=oriented, make_gif=make_gif,
+                                               frames_number=frames_number, info_dict=info_dict,
+                                               save_frames=save_frames, save_array=save_array,
+                                               save_indexed=save_indexed, save_video=save_video, resume=resume,
+                                               rocket_img_path=rocket_img_path,
+                                               background_img_path=background_img_path)
+
+
+def render_store(store_directory, save_path, indices=None, n_workers=None, chunk_size=8, frames_number=30,
+                 image_size=1000, oriented=False, make_gif=False, save_frames=True, save_array=False,
+                 save_indexed=False, save_video=False, resume=False, progress_every=0, verbose=True,
+                 rocket_img_path=ROCKET_IMG_PATH, background_img_path=BACKGROUND_IMG_PATH):
+    """
+    The function renders the simulations of the trajectories of a TrajectoryStore using a pool of processes.
+    :param str store_directory: the directory of the store
+    :param str save_path: the path to the folder where the simulation directories are created
+    :param None or list indices: indices of the trajectories to render, if None all of them
+    :param None or int n_workers: number of worker processes, if None os.cpu_count() is used
+    :param int chunk_size: number of simulations sent to a worker at once
+    :param int frames_number: number of frames of each simulation
+    :param int image_size: size of the (square) frames in pixels, e.g. the training resolution
+    :param bool oriented: if True the rocket is rotated along its velocity with a sub-pixel placement
+    :param bool make_gif: if True make also a gif of each simulation
+    :param bool save_frames: if True save every frame as a png
+    :param bool save_array: if True save all the frames of a simulation as a single .npy array
+    :param bool save_indexed: if True save all the frames of a simulation as a compact palette-indexed .npz array
+    :param bool save_video: if True make also an .mp4 video of each simulation
+    :param bool resume: if True the simulations whose directories are already complete are skipped
+    :param int progress_every: print the progress every progress_every simulations, 0 - never
+    :param bool verbose: if True print the throughput after the simulations are rendered
+    :param str rocket_img_path: the path to the image of the rocket
+    :param str background_img_path: the path to the image of the background
+    :return: dictionary with the number of rendered and skipped simulations and frames, time and throughput
+    """
+
+    store = TrajectoryStore(store_directory)
+    indices = list(range(len(store))) if indices is None else list(indices)
+    n_indices = len(indices)
+    if resume:
+        indices = [index for index in indices if not is_simulation_complete(
+            os.path.join(save_path, f"{FORCE_TYPES[int(store.params[index]['force_type'])]}_{index}"))]
+    worker = partial(render_store_task, store_directory=store_directory, save_path=save_path,
+                     frames_number=frames_number, image_size=image_size, oriented=oriented, make_gif=make_gif,
+                     save_frames=save_frames, save_array=save_array, save_indexed=save_indexed, save_video=save_video,
+                     resume=resume, rocket_img_path=rocket_img_path, background_img_path=background_img_path)
+
+    os.makedirs(save_path, exist_ok=True)
+
+    start_time = time.perf_counter()
+    frames = run_tasks(worker, indices, n_workers=n_workers, chunk_size=chunk_size, progress_every=progress_every)
+    elapsed_time = time.perf_counter() - start_time
+
+    stats = {'simulations': len(indices), 'skipped': n_indices - len(indices), 'frames': int(sum(frames)),
+             'seconds': elapsed_time,
+             'frames_per_s': sum(frames) / elapsed_time if elapsed_time > 0 else float('inf')}
+
+    if verbose:
+        print(f"Rendered {stats['simulations']} simulations ({stats['frames']} frames) in {elapsed_time:.2f} s: "
+              f"{stats['frames_per_s']:.1f} frames/s"
+              + (f", skipped {stats['skipped']} complete simulations" if stats['skipped'] else ''))
+
+    return stats
+
+
+'Usage example:'
+# if __name__ == '__main__':
+#     generate_dataset('simulation_frames/dataset', 1000, master_seed=0, n_workers=8)
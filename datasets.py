@@ -1,9 +1,17 @@
 import os
+import json
+import uuid
+import hashlib
+import numpy as np
 from PIL import Image
 import torch
-from torch.utils.data import Dataset, DataLoader
-from torchvision import transforms
-from visualization import visualise_batch
+from torch.utils.data import Dataset, IterableDataset, DataLoader, Sampler, get_worker_info
+from rocket_simulation import (FORCE_TYPES, COMPLETE_MARKER, ROCKET_IMG_PATH, BACKGROUND_IMG_PATH,
+                               generate_trajectories_fast, trajectory_to_pixels, render_frames, rocket_orientations,
+                               frame_steps, resample_trajectory)
+from trajectory_store import PARAMS_DTYPE, force_params
+from profiling import profiled
+from assets import simulation_assets, simulation_atlas
 import re
 
 
@@ -16,19 +24,229 @@ def natural_sort_key(s):
     return [int(text) if text.isdigit() else text.lower() for text in re.split(r'(\d+)', s)]
 
 
+def frame_cache_key(directory, image_files, transform, dtype, state=None):
+    """
+    The function calculates the key of the frame cache. The key changes whenever any of the images is added, removed or
+    modified, or the transform or the dtype of the cache changes.
+    :param str directory: the directory with the images
+    :param list image_files: sorted names of the images
+    :param transform: the transform applied to the images
+    :param str dtype: dtype of the cached frames
+    :param state: JSON serializable value which changes whenever the images change (e.g. the modification times of the
+    complete markers of the simulations, see MultiSimulationDataset), if None every image is stat-ed instead
+    :return: hex digest string
+    """
+
+    if state is None:
+        state = []
+        for image_file in image_files:
+            stat = os.stat(os.path.join(directory, image_file))
+            state.append([stat.st_size, stat.st_mtime_ns])
+
+    key_data = json.dumps({'files': image_files, 'state': state, 'transform': repr(transform), 'dtype': dtype})
+
+    return hashlib.sha1(key_data.encode()).hexdigest()
+
+
+def _process_alive(pid):
+    """
+    :param str pid: process id
+    :return: True if the process is running (or its state can't be checked)
+    """
+
+    try:
+        os.kill(int(pid), 0)
+    except (ValueError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def _sample_indices(indices, length):
+    """
+    The function checks the indices of the samples of a dataset, the same way for single samples and for batches.
+    :param int or np.ndarray indices: index or indices of the samples, negative ones count from the end
+    :param int length: number of samples of the dataset
+    :return: np.array of the indices with the negative ones converted to positive
+    """
+
+    indices = np.asarray(indices, dtype=np.intp)
+    if indices.size and (indices.min() < -length or indices.max() >= length):
+        raise IndexError("Index out of range")
+
+    return np.where(indices < 0, indices + length, indices)
+
+
+class FrameCache:
+    """
+    Memory-mapped cache of decoded and transformed frames of a simulation. On the first use every image is decoded and
+    transformed once and the result is saved as an array of shape (num_frames, C, H, W) in a .npy file, which is then
+    opened with np.load(mmap_mode='c') so that slicing it doesn't copy the data.
+    """
+
+    def __init__(self, directory, image_files, transform=None, cache_dir=None, dtype='float16', state=None):
+        """
+        :param str directory: the directory with the images
+        :param list image_files: sorted names of the images
+        :param transform: the transform applied to every image (e.g. torchvision.transforms.Compose)
+        :param None or str cache_dir: the directory of the cache, if None directory/.frame_cache is used
+        :param str dtype: 'uint8', 'float16' or 'float32' - dtype of the cached frames. The transformed frames are
+        assumed to be in range [0, 1] and they are scaled to [0, 255] for 'uint8'
+        :param state: value which changes whenever the images change, see frame_cache_key
+        """
+
+        if dtype not in ('uint8', 'float16', 'float32'):
+            raise ValueError("dtype must be one of ('uint8', 'float16', 'float32')")
+
+        self.directory = directory
+        self.image_files = image_files
+        self.transform = transform
+        self.dtype = dtype
+        self.cache_dir = cache_dir if cache_dir else os.path.join(directory, '.frame_cache')
+
+        self.key = frame_cache_key(directory, image_files, transform, dtype, state=state)
+        # the caches of other directories or dtypes may share the cache_dir, only the caches with the prefix of this
+        # directory and dtype are replaced by a new build:
+        self.prefix = hashlib.sha1(os.path.abspath(directory).encode()).hexdigest()[:16] + '-' + dtype
+        self.path = os.path.join(self.cache_dir, f'{self.prefix}-{self.key}.npy')
+
+        if not os.path.exists(self.path):
+            self._build()
+
+        self.frames = np.load(self.path, mmap_mode='c')
+
+    def _load_frame(self, image_file):
+        """Decodes and transforms a single image into a (C, H, W) array"""
+        img = Image.open(os.path.join(self.directory, image_file)).convert('RGB')
+        if self.transform:
+            frame = np.asarray(self.transform(img))
+        else:
+            frame = np.asarray(img).transpose(2, 0, 1) / 255
+
+        if self.dtype == 'uint8':
+            return np.clip(np.rint(frame * 255), 0, 255)
+
+        return frame
+
+    def _remove_outdated(self):
+        """
+        Removes the caches of the same directory and dtype with other keys and the temporary files left by the builds of
+        such caches by dead processes
+        """
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.startswith(self.prefix + '-'):
+                continue
+            outdated_cache = file_name.endswith('.npy') and file_name != os.path.basename(self.path)
+            # the temporary files are named <prefix>-<key>.<pid>.<random>.tmp:
+            stale_tmp = file_name.endswith('.tmp') and (not file_name.startswith(f'{self.prefix}-{self.key}.') or
+                                                        not _process_alive(file_name.split('.')[1]))
+            if not outdated_cache and not stale_tmp:
+                continue
+            # another process may be removing the same file:
+            try:
+                os.remove(os.path.join(self.cache_dir, file_name))
+            except FileNotFoundError:
+                pass
+
+    def _build(self):
+        """Decodes every frame once and saves them in the cache, removing the outdated caches"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._remove_outdated()
+
+        first_frame = self._load_frame(self.image_files[0]) if self.image_files else np.zeros((3, 0, 0))
+
+        # The cache is written to a temporary file of this process first, so that an interrupted build is never used
+        # and several processes building the same cache at once don't overwrite each other:
+        tmp_path = os.path.join(self.cache_dir, f'{self.prefix}-{self.key}.{os.getpid()}.{uuid.uuid4().hex}.tmp')
+        try:
+            frames = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype,
+                                               shape=(len(self.image_files),) + first_frame.shape)
+            for i, image_file in enumerate(self.image_files):
+                frames[i] = first_frame if i == 0 else self._load_frame(image_file)
+            frames.flush()
+            del frames
+            # the caches built by different processes are identical, so the last one simply wins:
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, idx):
+        return self.frames[idx]
+
+    def gather(self, starts, window_length):
+        """
+        The function gathers the windows of subsequent frames of a whole batch with a single indexing operation.
+        :param np.ndarray starts: indices of the first frames of the windows
+        :param int window_length: number of subsequent frames in a window
+        :return: np.array of shape (len(starts), window_length, C, H, W) and the dtype of the cache
+        """
+
+        frame_index = np.add.outer(np.asarray(starts, dtype=np.intp), np.arange(window_length))
+
+        return np.take(self.frames, frame_index, axis=0)
+
+
 class ImageDataset(Dataset):
-    def __init__(self, directory, transform=None):
+    def __init__(self, directory, transform=None, cache=False, cache_dir=None, cache_dtype='float16'):
+        """
+        :param str directory: the directory with the images of a simulation
+        :param transform: the transform applied to every image
+        :param bool cache: if True the images are decoded and transformed only once and kept in a FrameCache
+        :param None or str cache_dir: the directory of the cache, if None directory/.frame_cache is used
+        :param str cache_dtype: dtype of the cached frames ('uint8', 'float16' or 'float32'), the samples are float32
+        in [0, 1] whatever the dtype of the cache
+        """
         self.directory = directory
         self.image_files = sorted([f for f in os.listdir(directory) if f.endswith('.png')], key=natural_sort_key)
         self.transform = transform
+        self.cache = FrameCache(directory, self.image_files, transform=transform, cache_dir=cache_dir,
+                                dtype=cache_dtype) if cache else None
+        self.cache_dir = cache_dir
 
     def __len__(self):
         # Return the number of samples, considering groups of 3 images
         return max(0, len(self.image_files) - 2)
 
+    def frame_store(self):
+        """
+        The function returns the FrameCache the batches are gathered from: the cache of the dataset or, if it has none,
+        a uint8 cache built on the first call. It should be called in the main process before the DataLoader workers
+        are started (as WindowBatchDataset does), so the workers don't build it at once.
+        :return: FrameCache
+        """
+
+        if self.cache is None:
+            self.cache = FrameCache(self.directory, self.image_files, transform=self.transform,
+                                    cache_dir=self.cache_dir, dtype='uint8')
+
+        return self.cache
+
+    @profiled('dataset/image_dataset_batch')
+    def get_batch(self, indices):
+        """
+        The function gathers a whole batch of samples at once from the frame_store, see WindowBatchDataset.
+        :param np.ndarray indices: indices of the samples
+        :return: tensor of shape (len(indices), 3, C, H, W) with the dtype of the cache
+        """
+
+        indices = _sample_indices(indices, len(self))
+
+        return torch.from_numpy(self.frame_store().gather(indices, 3))
+
+    @profiled('dataset/image_dataset')
     def __getitem__(self, idx):
-        if idx >= len(self) - 2:  # Ensures the last batches have 3 images. I don't think its correct though
-            raise IndexError("Index out of range")
+        # len(self) already leaves out the last two images, so every sample has 3 images:
+        idx = int(_sample_indices(idx, len(self)))
+
+        # Three subsequent frames are a slice of the cache, converted to float32 in [0, 1] as the decoded images:
+        if self.cache is not None:
+            return frames_to_float(torch.from_numpy(self.cache[idx:idx+3]))
 
         # Load three subsequent images
         img_paths = self.image_files[idx:idx+3]
@@ -45,12 +263,442 @@ class ImageDataset(Dataset):
         return images_tensor
 
 
+def simulation_markers(root):
+    """
+    The function finds the complete simulation directories (see rocket_simulation.is_simulation_complete) with a
+    single stat per simulation. The hidden entries (e.g. .frame_store or .window_index.json) are skipped.
+    :param str root: the directory with the simulation directories, e.g. 'simulation_frames'
+    :return: dictionary of the modification times (in ns) of the complete markers by the simulation directory names
+    """
+
+    markers = {}
+    for simulation_directory_name in os.listdir(root):
+        if simulation_directory_name.startswith('.'):
+            continue
+        try:
+            marker_stat = os.stat(os.path.join(root, simulation_directory_name, COMPLETE_MARKER))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        markers[simulation_directory_name] = marker_stat.st_mtime_ns
+
+    return markers
+
+
+def scan_simulations(root, markers=None):
+    """
+    The function scans the simulation directories saved by rocket_simulation.generate_simulation_from_trajectory.
+    Only the complete simulations are scanned, so the simulations of an interrupted run never get into the samples.
+    :param str root: the directory with the simulation directories, e.g. 'simulation_frames'
+    :param None or dict markers: the complete simulations (see simulation_markers), if None they are found here
+    :return: list of dictionaries with the name, sorted frame file names, force_type and the modification time of the
+    complete marker of every simulation
+    """
+
+    if markers is None:
+        markers = simulation_markers(root)
+
+    simulations = []
+    for simulation_directory_name in sorted(markers, key=natural_sort_key):
+        snapshots_directory = os.path.join(root, simulation_directory_name, 'simulation_snapshots')
+        if not os.path.isdir(snapshots_directory):
+            continue
+
+        info_files = [f for f in os.listdir(os.path.join(root, simulation_directory_name)) if f.startswith('info_dict')]
+        if not info_files:
+            continue
+        with open(os.path.join(root, simulation_directory_name, info_files[0]), 'r') as json_file:
+            force_type = json.load(json_file)['force_type']
+
+        frames = sorted([f for f in os.listdir(snapshots_directory) if f.endswith('.png')], key=natural_sort_key)
+        simulations.append({'name': simulation_directory_name, 'frames': frames, 'force_type': force_type,
+                            'complete_mtime': markers[simulation_directory_name]})
+
+    return simulations
+
+
+class MultiSimulationDataset(Dataset):
+    """
+    Dataset of windows of subsequent frames taken from all the simulations in the root directory. Every sample is a
+    tensor of window_length frames and the label of the force_type of its simulation (index in
+    rocket_simulation.FORCE_TYPES). Only the complete simulations are used. The result of scanning the root is saved in
+    root/.window_index.json and reused as long as the complete simulations and their markers don't change (so a
+    simulation finished or regenerated later is scanned again).
+    """
+
+    def __init__(self, root, transform=None, window_length=3, stride=1, rebuild_index=False, cache=False,
+                 cache_dtype='float16'):
+        """
+        :param str root: the directory with the simulation directories, e.g. 'simulation_frames'
+        :param transform: the transform applied to every image
+        :param int window_length: number of subsequent frames in a sample
+        :param int stride: distance between the first frames of subsequent windows of a simulation
+        :param bool rebuild_index: if True the root is scanned again even if the saved index is up to date
+        :param bool cache: if True the frames of every simulation are kept in a FrameCache (all of them are built here,
+        so the DataLoader workers never build them at once)
+        :param str cache_dtype: dtype of the cached frames ('uint8', 'float16' or 'float32'), the samples are float32
+        in [0, 1] whatever the dtype of the cache
+        """
+
+        if not isinstance(window_length, int) or window_length < 1:
+            raise TypeError('window_length must be a positive integer')
+        if not isinstance(stride, int) or stride < 1:
+            raise TypeError('stride must be a positive integer')
+
+        self.root = root
+        self.transform = transform
+        self.window_length = window_length
+        self.stride = stride
+        self.cache = cache
+        self.cache_dtype = cache_dtype
+        self._caches = {}
+        self._frame_store = None
+
+        self.simulations = self._load_index(rebuild_index)
+        self.labels = np.array([FORCE_TYPES.index(simulation['force_type']) for simulation in self.simulations],
+                               dtype=np.int64)
+
+        # Flat index of (simulation, start_frame) windows:
+        simulation_index, start_frames = [], []
+        for i, simulation in enumerate(self.simulations):
+            starts = np.arange(0, len(simulation['frames']) - window_length + 1, stride)
+            simulation_index.append(np.full(len(starts), i))
+            start_frames.append(starts)
+        self.simulation_index = np.concatenate(simulation_index) if simulation_index else np.zeros(0, dtype=int)
+        self.start_frames = np.concatenate(start_frames) if start_frames else np.zeros(0, dtype=int)
+
+        # Index of the first frame of every simulation in the frames of all the simulations (see frame_store):
+        frame_counts = np.array([len(simulation['frames']) for simulation in self.simulations], dtype=np.int64)
+        self.first_frames = np.cumsum(frame_counts) - frame_counts
+
+        if cache:
+            for simulation in self.simulations:
+                directory = os.path.join(self.root, simulation['name'], 'simulation_snapshots')
+                # the frames of a complete simulation change only together with its marker, so they aren't stat-ed:
+                self._caches[simulation['name']] = FrameCache(directory, simulation['frames'],
+                                                              transform=self.transform, dtype=self.cache_dtype,
+                                                              state=simulation['complete_mtime'])
+
+    def _load_index(self, rebuild_index):
+        """Loads the saved scan of the root or scans it again if it is missing or outdated"""
+        index_path = os.path.join(self.root, '.window_index.json')
+        # the frames of a simulation don't change after its complete marker is written:
+        markers = simulation_markers(self.root)
+
+        if not rebuild_index and os.path.exists(index_path):
+            with open(index_path, 'r') as json_file:
+                index = json.load(json_file)
+            if index.get('markers') == markers:
+                return index['simulations']
+
+        simulations = scan_simulations(self.root, markers)
+        with open(index_path, 'w') as json_file:
+            json.dump({'markers': markers, 'simulations': simulations}, json_file)
+
+        return simulations
+
+    def __len__(self):
+        return len(self.start_frames)
+
+    @profiled('dataset/multi_simulation_dataset')
+    def __getitem__(self, idx):
+        idx = int(_sample_indices(idx, len(self)))
+
+        simulation = self.simulations[self.simulation_index[idx]]
+        start_frame = int(self.start_frames[idx])
+        label = self.labels[self.simulation_index[idx]]
+        directory = os.path.join(self.root, simulation['name'], 'simulation_snapshots')
+
+        if self.cache:
+            frames = self._caches[simulation['name']][start_frame:start_frame + self.window_length]
+            return frames_to_float(torch.from_numpy(frames)), label
+
+        images = []
+        for img_path in simulation['frames'][start_frame:start_frame + self.window_length]:
+            img = Image.open(os.path.join(directory, img_path)).convert('RGB')
+            if self.transform:
+                img = self.transform(img)
+            images.append(img)
+
+        return torch.stack(images), label
+
+    def frame_store(self):
+        """
+        The function returns the uint8 FrameCache of the frames of all the simulations one after another (in
+        root/.frame_store), so a batch of windows of different simulations is gathered with a single indexing operation.
+        It is built on the first call, which should be in the main process before the DataLoader workers are started
+        (as WindowBatchDataset does), so the workers don't build it at once.
+        :return: FrameCache
+        """
+
+        if self._frame_store is None:
+            image_files = [os.path.join(simulation['name'], 'simulation_snapshots', frame)
+                           for simulation in self.simulations for frame in simulation['frames']]
+            state = [simulation['complete_mtime'] for simulation in self.simulations]
+            self._frame_store = FrameCache(self.root, image_files, transform=self.transform,
+                                           cache_dir=os.path.join(self.root, '.frame_store'), dtype='uint8',
+                                           state=state)
+
+        return self._frame_store
+
+    @profiled('dataset/multi_simulation_batch')
+    def get_batch(self, indices):
+        """
+        The function gathers a whole batch of samples at once from the uint8 frame_store, see WindowBatchDataset.
+        :param np.ndarray indices: indices of the samples
+        :return: uint8 tensor of shape (len(indices), window_length, C, H, W) with the frames (scaled to [0, 255]) and
+        int64 tensor of shape (len(indices),) with the labels
+        """
+
+        indices = _sample_indices(indices, len(self))
+
+        simulation_index = self.simulation_index[indices]
+        starts = self.first_frames[simulation_index] + self.start_frames[indices]
+        frames = self.frame_store().gather(starts, self.window_length)
+
+        return torch.from_numpy(frames), torch.from_numpy(self.labels[simulation_index])
+
+
+class WindowBatchSampler(Sampler):
+    """
+    Sampler yielding whole batches of sample indices as np.arrays, to be used as the sampler of a DataLoader with
+    batch_size=None (see window_batch_loader), so the dataset gets all the indices of a batch at once.
+    """
+
+    def __init__(self, n_samples, batch_size, shuffle=True, drop_last=False, seed=0):
+        """
+        :param int n_samples: number of samples of the dataset
+        :param int batch_size: number of samples in a batch
+        :param bool shuffle: if True the samples are shuffled every epoch
+        :param bool drop_last: if True the last incomplete batch is skipped
+        :param int seed: seed of the shuffling, the order of epoch e depends only on (seed, e)
+        """
+
+        if not isinstance(batch_size, int) or batch_size < 1:
+            raise TypeError('batch_size must be a positive integer')
+
+        self.n_samples = n_samples
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        """
+        :param int epoch: the epoch of the next iteration (it chooses the order of the samples)
+        """
+
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return self.n_samples // self.batch_size
+        return (self.n_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        if self.shuffle:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(self.n_samples)
+        else:
+            order = np.arange(self.n_samples)
+
+        for i in range(len(self)):
+            yield order[i * self.batch_size:(i + 1) * self.batch_size]
+
+
+class WindowBatchDataset(Dataset):
+    """
+    View of an ImageDataset or a MultiSimulationDataset indexed by whole batches: dataset[indices] gathers all the
+    windows of the batch from the uint8 frame cache at once, instead of stacking and collating the samples one by one.
+    """
+
+    def __init__(self, dataset):
+        """
+        :param ImageDataset or MultiSimulationDataset dataset: the dataset of windows
+        """
+
+        if not isinstance(dataset, (ImageDataset, MultiSimulationDataset)):
+            raise TypeError('dataset must be an ImageDataset or a MultiSimulationDataset')
+
+        self.dataset = dataset
+        # the frame store is built here, in the main process, before any DataLoader worker is started:
+        dataset.frame_store()
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, indices):
+        return self.dataset.get_batch(indices)
+
+
+def window_batch_loader(dataset, batch_size=32, shuffle=True, drop_last=False, seed=0, num_workers=0,
+                        pin_memory=None):
+    """
+    The function creates a DataLoader of whole batches of windows gathered from a uint8 frame cache (see
+    WindowBatchDataset). The frames stay uint8 (4 times smaller than float32) until they are converted by
+    frames_to_float at the end, so the loading of a batch is one indexing operation and one conversion.
+    :param ImageDataset or MultiSimulationDataset dataset: the dataset of windows
+    :param int batch_size: number of samples in a batch
+    :param bool shuffle: if True the samples are shuffled every epoch (see WindowBatchSampler)
+    :param bool drop_last: if True the last incomplete batch is skipped
+    :param int seed: seed of the shuffling
+    :param int num_workers: number of DataLoader worker processes
+    :param None or bool pin_memory: if True the batches are copied into the pinned memory (for a fast transfer to the
+    GPU), if None only when CUDA is available
+    :return: torch.utils.data.DataLoader
+    """
+
+    if pin_memory is None:
+        pin_memory = torch.cuda.is_available()
+
+    sampler = WindowBatchSampler(len(dataset), batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed)
+
+    return DataLoader(WindowBatchDataset(dataset), batch_size=None, sampler=sampler, num_workers=num_workers,
+                      pin_memory=pin_memory)
+
+
+def frames_to_float(frames, device=None):
+    """
+    The function converts a batch of frames into float32 values in [0, 1] with a single vectorized operation (after
+    moving the batch to the device, so only the uint8 data are transferred).
+    :param torch.Tensor frames: uint8 frames in [0, 255] or float frames in [0, 1]
+    :param None or str or torch.device device: the device the batch is moved to, if None it is not moved
+    :return: float32 tensor of the same shape
+    """
+
+    if device is not None:
+        frames = frames.to(device, non_blocking=True)
+    if frames.dtype == torch.uint8:
+        return frames.float().div_(255)
+
+    return frames.float()
+
+
+class ProceduralDataset(IterableDataset):
+    """
+    Dataset which generates the simulations on the fly instead of loading them from disk. Every sample is generated by
+    rocket_simulation.generate_trajectories_fast and rendered in memory directly at the resolution image_size. Sample
+    number i always uses the seed np.random.SeedSequence(seed, spawn_key=(i,)) (the same as
+    dataset_generation.simulation_tasks), so the samples don't depend on the number of DataLoader workers - every worker
+    generates every num_workers-th sample.
+    """
+
+    def __init__(self, n_samples=None, force_types=FORCE_TYPES, seed=0, image_size=64, frames_number=30,
+                 time_step=0.01, max_simul_steps=3000, box_size=10, rocket_img_path=ROCKET_IMG_PATH,
+                 background_img_path=BACKGROUND_IMG_PATH, rocket_width=100, rocket_height=50, oriented=False):
+        """
+        :param None or int n_samples: number of samples, if None the dataset is infinite
+        :param tuple force_types: force types of the simulations, the samples cycle through them
+        :param int seed: the master seed of the dataset
+        :param int image_size: size of the rendered (square) frames in pixels
+        :param int frames_number: number of frames of every sample
+        :param float time_step: the time step used in Verlet integration algorithm
+        :param int max_simul_steps: maximum number of simulation steps
+        :param int box_size: size of the box the rocket is contained
+        :param str rocket_img_path: the path to the image of the rocket
+        :param str background_img_path: the path to the image of the background
+        :param int rocket_width: the width of the rocket image in pixels of the full size background
+        :param int rocket_height: the height of the rocket image in pixels of the full size background
+        :param bool oriented: if True the rocket is rotated along its velocity and placed with a sub-pixel precision
+        (see assets.SpriteAtlas), which makes the motion at low resolutions smooth
+        """
+
+        if n_samples is not None and (not isinstance(n_samples, int) or n_samples < 0):
+            raise TypeError('n_samples must be a non-negative integer or None')
+        if not isinstance(image_size, int) or image_size < 1:
+            raise TypeError('image_size must be a positive integer')
+        if not isinstance(frames_number, int) or frames_number < 1:
+            raise TypeError('frames_number must be a positive integer')
+
+        self.n_samples = n_samples
+        self.force_types = force_types
+        self.seed = seed
+        self.image_size = image_size
+        self.frames_number = frames_number
+        self.time_step = time_step
+        self.max_simul_steps = max_simul_steps
+        self.box_size = box_size
+        self.rocket_img_path = rocket_img_path
+        self.background_img_path = background_img_path
+        self.rocket_width = rocket_width
+        self.rocket_height = rocket_height
+        self.oriented = oriented
+        self._images = None
+
+    def _load_images(self):
+        """Returns the background and the rocket (or its SpriteAtlas) scaled to image_size (cached once per worker)"""
+        background, rocket = simulation_assets(self.background_img_path, self.rocket_img_path, self.image_size,
+                                               rocket_width=self.rocket_width, rocket_height=self.rocket_height,
+                                               mode='RGB')
+        if self.oriented:
+            rocket = simulation_atlas(self.background_img_path, self.rocket_img_path, self.image_size,
+                                      rocket_width=self.rocket_width, rocket_height=self.rocket_height)
+
+        return background, rocket
+
+    @profiled('dataset/procedural_sample')
+    def generate_sample(self, index):
+        """
+        The function generates the sample number index.
+        :param int index: index of the sample
+        :return: frames - float tensor of shape (frames_number, 3, image_size, image_size) with values in [0, 1], label -
+        index of the force type in rocket_simulation.FORCE_TYPES, params - dictionary of typed parameters of the
+        trajectory (see trajectory_store.PARAMS_DTYPE)
+        """
+
+        if self._images is None:
+            self._images = self._load_images()
+        background, rocket = self._images
+
+        force_type = self.force_types[index % len(self.force_types)]
+        rng = np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=(index,)))
+        (x, y), _, force_parameters = generate_trajectories_fast(force_type, time_step=self.time_step,
+                                                                 max_simul_steps=self.max_simul_steps,
+                                                                 box_size=self.box_size, rng=rng, return_params=True)
+
+        # frames_number frames uniformly spread in time over the trajectory, so that all the samples have the same
+        # shape:
+        steps = frame_steps(len(x), frames_number=self.frames_number)
+        x_frames, y_frames = resample_trajectory(x, y, steps)
+        if self.oriented:
+            # the atlas is placed by the center of the rocket:
+            x_pixels, y_pixels = trajectory_to_pixels(x_frames, y_frames, self.box_size, self.image_size, 0, 0)
+            angles = rocket_orientations(x, y, steps)
+        else:
+            x_pixels, y_pixels = trajectory_to_pixels(x_frames, y_frames, self.box_size, self.image_size,
+                                                      rocket.width, rocket.height)
+            angles = None
+
+        frames = np.empty((self.frames_number,) + background.shape, dtype=np.uint8)
+        for i, frame in enumerate(render_frames(x_pixels, y_pixels, background, rocket, angles=angles)):
+            frames[i] = frame
+
+        frames_tensor = torch.from_numpy(frames).permute(0, 3, 1, 2).float().div_(255)
+        params = force_params(force_type, *force_parameters, time_step=self.time_step, box_size=self.box_size)
+        params = {name: params[name] for name in PARAMS_DTYPE.names}
+
+        return frames_tensor, FORCE_TYPES.index(force_type), params
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        index = worker_id
+        while self.n_samples is None or index < self.n_samples:
+            yield self.generate_sample(index)
+            index += num_workers
+
+
 'Usage example:'
+# from torchvision import transforms
+# from visualization import visualise_batch
+#
 # transform = transforms.Compose([
 #     transforms.Resize((64, 64)), # downsampling the resolution of the images
 #     transforms.ToTensor()
 # ])
 # dataset = ImageDataset(directory=r'simulation_frames/gravity_test_0/simulation_snapshots', transform=transform)
+# cached_dataset = ImageDataset(directory=r'simulation_frames/gravity_test_0/simulation_snapshots', transform=transform,
+#                               cache=True)
 # dataloader = DataLoader(dataset, batch_size=1, shuffle=False)
 #
 # print('Length of dataset:', dataset.__len__())
@@ -59,4 +707,15 @@ class ImageDataset(Dataset):
 #
 # for batch in dataset:
 #     visualise_batch(batch)
+#
+# multi_dataset = MultiSimulationDataset(root=r'simulation_frames', transform=transform, window_length=3, stride=1)
+# images, label = multi_dataset[0]
+#
+# batch_loader = window_batch_loader(multi_dataset, batch_size=64, shuffle=True)
+# for frames, labels in batch_loader:
+#     frames = frames_to_float(frames)  # float tensor of shape (64, 3, 3, 64, 64)
+#
+# procedural_dataset = ProceduralDataset(n_samples=10000, image_size=64, seed=0, oriented=True)
+# procedural_dataloader = DataLoader(procedural_dataset, batch_size=32, num_workers=4)
+# frames, labels, params = next(iter(procedural_dataloader))
 
@@ -0,0 +1,256 @@
+"""Fast encoding of rendered simulations: shared palette GIFs, palette-indexed frame arrays and videos"""
+
+import hashlib
+import numpy as np
+
+
+# Number of bits per channel of the lookup table mapping colors to the palette (2 ** (3 * LUT_BITS) entries):
+LUT_BITS = 5
+
+_palette_cache = {}
+
+
+def build_palette(background, rocket, n_colors=256):
+    """
+    The function chooses the palette of the simulations of a rocket moving on a background. Every frame is the
+    background with the rocket blended into it, so the palette is made (by median cut) from the background together
+    with the rocket blended into the background at a few places.
+    :param np.ndarray background: uint8 array of shape (height, width, channels) with the background
+    :param np.ndarray rocket: uint8 array of shape (rocket_height, rocket_width, 4) with the RGBA rocket sprite
+    :param int n_colors: number of colors of the palette (at most 256)
+    :return: uint8 np.array of shape (n_colors, 3) with the palette
+    """
+
+    from PIL import Image
+    from rocket_simulation import render_frames
+
+    height, width = background.shape[:2]
+    positions = [(width * i // 4, height * j // 4) for i in range(4) for j in range(4)]
+    samples = [background[..., :3]]
+    for (x_pos, y_pos), frame in zip(positions, render_frames([p[0] for p in positions], [p[1] for p in positions],
+                                                             background, rocket)):
+        samples.append(frame[y_pos:y_pos + rocket.shape[0], x_pos:x_pos + rocket.shape[1], :3].copy())
+
+    # the samples are put one under another (padded to the width of the background) to quantize them at once:
+    rows = [np.pad(sample, ((0, 0), (0, width - sample.shape[1]), (0, 0)), mode='edge') for sample in samples
+            if sample.size]
+    image = Image.fromarray(np.ascontiguousarray(np.concatenate(rows)), 'RGB')
+    quantized = image.quantize(colors=n_colors, method=Image.Quantize.MEDIANCUT)
+
+    palette = np.array(quantized.getpalette()[:3 * n_colors], dtype=np.uint8).reshape(-1, 3)
+    return np.pad(palette, ((0, n_colors - len(palette)), (0, 0)))
+
+
+def palette_lut(palette, bits=LUT_BITS):
+    """
+    The function creates the lookup table mapping every color (with its channels cut to bits bits) to the index of the
+    nearest color of the palette, so the frames are quantized with a single indexing operation.
+    :param np.ndarray palette: uint8 np.array of shape (n_colors, 3)
+    :param int bits: number of bits per channel
+    :return: uint8 np.array of shape (2 ** (3 * bits),)
+    """
+
+    levels = (np.arange(2 ** bits) << (8 - bits)) + (1 << (7 - bits))
+    colors = np.stack(np.meshgrid(levels, levels, levels, indexing='ij'), axis=-1).reshape(-1, 3)
+
+    # |color - palette|^2 = |color|^2 - 2 color . palette + |palette|^2, the first term doesn't change the argmin:
+    palette = palette.astype(np.float64)
+    distances = (palette ** 2).sum(axis=1)[None, :] - 2 * colors.astype(np.float64) @ palette.T
+
+    return distances.argmin(axis=1).astype(np.uint8)
+
+
+def shared_palette(background, rocket, n_colors=256):
+    """
+    The function returns the palette and its lookup table (see build_palette and palette_lut) of a background and a
+    rocket. They are computed once per process and images, and shared by all the simulations. The read-only images
+    (e.g. the cached ones of assets.simulation_assets) can't change, so they are recognized by their identity, the
+    writeable ones by the hash of their pixels.
+    :param np.ndarray background: uint8 array of shape (height, width, channels) with the background
+    :param np.ndarray rocket: uint8 array of shape (rocket_height, rocket_width, 4) with the RGBA rocket sprite
+    :param int n_colors: number of colors of the palette
+    :return: palette - uint8 np.array of shape (n_colors, 3) and lut - uint8 np.array of shape (2 ** (3 * LUT_BITS),)
+    """
+
+    if background.flags.writeable or rocket.flags.writeable:
+        key = (hashlib.sha1(np.ascontiguousarray(background)).hexdigest(), background.shape,
+               hashlib.sha1(np.ascontiguousarray(rocket)).hexdigest(), rocket.shape, n_colors)
+        images = None
+    else:
+        # the cached images are kept, so their ids can't be reused by other arrays:
+        key = (id(background), id(rocket), n_colors)
+        images = (background, rocket)
+
+    if key not in _palette_cache:
+        palette = build_palette(background, rocket, n_colors=n_colors)
+        _palette_cache[key] = (palette, palette_lut(palette), images)
+
+    return _palette_cache[key][:2]
+
+
+def quantize(pixels, lut, bits=LUT_BITS):
+    """
+    The function maps the pixels to the indices of the palette of the lookup table.
+    :param np.ndarray pixels: uint8 array of shape (..., channels >= 3)
+    :param np.ndarray lut: the lookup table (see palette_lut)
+    :param int bits: number of bits per channel of the lookup table
+    :return: uint8 np.array of shape pixels.shape[:-1] with the indices
+    """
+
+    shift = 8 - bits
+    red = (pixels[..., 0] >> shift).astype(np.intp)
+    green = (pixels[..., 1] >> shift).astype(np.intp)
+    blue = (pixels[..., 2] >> shift).astype(np.intp)
+
+    return lut[(red << (2 * bits)) | (green << bits) | blue]
+
+
+class GifStreamWriter:
+    """
+    Writer of an animated GIF with one global palette. Every frame is written to the file as soon as it is given and
+    only the changed rectangle of a frame has to be encoded (the rest of the previous frame is kept), so the encoding
+    of a moving sprite is fast and the frames are never kept in memory.
+    """
+
+    def __init__(self, path, palette, size, duration=500, loop=0):
+        """
+        :param str path: path of the GIF file
+        :param np.ndarray palette: uint8 np.array of shape (n_colors, 3)
+        :param tuple size: (width, height) of the frames
+        :param float duration: duration of every frame in milliseconds
+        :param int loop: number of loops of the animation, 0 - forever
+        """
+
+        from PIL import Image, GifImagePlugin
+
+        self._image_module, self._gif_plugin = Image, GifImagePlugin
+        self.palette_bytes = np.ascontiguousarray(palette, dtype=np.uint8).tobytes()
+        self.size = size
+        self.duration = duration
+        self.frames = 0
+
+        header_image = Image.new('P', size)
+        header_image.putpalette(self.palette_bytes)
+        header, _ = GifImagePlugin.getheader(header_image, info={'loop': loop, 'optimize': False})
+
+        self.file = open(path, 'wb')
+        for part in header:
+            self.file.write(part)
+
+    def write_frame(self, indices, box=None):
+        """
+        The function writes a frame.
+        :param np.ndarray indices: uint8 array of shape (height, width) with the palette indices of the whole frame
+        :param None or tuple box: (top, bottom, left, right) rectangle of the frame which changed since the previous
+        frame, if None (or for the first frame) the whole frame is written
+        """
+
+        if box is None or self.frames == 0:
+            top, bottom, left, right = 0, indices.shape[0], 0, indices.shape[1]
+        else:
+            top, bottom, left, right = box
+        if bottom <= top or right <= left:
+            # nothing changed, but a frame has at least one pixel:
+            top, bottom, left, right = 0, 1, 0, 1
+
+        region = np.ascontiguousarray(indices[top:bottom, left:right])
+        frame = self._image_module.new('P', (right - left, bottom - top))
+        frame.frombytes(region.tobytes())
+        frame.putpalette(self.palette_bytes)
+        # disposal 1 - the frame is drawn on top of the previous one:
+        for part in self._gif_plugin.getdata(frame, (left, top), duration=self.duration, disposal=1):
+            self.file.write(part)
+        self.frames += 1
+
+    def close(self):
+        """The function writes the end of the GIF and closes the file"""
+
+        if not self.file.closed:
+            self.file.write(b';')
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class FrameEncoder:
+    """
+    Encoder of the frames of a single simulation yielded by rocket_simulation.render_frames(..., with_boxes=True).
+    The palette indices of the background are computed once and then only the changed rectangle of every frame is
+    quantized. The frames are streamed to the GIF and/or video writers and the indexed frames can be collected into a
+    compact array (1 byte per pixel with a single palette).
+    """
+
+    def __init__(self, background, rocket, frames_number, gif_path=None, gif_duration=500, video_path=None,
+                 video_fps=10, indexed=False):
+        """
+        :param np.ndarray background: uint8 array of shape (height, width, channels) with the background
+        :param np.ndarray rocket: uint8 array of shape (rocket_height, rocket_width, 4) with the RGBA rocket sprite
+        :param int frames_number: number of frames of the simulation (the size of the indexed array)
+        :param None or str gif_path: path of the GIF, if None no GIF is made
+        :param float gif_duration: duration of every frame of the GIF in milliseconds
+        :param None or str video_path: path of the video (e.g. .mp4, needs the imageio-ffmpeg plugin), if None no video
+        is made
+        :param float video_fps: frames per second of the video
+        :param bool indexed: if True the indexed frames are collected (see save_indexed)
+        """
+
+        self.palette, self.lut = shared_palette(background, rocket)
+        self.indices = quantize(background, self.lut)
+        self.gif_writer = GifStreamWriter(gif_path, self.palette, (background.shape[1], background.shape[0]),
+                                          duration=gif_duration) if gif_path else None
+        if video_path:
+            import imageio.v2 as imageio
+            self.video_writer = imageio.get_writer(video_path, fps=video_fps)
+        else:
+            self.video_writer = None
+        self.indexed_frames = np.empty((frames_number,) + self.indices.shape, dtype=np.uint8) if indexed else None
+        self.frames = 0
+
+    def add_frame(self, frame, box):
+        """
+        The function encodes the next frame.
+        :param np.ndarray frame: uint8 array of shape (height, width, channels) with the frame
+        :param tuple box: (top, bottom, left, right) rectangle of the frame which changed since the previous frame
+        """
+
+        top, bottom, left, right = box
+        if self.gif_writer is not None or self.indexed_frames is not None:
+            self.indices[top:bottom, left:right] = quantize(frame[top:bottom, left:right], self.lut)
+        if self.gif_writer is not None:
+            self.gif_writer.write_frame(self.indices, box)
+        if self.indexed_frames is not None:
+            self.indexed_frames[self.frames] = self.indices
+        if self.video_writer is not None:
+            self.video_writer.append_data(frame[..., :3])
+        self.frames += 1
+
+    def save_indexed(self, path):
+        """
+        The function saves the indexed frames and the palette as an .npz file with the arrays 'indices' (uint8 of shape
+        (frames, height, width)) and 'palette' (uint8 of shape (n_colors, 3)), the frames are palette[indices].
+        :param str path: path of the .npz file
+        """
+
+        np.savez(path, indices=self.indexed_frames[:self.frames], palette=self.palette)
+
+    def close(self):
+        """The function finishes the GIF and the video"""
+
+        if self.gif_writer is not None:
+            self.gif_writer.close()
+        if self.video_writer is not None:
+            self.video_writer.close()
+
+
+'Usage example:'
+# background, rocket = simulation_assets('images/background.png', 'images/rocket.png', image_size=1000)
+# encoder = FrameEncoder(background, rocket.rgba, len(x_pixels), gif_path='simulation.gif', indexed=True)
+# for frame, box in render_frames(x_pixels, y_pixels, background, rocket, with_boxes=True):
+#     encoder.add_frame(frame, box)
+# encoder.close()
+# encoder.save_indexed('simulation_indexed.npz')
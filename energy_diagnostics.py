@@ -0,0 +1,173 @@
+"""Vectorized energy diagnostics of many trajectories at once (e.g. of a whole trajectory_store.TrajectoryStore)"""
+
+import numpy as np
+from rocket_simulation import FORCE_TYPES
+
+
+# One record of the drift report per trajectory, the drifts are relative to the absolute value of the initial energy:
+REPORT_DTYPE = np.dtype([('index', '<i8'), ('force_type', 'u1'), ('length', '<i8'), ('initial_energy', '<f8'),
+                         ('final_energy', '<f8'), ('max_drift', '<f8'), ('final_drift', '<f8'), ('std_drift', '<f8')])
+
+
+def energy_terms(coords, lengths, params, body_mass=1):
+    """
+    The function calculates the kinetic, potential and total energy at every step of many trajectories at once. The
+    velocity is taken from the central difference (r[i + 1] - r[i - 1]) / (2 * time_step), which is the velocity of
+    the Verlet integrator, so the total energy of a correct trajectory only oscillates and doesn't drift. The first and
+    the last step of every trajectory have no central difference and neither do the bounces off the walls of the
+    trajectories without force, their energies are np.nan.
+    :param np.ndarray coords: concatenated trajectories, np.array of shape (M, 2) (e.g. a slice of TrajectoryStore
+    .coords)
+    :param np.ndarray lengths: number of steps of every trajectory, np.array of shape (n,) summing up to M
+    :param np.ndarray params: typed parameters of every trajectory, np.array of shape (n,) and dtype
+    trajectory_store.PARAMS_DTYPE
+    :param float body_mass: mass of the rocket/body
+    :return: kinetic, potential and total energy, np.arrays of shape (M,)
+    """
+
+    if not isinstance(coords, np.ndarray) or not isinstance(params, np.ndarray):
+        raise TypeError('coords and params must be numpy arrays')
+    lengths = np.asarray(lengths, dtype=np.int64)
+    assert coords.shape == (lengths.sum(), 2) and 'coords must be of shape (sum of lengths, 2)'
+    assert params.shape == lengths.shape and 'there must be one params record per trajectory'
+
+    starts = np.cumsum(lengths) - lengths
+    time_step = np.repeat(params['time_step'], lengths)
+
+    velocity = np.full(coords.shape, np.nan)
+    velocity[1:-1] = (coords[2:] - coords[:-2]) / (2 * time_step[1:-1, None])
+    # the central differences across the boundaries of the trajectories are not velocities:
+    velocity[starts[lengths > 0]] = np.nan
+    velocity[(starts + lengths - 1)[lengths > 0]] = np.nan
+
+    # The rocket without force bounces off the walls, the central difference of a step at a wall averages the velocities
+    # before and after the bounce, so such steps are skipped:
+    no_force = np.repeat(params['force_type'] == FORCE_TYPES.index('no_force'), lengths)
+    steps = np.diff(coords, axis=0)
+    bounce = np.zeros(len(coords), dtype=bool)
+    bounce[1:-1] = np.any(steps[1:] * steps[:-1] < 0, axis=1)
+    velocity[no_force & bounce] = np.nan
+
+    kinetic_energy = body_mass * np.einsum('ij,ij->i', velocity, velocity) / 2
+
+    # The parameters unused by a force type are np.nan, zeroing them switches the potential off without branching:
+    g_constant = np.repeat(np.nan_to_num(params['g_constant']), lengths, axis=0)
+    spring_constant = np.repeat(np.nan_to_num(params['spring_constant']), lengths, axis=0)
+    displacement = coords - np.repeat(np.nan_to_num(params['equilibrium_point']), lengths, axis=0)
+
+    # gravity: - body_mass * g * r, harmonic oscillator: k * (r - r_0) ** 2 / 2
+    potential_energy = (- body_mass * np.einsum('ij,ij->i', g_constant, coords)
+                        + 0.5 * np.einsum('ij,ij->i', spring_constant, displacement ** 2))
+    potential_energy[np.isnan(kinetic_energy)] = np.nan
+
+    return kinetic_energy, potential_energy, kinetic_energy + potential_energy
+
+
+def drift_statistics(total, lengths, params, first_index=0):
+    """
+    The function reduces the total energy of many trajectories (see energy_terms) into one REPORT_DTYPE record per
+    trajectory. The trajectories shorter than 3 steps have no energy, their statistics are np.nan.
+    :param np.ndarray total: total energy at every step, np.array of shape (M,)
+    :param np.ndarray lengths: number of steps of every trajectory, np.array of shape (n,)
+    :param np.ndarray params: typed parameters of every trajectory (trajectory_store.PARAMS_DTYPE)
+    :param int first_index: index of the first trajectory, saved in the index field of the report
+    :return: np.array of shape (n,) and dtype REPORT_DTYPE
+    """
+
+    lengths = np.asarray(lengths, dtype=np.int64)
+    report = np.zeros(len(lengths), dtype=REPORT_DTYPE)
+    report['index'] = first_index + np.arange(len(lengths))
+    report['force_type'] = params['force_type']
+    report['length'] = lengths
+    for name in REPORT_DTYPE.names[3:]:
+        report[name] = np.nan
+
+    valid = lengths >= 3
+    if not valid.any():
+        return report
+
+    starts = np.cumsum(lengths) - lengths
+    initial_energy = np.full(len(lengths), np.nan)
+    initial_energy[valid] = total[starts[valid] + 1]
+    scale = np.maximum(np.abs(initial_energy), 1e-12)
+
+    relative_drift = (total - np.repeat(initial_energy, lengths)) / np.repeat(scale, lengths)
+    finite = ~np.isnan(relative_drift)
+    counts = np.add.reduceat(finite, starts[valid])
+    relative_drift[~finite] = 0.
+
+    drift_sum = np.add.reduceat(relative_drift, starts[valid])
+    drift_squares = np.add.reduceat(relative_drift ** 2, starts[valid])
+
+    report['initial_energy'][valid] = initial_energy[valid]
+    report['final_energy'][valid] = total[(starts + lengths - 2)[valid]]
+    report['max_drift'][valid] = np.maximum.reduceat(np.abs(relative_drift), starts[valid])
+    report['final_drift'][valid] = relative_drift[(starts + lengths - 2)[valid]]
+    report['std_drift'][valid] = np.sqrt(np.maximum(drift_squares / counts - (drift_sum / counts) ** 2, 0.))
+
+    return report
+
+
+def store_drift_report(store, body_mass=1, max_block_steps=2 ** 22):
+    """
+    The function calculates the drift report of every trajectory of a TrajectoryStore. The trajectories are processed
+    in blocks of consecutive trajectories of at most max_block_steps steps (a longer trajectory is its own block), so
+    the memory used doesn't depend on the size of the store.
+    :param trajectory_store.TrajectoryStore store: the store to check
+    :param float body_mass: mass of the rocket/body
+    :param int max_block_steps: largest number of steps processed at once
+    :return: np.array of shape (len(store),) and dtype REPORT_DTYPE
+    """
+
+    if not isinstance(max_block_steps, int) or max_block_steps < 1:
+        raise TypeError('max_block_steps must be a positive integer')
+
+    offsets = np.asarray(store.offsets)
+    reports = []
+    first = 0
+    while first < len(store):
+        # the last trajectory which still fits into the block (at least one trajectory):
+        last = max(int(np.searchsorted(offsets, offsets[first] + max_block_steps, side='right')) - 1, first + 1)
+        last = min(last, len(store))
+
+        lengths = np.diff(offsets[first:last + 1])
+        params = np.asarray(store.params[first:last])
+        _, _, total = energy_terms(np.asarray(store.coords[offsets[first]:offsets[last]]), lengths, params,
+                                   body_mass=body_mass)
+        reports.append(drift_statistics(total, lengths, params, first_index=first))
+        first = last
+
+    return np.concatenate(reports) if reports else np.zeros(0, dtype=REPORT_DTYPE)
+
+
+def print_drift_report(report, worst=10):
+    """
+    The function prints the summary of a drift report: statistics of the relative drift per force type and the
+    trajectories with the largest drift.
+    :param np.ndarray report: np.array of dtype REPORT_DTYPE (e.g. from store_drift_report)
+    :param int worst: number of the trajectories with the largest drift to print
+    """
+
+    print(f"{'force_type':<21}{'count':>8}{'median_drift':>14}{'p95_drift':>12}{'max_drift':>12}{'median_final':>14}")
+    for code, force_type in enumerate(FORCE_TYPES):
+        records = report[(report['force_type'] == code) & ~np.isnan(report['max_drift'])]
+        if not len(records):
+            continue
+        print(f"{force_type:<21}{len(records):>8}{np.median(records['max_drift']):>14.3e}"
+              f"{np.percentile(records['max_drift'], 95):>12.3e}{records['max_drift'].max():>12.3e}"
+              f"{np.median(records['final_drift']):>14.3e}")
+
+    if worst:
+        records = report[~np.isnan(report['max_drift'])]
+        records = records[np.argsort(records['max_drift'])[::-1][:worst]]
+        print(f"\n{'index':>8}  {'force_type':<21}{'length':>8}{'initial_energy':>16}{'max_drift':>12}")
+        for record in records:
+            print(f"{record['index']:>8}  {FORCE_TYPES[record['force_type']]:<21}{record['length']:>8}"
+                  f"{record['initial_energy']:>16.4e}{record['max_drift']:>12.3e}")
+
+
+'Usage example:'
+# from trajectory_store import TrajectoryStore
+# store = TrajectoryStore('trajectory_store')
+# report = store_drift_report(store)
+# print_drift_report(report, worst=10)
@@ -0,0 +1,141 @@
+"""Step kernels of the simulations, compiled with numba if it is installed"""
+
+from importlib.util import find_spec
+
+# numba is only looked up here, it is imported (which takes a noticeable part of a second) on the first call of a
+# compiled kernel:
+NUMBA_AVAILABLE = find_spec('numba') is not None
+
+
+def verlet_kernel_py(buffer, force_code, max_simul_steps, time_step, box_size, body_mass, g_x, g_y, B_z, k_x, k_y,
+                     r_0_x, r_0_y):
+    """
+    The function integrates the movement of a rocket with Verlet algorithm (see rocket_simulation.verlet_integration).
+    It only works on floats and a preallocated buffer, so it can be compiled with numba.
+    :param np.ndarray buffer: array of shape (max_simul_steps, 2) with the two first positions already filled in
+    :param int force_code: index of the force type in rocket_simulation.FORCE_TYPES
+    :param int max_simul_steps: maximum number of simulation steps
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param float box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param float g_x: x component of the gravity term (body_mass * g * time_step ** 2 / body_mass)
+    :param float g_y: y component of the gravity term
+    :param float B_z: z component of the magnetic field
+    :param float k_x: x component of the spring constant
+    :param float k_y: y component of the spring constant
+    :param float r_0_x: x component of the equilibrium point
+    :param float r_0_y: y component of the equilibrium point
+    :return: number of filled steps of the buffer
+    """
+
+    x_prev, y_prev = float(buffer[0, 0]), float(buffer[0, 1])
+    x_curr, y_curr = float(buffer[1, 0]), float(buffer[1, 1])
+
+    length = 2
+    for j in range(max_simul_steps - 2):
+
+        if force_code == 0:
+            x_next = 2 * x_curr - x_prev
+            y_next = 2 * y_curr - y_prev
+            # Check if the rocket hit the wall and make it bounce of it if it did:
+            if x_next < 0 or x_next > box_size:
+                x_next = x_curr + (- (x_curr - x_prev) / time_step) * time_step
+            if y_next < 0 or y_next > box_size:
+                y_next = y_curr + (- (y_curr - y_prev) / time_step) * time_step
+
+        elif force_code == 1:
+            x_next = 2 * x_curr - x_prev + g_x
+            y_next = 2 * y_curr - y_prev + g_y
+
+        elif force_code == 2:
+            # Calculating instantaneous velocity
+            v_x = (x_curr - x_prev) / time_step
+            v_y = (y_curr - y_prev) / time_step
+            x_next = 2 * x_curr - x_prev + (v_y * B_z) * time_step ** 2 / body_mass
+            y_next = 2 * y_curr - y_prev + (- v_x * B_z) * time_step ** 2 / body_mass
+
+        else:
+            x_next = 2 * x_curr - x_prev + - k_x * (x_curr - r_0_x) * time_step ** 2 / body_mass
+            y_next = 2 * y_curr - y_prev + - k_y * (y_curr - r_0_y) * time_step ** 2 / body_mass
+
+        buffer[j + 2, 0] = x_next
+        buffer[j + 2, 1] = y_next
+        length = j + 3
+
+        # If the rocket goes out of the box we finish the simulation:
+        if x_next < 0 or x_next > box_size or y_next < 0 or y_next > box_size:
+            break
+
+        x_prev, y_prev, x_curr, y_curr = x_curr, y_curr, x_next, y_next
+
+    return length
+
+
+def box_kernel_py(position, box_size, dt, m, constant, spring, center, magnetic):
+    """
+    The function simulates movement of a ball inside the box with four quadrants of different forces (see
+    box_with_different_forces_simulation.simulate_movement and force_lookup_tables). It only works on floats and
+    preallocated arrays, so it can be compiled with numba.
+    :param np.ndarray position: array of shape (num_iterations, 2) with the two first positions already filled in
+    :param float box_size: size of the square box the ball is moving in
+    :param float dt: time step between each simulation iteration
+    :param float m: mass of the ball
+    :param np.ndarray constant: array of shape (4, 2) with the constant terms of the forces
+    :param np.ndarray spring: array of shape (4,) with the spring constants
+    :param np.ndarray center: array of shape (4, 2) with the equilibrium points of the springs
+    :param np.ndarray magnetic: array of shape (4,) with the magnetic terms (charge * B_z)
+    :return: None, the position array is filled in place
+    """
+
+    for i in range(0, position.shape[0] - 2):
+        x_prev, y_prev = float(position[i, 0]), float(position[i, 1])
+        x_curr, y_curr = float(position[i + 1, 0]), float(position[i + 1, 1])
+
+        region = int(x_curr >= box_size / 2) + 2 * int(y_curr >= box_size / 2)
+        v_x = (x_curr - x_prev) / (2 * dt)
+        v_y = (y_curr - y_prev) / (2 * dt)
+        f_x = constant[region, 0] - spring[region] * (x_curr - center[region, 0]) + magnetic[region] * v_y
+        f_y = constant[region, 1] - spring[region] * (y_curr - center[region, 1]) + magnetic[region] * - v_x
+
+        x_next = 2 * x_curr - x_prev + f_x * dt ** 2 / m
+        y_next = 2 * y_curr - y_prev + f_y * dt ** 2 / m
+
+        # checking for collisions of the ball with the boundaries of the box
+        if x_next < 0 or x_next > box_size:
+            x_next = x_curr - v_x * dt
+        if y_next < 0 or y_next > box_size:
+            y_next = y_curr - v_y * dt
+
+        position[i + 2, 0] = x_next
+        position[i + 2, 1] = y_next
+
+
+_compiled_kernels = {}
+
+
+def compiled(kernel):
+    """
+    The function returns the numba compiled version of a kernel (or the kernel itself if numba is not installed). The
+    compiled kernels are cached on disk (in __pycache__), so only the first run pays for the compilation.
+    :param kernel: one of the pure Python kernels of this module
+    :return: the compiled kernel
+    """
+
+    if kernel not in _compiled_kernels:
+        if NUMBA_AVAILABLE:
+            from numba import njit
+            _compiled_kernels[kernel] = njit(cache=True)(kernel)
+        else:
+            _compiled_kernels[kernel] = kernel
+
+    return _compiled_kernels[kernel]
+
+
+def verlet_kernel(*args):
+    """verlet_kernel_py compiled with numba (see compiled)"""
+    return compiled(verlet_kernel_py)(*args)
+
+
+def box_kernel(*args):
+    """box_kernel_py compiled with numba (see compiled)"""
+    return compiled(box_kernel_py)(*args)
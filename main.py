@@ -1,128 +1,182 @@
-import matplotlib.pyplot as plt
-from rocket_simulation import generate_trajectories, generate_simulation_from_trajectory
-from animation import animate_movement, test_circle
-from visualization import visualize_trajectory
-
-'Testing the generation of trajectories:'
-# fig, ax = plt.subplots()
-# # x_no_force, y_no_force = generate_trajectories('no_force', time_step=1, max_simul_steps=30, box_size=10)
-# # ax.scatter(x_no_force, y_no_force, s=0.5)
-#
-# # x_g, y_g = generate_trajectories('gravity', time_step=1, max_simul_steps=30, box_size=10)
-# # ax.scatter(x_g, y_g, s=1)
-#
-# # x_B, y_B  = generate_trajectories('magnetic_field', time_step=0.01, max_simul_steps=3000, box_size=10)
-# # ax.scatter(x_B[::150], y_B[::150], s=1)
-#
-# x_harm, y_harm = generate_trajectories('harmonic_oscillator', time_step=0.01, max_simul_steps=3000,
-#                                        box_size=10)
-# ax.scatter(x_harm, y_harm, s=0.5)
-#
-# ax.set_xlim(0, 10)
-# ax.set_ylim(0, 10)
-# ax.set_aspect('equal')
-# plt.show()
-
-'Testing the creation of animation frames from coordinates'
-# x, y = test_circle(5, 5, 3, 30)
-#
-# #animate_movement(x, y, 10)
-# save_path = r'C:\Users\Public\Desktop\Python projects\physics_guesser\simulation_frames'
-# generate_simulation_from_trajectory(x, y, 10, save_path, 'test', make_gif=True)
-
-'Testing generation of simulation from generated_trajectory - magnetic field'
-# (x_B, y_B), info_dict = generate_trajectories('magnetic_field', time_step=0.01, max_simul_steps=1000, box_size=10)
-# fig, ax = plt.subplots()
-# ax.scatter(x_B, y_B, s=0.5)
-#
-# ax.set_xlim(0, 10)
-# ax.set_ylim(0, 10)
-# ax.set_aspect('equal')
-# plt.show(block='True')
-#
-# animate_movement(x_B, y_B, 10, interval=10)
-#
-# save_animation = bool(int(input('Save animation (1/0)? ')))
-# if save_animation:
-#     save_path = r'C:\Users\Public\Desktop\Python projects\physics_guesser\simulation_frames'
-#     generate_simulation_from_trajectory(x_B, y_B, 10, save_path, 'magnetic_field_test',
-#                                         'magnetic_field_test_0', make_gif=True, info_dict=info_dict
-#                                         )
-
-'Testing generation of simulation from generated_trajectory - gravity'
-# (x_g, y_g), info_dict = generate_trajectories('gravity', time_step=0.01, max_simul_steps=3000, box_size=10)
-# fig, ax = plt.subplots()
-# ax.scatter(x_g, y_g, s=0.5)
-#
-# ax.set_xlim(0, 10)
-# ax.set_ylim(0, 10)
-# ax.set_aspect('equal')
-# plt.show(block='True')
-#
-# animate_movement(x_g, y_g, 10, interval=10)
-#
-# save_animation = bool(int(input('Save animation (1/0)? ')))
-# if save_animation:
-#     save_path = r'C:\Users\Public\Desktop\Python projects\physics_guesser\simulation_frames'
-#     generate_simulation_from_trajectory(x_g, y_g, 10, save_path, 'gravity_test',
-#                                         'gravity_test_0', make_gif=True, info_dict=info_dict)
-
-'Testing generation of simulation from generated_trajectory - harmonic_oscillator'
-# (x_h, y_h), info_dict = generate_trajectories('harmonic_oscillator', time_step=0.01, max_simul_steps=3000,
-#                                               box_size=10)
-# fig, ax = plt.subplots()
-# ax.scatter(x_h, y_h, s=0.5)
-#
-# ax.set_xlim(0, 10)
-# ax.set_ylim(0, 10)
-# ax.set_aspect('equal')
-# plt.show(block='True')
-#
-# animate_movement(x_h, y_h, 10, interval=10)
-#
-# save_animation = bool(int(input('Save animation (1/0)?')))
-# if save_animation:
-#     save_path = r'C:\Users\Public\Desktop\Python projects\physics_guesser\simulation_frames'
-#     generate_simulation_from_trajectory(x_h, y_h, 10, save_path, 'harmonic_test',
-#                                         'harmonic_test_0', make_gif=True, info_dict=info_dict)
-
-
-'Testing generation of simulation from generated trajectory - no force:'
-# (x_f, y_f), info_dict = generate_trajectories('no_force', time_step=0.01, max_simul_steps=1000,
-#                                               box_size=10)
-# fig, ax = plt.subplots()
-# ax.scatter(x_f, y_f, s=0.5)
-#
-# ax.set_xlim(0, 10)
-# ax.set_ylim(0, 10)
-# ax.set_aspect('equal')
-# plt.show(block='True')
-#
-# animate_movement(x_f, y_f, 10, interval=10)
-#
-# save_animation = bool(int(input('Save animation (1/0)?')))
-# if save_animation:
-#     save_path = r'C:\Users\Public\Desktop\Python projects\physics_guesser\simulation_frames'
-#     generate_simulation_from_trajectory(x_f, y_f, 10, save_path, 'no_force_test',
-#                                         'no_force_test_0', make_gif=True, info_dict=info_dict)
-
-'Testing the loading of saved trajectory for no force'
-# x_file = r'simulation_frames/no_force_test_0/no_force_test_x_coords.npy'
-# y_file = r'simulation_frames/no_force_test_0/no_force_test_y_coords.npy'
-# visualize_trajectory(x_file, y_file, r'simulation_frames/no_force_test_0/info_dict.txt')
-
-'Testing the loading of saved trajectory for magnetic_field'
-# x_file = r'simulation_frames/magnetic_field_test_0/magnetic_field_test_x_coords.npy'
-# y_file = r'simulation_frames/magnetic_field_test_0/magnetic_field_test_y_coords.npy'
-# visualize_trajectory(x_file, y_file, r'simulation_frames/magnetic_field_test_0/info_dict.txt')
-
-'Testing the loading of saved trajectory for 2D harmonic oscillator'
-# x_file = r'simulation_frames/harmonic_test_0/harmonic_test_x_coords.npy'
-# y_file = r'simulation_frames/harmonic_test_0/harmonic_test_y_coords.npy'
-# visualize_trajectory(x_file, y_file, r'simulation_frames/harmonic_test_0/info_dict.txt')
-
-'Testing the loading of saved trajectory for gravity'
-x_file = r'simulation_frames/gravity_test_0/gravity_test_x_coords.npy'
-y_file = r'simulation_frames/gravity_test_0/gravity_test_y_coords.npy'
-visualize_trajectory(x_file, y_file, r'simulation_frames/gravity_test_0/info_dict')
+"""Command line interface of the simulation pipeline, run python main.py <subcommand> --help for the options"""
 
+import os
+import argparse
+import numpy as np
+import profiling
+from rocket_simulation import FORCE_TYPES, INTEGRATORS, ROCKET_IMG_PATH, BACKGROUND_IMG_PATH
+from dataset_generation import generate_store, render_store, generate_dataset
+
+FRAME_FORMATS = ('png', 'gif', 'npy', 'indexed', 'mp4')
+
+
+def add_simulation_arguments(parser):
+    """
+    The function adds the arguments of the trajectory generation to a parser.
+    :param argparse.ArgumentParser parser: the parser of a subcommand
+    """
+
+    parser.add_argument('-n', '--n-simulations', type=int, required=True, help='total number of simulations')
+    parser.add_argument('--force-types', nargs='+', choices=FORCE_TYPES, default=list(FORCE_TYPES),
+                        help='force types the simulations cycle through, repeat a force type to change the mix, '
+                             'e.g. --force-types gravity gravity no_force')
+    parser.add_argument('--seed', type=int, default=0, help='master seed of all the simulations')
+    parser.add_argument('--time-step', type=float, default=0.01)
+    parser.add_argument('--max-steps', type=int, default=3000, help='maximum number of simulation steps')
+    parser.add_argument('--box-size', type=int, default=10)
+
+
+def add_rendering_arguments(parser):
+    """
+    The function adds the arguments of the rendering of the frames to a parser.
+    :param argparse.ArgumentParser parser: the parser of a subcommand
+    """
+
+    parser.add_argument('--frames', type=int, default=30, help='number of frames of every simulation')
+    parser.add_argument('--image-size', type=int, default=1000,
+                        help='size of the (square) frames in pixels, e.g. 64 renders directly at a training resolution')
+    parser.add_argument('--rocket-img', default=ROCKET_IMG_PATH, help='path to the image of the rocket')
+    parser.add_argument('--background-img', default=BACKGROUND_IMG_PATH, help='path to the image of the background')
+    parser.add_argument('--oriented', action='store_true',
+                        help='rotate the rocket along its velocity and place it with a sub-pixel precision')
+    parser.add_argument('--format', nargs='+', choices=FRAME_FORMATS, default=['png'],
+                        help='output formats of the frames: separate png files, a gif, one .npy array, one compact '
+                             'palette-indexed .npz array and/or an mp4 video (needs imageio-ffmpeg)')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='fail on existing simulation directories instead of skipping the complete ones')
+
+
+def add_run_arguments(parser, chunk_size):
+    """
+    The function adds the arguments of the parallel run to a parser.
+    :param argparse.ArgumentParser parser: the parser of a subcommand
+    :param int chunk_size: default number of tasks sent to a worker at once
+    """
+
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all CPUs)')
+    parser.add_argument('--chunk-size', type=int, default=chunk_size, help='number of tasks sent to a worker at once')
+    parser.add_argument('--progress-every', type=int, default=100, help='print the progress every N tasks, 0 - never')
+
+
+def build_parser():
+    """
+    The function creates the parser of the command line arguments.
+    :return: argparse.ArgumentParser
+    """
+
+    parser = argparse.ArgumentParser(description='Generation of rocket simulations and datasets')
+    parser.add_argument('--profile', action='store_true', help='print the time spent in every stage of the pipeline')
+    parser.add_argument('--trace', default=None, help='path of a Chrome trace JSON file of the stages (implies '
+                                                      '--profile)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate = subparsers.add_parser('generate', help='generate trajectories (without frames) into a trajectory store, '
+                                                      'an interrupted run is resumed')
+    generate.add_argument('-o', '--output', required=True, help='directory of the trajectory store')
+    add_simulation_arguments(generate)
+    generate.add_argument('--integrator', choices=INTEGRATORS, default='verlet')
+    add_run_arguments(generate, chunk_size=64)
+
+    render = subparsers.add_parser('render', help='render the frames of the trajectories of a trajectory store')
+    render.add_argument('--store', required=True, help='directory of the trajectory store')
+    render.add_argument('-o', '--output', required=True, help='directory of the simulation directories')
+    add_rendering_arguments(render)
+    add_run_arguments(render, chunk_size=8)
+
+    dataset = subparsers.add_parser('dataset', help='generate trajectories and render their frames')
+    dataset.add_argument('-o', '--output', required=True, help='directory of the simulation directories')
+    add_simulation_arguments(dataset)
+    add_rendering_arguments(dataset)
+    add_run_arguments(dataset, chunk_size=8)
+
+    energy = subparsers.add_parser('energy', help='energy drift report of all the trajectories of a trajectory store')
+    energy.add_argument('--store', required=True, help='directory of the trajectory store')
+    energy.add_argument('--body-mass', type=float, default=1)
+    energy.add_argument('--worst', type=int, default=10, help='number of the trajectories with the largest drift to '
+                                                              'print')
+    energy.add_argument('--report', default=None, help='path of a .npy file to save the whole report to')
+
+    return parser
+
+
+def main(argv=None):
+    """
+    The function runs the subcommand given in the command line arguments.
+    :param None or list argv: the command line arguments, if None sys.argv is used
+    :return: dictionary with the statistics of the run (or the energy report)
+    """
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    # the images are checked before any output is written, instead of failing in every worker:
+    for name in ('rocket_img', 'background_img'):
+        if hasattr(args, name) and not os.path.isfile(getattr(args, name)):
+            parser.error(f"the image {getattr(args, name)} doesn't exist")
+
+    if args.profile or args.trace:
+        profiling.enable(trace=bool(args.trace))
+    try:
+        return run_command(args)
+    finally:
+        if args.profile or args.trace:
+            profiling.print_summary()
+        if args.trace:
+            profiling.export_chrome_trace(args.trace)
+
+
+def run_command(args):
+    """
+    The function runs the subcommand of the parsed command line arguments.
+    :param argparse.Namespace args: the parsed arguments
+    :return: dictionary with the statistics of the run (or the energy report)
+    """
+
+    if args.command == 'generate':
+        return generate_store(args.output, args.n_simulations, force_types=tuple(args.force_types),
+                              master_seed=args.seed, n_workers=args.workers, chunk_size=args.chunk_size,
+                              time_step=args.time_step, max_simul_steps=args.max_steps, box_size=args.box_size,
+                              integrator=args.integrator, progress_every=args.progress_every)
+
+    if args.command == 'render':
+        return render_store(args.store, args.output, n_workers=args.workers, chunk_size=args.chunk_size,
+                            frames_number=args.frames, image_size=args.image_size, oriented=args.oriented,
+                            make_gif='gif' in args.format, save_frames='png' in args.format,
+                            save_array='npy' in args.format, save_indexed='indexed' in args.format,
+                            save_video='mp4' in args.format, resume=not args.no_resume,
+                            progress_every=args.progress_every, rocket_img_path=args.rocket_img,
+                            background_img_path=args.background_img)
+
+    if args.command == 'dataset':
+        return generate_dataset(args.output, args.n_simulations, force_types=tuple(args.force_types),
+                                master_seed=args.seed, n_workers=args.workers, chunk_size=args.chunk_size,
+                                time_step=args.time_step, max_simul_steps=args.max_steps, box_size=args.box_size,
+                                frames_number=args.frames, image_size=args.image_size, oriented=args.oriented,
+                                make_gif='gif' in args.format, save_frames='png' in args.format,
+                                save_array='npy' in args.format, save_indexed='indexed' in args.format,
+                                save_video='mp4' in args.format, resume=not args.no_resume,
+                                progress_every=args.progress_every, rocket_img_path=args.rocket_img,
+                                background_img_path=args.background_img)
+
+    # energy:
+    from trajectory_store import TrajectoryStore
+    from energy_diagnostics import store_drift_report, print_drift_report
+
+    report = store_drift_report(TrajectoryStore(args.store), body_mass=args.body_mass)
+    print_drift_report(report, worst=args.worst)
+    if args.report:
+        np.save(args.report, report)
+
+    return report
+
+
+if __name__ == '__main__':
+    main()
+
+
+'Usage example:'
+# python main.py generate -o trajectory_store -n 100000 --workers 8
+# python main.py energy --store trajectory_store --worst 20
+# python main.py render --store trajectory_store -o simulation_frames --format png gif
+# python main.py dataset -o simulation_frames/dataset -n 1000 --force-types gravity magnetic_field --seed 1
+# python main.py dataset -o simulation_frames/dataset_64 -n 1000 --image-size 64 --oriented --format npy
+# python main.py --profile --trace trace.json dataset -o simulation_frames/profiled -n 16 --format png gif
@@ -0,0 +1,226 @@
+"""Opt-in timing of the stages of the generation pipeline (counters, wall time histograms and Chrome traces)"""
+
+import os
+import json
+import time
+import threading
+from contextlib import nullcontext
+from functools import wraps
+import numpy as np
+
+
+# The profiling is off unless enable() is called or the PHYSICS_GUESSER_PROFILE environment variable is set:
+ENABLED = os.environ.get('PHYSICS_GUESSER_PROFILE', '') not in ('', '0')
+# If True the events are also kept for export_chrome_trace (see enable):
+TRACE = True
+# Largest number of kept trace events, the durations of the stages are kept regardless of it:
+MAX_TRACE_EVENTS = 1000000
+
+_durations = {}
+_counters = {}
+_trace_events = []
+_NULL_STAGE = nullcontext()
+
+
+def enable(trace=True):
+    """
+    The function switches the profiling on.
+    :param bool trace: if True the events are also kept for export_chrome_trace
+    """
+
+    global ENABLED, TRACE
+    ENABLED = True
+    TRACE = trace
+
+
+def disable():
+    """The function switches the profiling off, the recorded data are kept"""
+
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """The function removes all the recorded data"""
+
+    _durations.clear()
+    _counters.clear()
+    _trace_events.clear()
+
+
+class _Stage:
+    """Context manager measuring the wall time of a single execution of a stage"""
+
+    __slots__ = ('name', 'start_ns')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration_ns = time.perf_counter_ns() - self.start_ns
+        _durations.setdefault(self.name, []).append(duration_ns)
+        if TRACE and len(_trace_events) < MAX_TRACE_EVENTS:
+            _trace_events.append({'name': self.name, 'cat': self.name.split('/')[0], 'ph': 'X',
+                                  'ts': self.start_ns / 1000, 'dur': duration_ns / 1000,
+                                  'pid': os.getpid(), 'tid': threading.get_ident()})
+        return False
+
+
+def stage(name):
+    """
+    The function returns a context manager measuring the wall time of the code inside of it as a stage. When the
+    profiling is disabled a shared empty context manager is returned, so the cost is a single function call.
+    :param str name: name of the stage, the part before the first '/' is its category (e.g. 'render/png_encode')
+    :return: context manager
+    """
+
+    return _Stage(name) if ENABLED else _NULL_STAGE
+
+
+def profiled(name):
+    """
+    Decorator measuring every call of the function as the stage name (see stage).
+    :param str name: name of the stage
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def count(name, n=1):
+    """
+    The function increases the counter name by n (if the profiling is enabled).
+    :param str name: name of the counter, e.g. 'render/frames'
+    :param int n: the increment
+    """
+
+    if not ENABLED:
+        return
+    _counters[name] = _counters.get(name, 0) + n
+    if TRACE and len(_trace_events) < MAX_TRACE_EVENTS:
+        _trace_events.append({'name': name, 'ph': 'C', 'ts': time.perf_counter_ns() / 1000,
+                              'pid': os.getpid(), 'args': {name.split('/')[-1]: _counters[name]}})
+
+
+def snapshot():
+    """
+    The function returns all the recorded data, e.g. to send them from a worker process to the main process.
+    :return: dictionary with the durations, counters and trace events
+    """
+
+    return {'durations': {name: list(durations) for name, durations in _durations.items()},
+            'counters': dict(_counters), 'trace_events': list(_trace_events)}
+
+
+def merge(data):
+    """
+    The function adds the data recorded in another process (see snapshot) to the data of this process.
+    :param dict data: the result of snapshot
+    """
+
+    for name, durations in data['durations'].items():
+        _durations.setdefault(name, []).extend(durations)
+    for name, value in data['counters'].items():
+        _counters[name] = _counters.get(name, 0) + value
+    _trace_events.extend(data['trace_events'][:max(0, MAX_TRACE_EVENTS - len(_trace_events))])
+
+
+def stage_statistics():
+    """
+    The function calculates the statistics of the wall time of every recorded stage.
+    :return: dictionary {stage name: {'count', 'total_s', 'mean_s', 'p50_s', 'p95_s', 'max_s'}}
+    """
+
+    statistics = {}
+    for name, durations in _durations.items():
+        seconds = np.array(durations) / 1e9
+        statistics[name] = {'count': len(seconds), 'total_s': float(seconds.sum()), 'mean_s': float(seconds.mean()),
+                            'p50_s': float(np.percentile(seconds, 50)), 'p95_s': float(np.percentile(seconds, 95)),
+                            'max_s': float(seconds.max())}
+
+    return statistics
+
+
+def counters():
+    """
+    :return: dictionary {counter name: value}
+    """
+
+    return dict(_counters)
+
+
+def histogram(name, bins_per_decade=4):
+    """
+    The function calculates the histogram of the wall times of a stage on logarithmic bins.
+    :param str name: name of the stage
+    :param int bins_per_decade: number of bins per factor of 10 of time
+    :return: counts - np.array of the number of executions in every bin and edges - np.array of the edges of the bins
+    in seconds
+    """
+
+    seconds = np.array(_durations.get(name, []), dtype=float) / 1e9
+    if not len(seconds):
+        return np.zeros(0, dtype=int), np.zeros(0)
+
+    low = np.floor(np.log10(max(seconds.min(), 1e-9)) * bins_per_decade)
+    high = np.ceil(np.log10(max(seconds.max(), 1e-9)) * bins_per_decade) + 1
+    edges = 10 ** (np.arange(low, high + 1) / bins_per_decade)
+
+    return np.histogram(seconds, bins=edges)[0], edges
+
+
+def print_summary(histograms=False):
+    """
+    The function prints the table of the statistics of all the stages (sorted by the total time) and the counters.
+    :param bool histograms: if True print also the histogram of the wall times of every stage
+    """
+
+    statistics = stage_statistics()
+    print(f"{'stage':<32}{'count':>9}{'total [s]':>11}{'mean [ms]':>11}{'p50 [ms]':>10}{'p95 [ms]':>10}"
+          f"{'max [ms]':>10}")
+    for name, stage_stats in sorted(statistics.items(), key=lambda item: - item[1]['total_s']):
+        print(f"{name:<32}{stage_stats['count']:>9}{stage_stats['total_s']:>11.3f}{stage_stats['mean_s'] * 1e3:>11.3f}"
+              f"{stage_stats['p50_s'] * 1e3:>10.3f}{stage_stats['p95_s'] * 1e3:>10.3f}"
+              f"{stage_stats['max_s'] * 1e3:>10.3f}")
+
+    if _counters:
+        print(f"\n{'counter':<32}{'value':>9}")
+        for name, value in sorted(_counters.items()):
+            print(f'{name:<32}{value:>9}')
+
+    if histograms:
+        for name in statistics:
+            counts, edges = histogram(name)
+            print(f'\n{name}')
+            for n, low, high in zip(counts, edges[:-1], edges[1:]):
+                print(f"{low * 1e3:>10.3f} - {high * 1e3:>10.3f} ms {n:>8} {'#' * int(40 * n / counts.max())}")
+
+
+def export_chrome_trace(path):
+    """
+    The function saves the recorded events in the Chrome trace format (open it in chrome://tracing or Perfetto).
+    :param str path: path of the JSON file
+    """
+
+    with open(path, 'w') as json_file:
+        json.dump({'traceEvents': _trace_events, 'displayTimeUnit': 'ms'}, json_file)
+
+
+'Usage example:'
+# import profiling
+# profiling.enable()
+# generate_dataset('simulation_frames/dataset', 100, n_workers=1)
+# profiling.print_summary()
+# profiling.export_chrome_trace('trace.json')
@@ -1,8 +1,21 @@
 import numpy as np
-from PIL import Image
-import imageio.v2 as imageio
 import os
+from shutil import rmtree
 from json import dump
+from jit_kernels import NUMBA_AVAILABLE, verlet_kernel, verlet_kernel_py
+from profiling import stage, profiled, count
+from encoding import FrameEncoder
+from assets import Sprite, SpriteAtlas, simulation_assets, simulation_atlas
+
+
+FORCE_TYPES = ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+# File written to a simulation directory after all its files are saved, it holds the number of frames:
+COMPLETE_MARKER = '.complete'
+INTEGRATORS = ('verlet', 'velocity_verlet', 'boris', 'rk4')
+# The images of the package, found regardless of the current directory:
+IMAGES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images')
+ROCKET_IMG_PATH = os.path.join(IMAGES_DIRECTORY, 'rocket.png')
+BACKGROUND_IMG_PATH = os.path.join(IMAGES_DIRECTORY, 'background.png')
 
 
 def gravity(mass, g_vector):
@@ -55,7 +68,7 @@ def harmonic_oscillator(body_position, spring_constant, equilibrium_point):
 
 
 def random_initial_pos(box_size, low_starting_position_limit, high_starting_position_limit, low_starting_velocity_limit,
-                       high_starting_velocity_limit, time_step=0.01):
+                       high_starting_velocity_limit, time_step=0.01, rng=None):
     """
     The function generates two first initial positions of a body (necessity for Verlet integration algorithm)
     :param box_size: size of the box the body is moving in
@@ -64,6 +77,7 @@ def random_initial_pos(box_size, low_starting_position_limit, high_starting_posi
     :param low_starting_velocity_limit: low limit for initial velocity, int or float smaller than high_starting_velocity_limit
     :param high_starting_velocity_limit: high limit for initial velocity, int or float larger than low_starting_velocity_limit
     :param time_step: Verlet integration time step
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
     :return: position, where position = np.array([position[0], position[1]]) and position[0], position[1] are np.arrays of shape (1,2)
     """
 
@@ -81,17 +95,71 @@ def random_initial_pos(box_size, low_starting_position_limit, high_starting_posi
     assert low_starting_velocity_limit < high_starting_velocity_limit and ('high_starting_velocity_limit must be'
                                                                            'greater than low_starting_velocity_limit')
 
+    if rng is None:
+        rng = np.random
+
     position = np.zeros((2, 2))
     velocity_0 = (low_starting_velocity_limit + (high_starting_velocity_limit - low_starting_velocity_limit) *
-                  np.random.random(2))
+                  rng.random(2))
 
     position[1] = box_size * (low_starting_position_limit + (high_starting_position_limit -
-                                                             low_starting_position_limit) * np.random.random(2))
+                                                             low_starting_position_limit) * rng.random(2))
     position[0] = position[1] - velocity_0 * time_step
 
     return position
 
 
+def random_force_parameters(box_size, rng=None):
+    """
+    The function draws random parameters of all the forces used in generate_trajectories: normalised gravity
+    acceleration, z component of magnetic field, equilibrium point and spring constant of the harmonic oscillator.
+    :param int box_size: size of the box the rocket is contained
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :return: g_acc_norm - np.array of shape (1, 2), B_z - float, r_0 - np.array of shape (2,), spring_constant -
+    np.array of shape (1, 2)
+    """
+
+    if rng is None:
+        rng = np.random
+
+    g_acc = -1 + 2 * rng.random(2)
+    g_acc_norm = (g_acc * 0.5 / np.linalg.norm(g_acc)).reshape(1, 2)
+    B_z = -2 + 4 * rng.random()
+    r_0 = box_size * (0.4 + 0.2 * rng.random(2))
+    spring_constant_x = 0.5 * rng.random()
+    spring_constant_y = np.sqrt(0.5 ** 2 - spring_constant_x ** 2)
+    spring_constant = np.array([[spring_constant_x, spring_constant_y]])
+
+    return g_acc_norm, B_z, r_0, spring_constant
+
+
+def trajectory_info(force_type, position, g_acc_norm, B_z, r_0, spring_constant):
+    """
+    The function creates the dictionary with information about a generated trajectory. Only the parameters of the force
+    of the given force_type are stored.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body (see random_initial_pos)
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :return: dictionary with information about the trajectory
+    """
+
+    info_dict = {'force_type': force_type, 'initial_position': str(position[0])}
+
+    if force_type == 'gravity':
+        info_dict['g_constant'] = str(g_acc_norm)
+    elif force_type == 'magnetic_field':
+        info_dict['B_field'] = str(B_z)
+    elif force_type == 'harmonic_oscillator':
+        info_dict['equilibrium_point'] = str(r_0)
+        info_dict['spring_constant'] = str(spring_constant)
+
+    return info_dict
+
+
+@profiled('trajectory/generate_trajectories')
 def generate_trajectories(force_type, time_step=0.01, max_simul_steps=30, box_size=1000, body_mass=1):
     """
     The function generates a trajectory of a movement of a rocket with one of forces (force_type) acting on it.
@@ -110,18 +178,9 @@ def generate_trajectories(force_type, time_step=0.01, max_simul_steps=30, box_si
                'variable force_type has to be one of (\'no_force\', \'gravity\', '
                '\'magnetic_field\', \'harmonic_oscillator\')')
 
-    # Creating dictionary with information on generated trajectory:
-    info_dict = {'force_type': force_type}
-
     # Generating random gravity acceleration, z component of magnetic field, equilibrium point and spring constant for
     # harmonic oscillator:
-    g_acc = -1 + 2 * np.random.random(2)
-    g_acc_norm = (g_acc * 0.5 / np.linalg.norm(g_acc)).reshape(1, 2)
-    B_z = -2 + 4 * np.random.random()
-    r_0 = box_size * (0.4 + 0.2 * np.random.random(2))
-    spring_constant_x = 0.5 * np.random.random()
-    spring_constant_y = np.sqrt(0.5 ** 2 - spring_constant_x ** 2)
-    spring_constant = np.array([[spring_constant_x, spring_constant_y]])
+    g_acc_norm, B_z, r_0, spring_constant = random_force_parameters(box_size)
 
     # Generating random initial position:
     position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
@@ -129,17 +188,8 @@ def generate_trajectories(force_type, time_step=0.01, max_simul_steps=30, box_si
                                   high_starting_velocity_limit=1,
                                   time_step=time_step)
 
-    info_dict['initial_position'] = str(position[0])
-
-    if force_type == 'no_force':
-        pass
-    elif force_type == 'gravity':
-        info_dict['g_constant'] = str(g_acc_norm)
-    elif force_type == 'magnetic_field':
-        info_dict['B_field'] = str(B_z)
-    else:
-        info_dict['equilibrium_point'] = str(r_0)
-        info_dict['spring_constant'] = str(spring_constant)
+    # Creating dictionary with information on generated trajectory:
+    info_dict = trajectory_info(force_type, position, g_acc_norm, B_z, r_0, spring_constant)
 
     for j in range(max_simul_steps - 2):
 
@@ -182,11 +232,557 @@ def generate_trajectories(force_type, time_step=0.01, max_simul_steps=30, box_si
     return position, info_dict
 
 
+def verlet_integration(force_type, position, time_step, max_simul_steps, box_size, body_mass, g_acc_norm, B_z, r_0,
+                       spring_constant, use_jit=None):
+    """
+    The function integrates the movement of a rocket with Verlet algorithm in the same way as generate_trajectories,
+    but it writes the positions into a preallocated buffer and evaluates the forces inline on floats instead of
+    calling gravity/magnetic_field/harmonic_oscillator at every step (see jit_kernels.verlet_kernel_py). The buffer is
+    truncated at the step in which the rocket left the box.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body, np.array of shape (2, 2) (see random_initial_pos)
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :param None or bool use_jit: if None the numba kernel is used when numba is installed, if False the pure Python
+    kernel is used, if True the numba kernel is required
+    :return: np.array of shape (number of steps, 2) with the positions of the rocket
+    """
+
+    buffer = np.empty((max(max_simul_steps, 2), 2))
+    buffer[:2] = position[:2]
+
+    # Constant parts of the forces (the same arithmetic as in gravity and harmonic_oscillator):
+    g_x, g_y = (body_mass * float(g_acc_norm[0][0]) * time_step ** 2 / body_mass,
+                body_mass * float(g_acc_norm[0][1]) * time_step ** 2 / body_mass)
+    k_x, k_y = float(spring_constant[0][0]), float(spring_constant[0][1])
+    r_0_x, r_0_y = float(r_0[0]), float(r_0[1])
+
+    # The step loop runs in the numba-compiled kernel if numba is installed (or if use_jit is True):
+    kernel = verlet_kernel if (use_jit is None or use_jit) else verlet_kernel_py
+    if use_jit and not NUMBA_AVAILABLE:
+        raise ImportError('use_jit=True requires numba to be installed')
+    length = kernel(buffer, FORCE_TYPES.index(force_type), max_simul_steps, float(time_step), float(box_size),
+                    float(body_mass), g_x, g_y, float(B_z), k_x, k_y, r_0_x, r_0_y)
+
+    return buffer[:length]
+
+
+def iter_trajectory_chunks(force_type, position, time_step, n_steps, box_size, body_mass, g_acc_norm, B_z, r_0,
+                           spring_constant, chunk_size=65536, resume=False, use_jit=None):
+    """
+    The generator integrates the movement of a rocket in the same way as verlet_integration, but it yields the
+    positions in chunks of at most chunk_size steps, so the memory used doesn't depend on the length of the run.
+    Chaining the chunks of a run with n_steps = max_simul_steps - 2 gives exactly the result of verlet_integration.
+    An interrupted run can be continued by passing the last two yielded positions as position with resume=True.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body (or the last two positions of the interrupted run),
+    np.array of shape (2, 2)
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param None or int n_steps: number of steps to make after the two given positions, if None the simulation runs
+    until the rocket leaves the box (the rocket without force never leaves it, so n_steps is required for it)
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :param int chunk_size: maximum number of steps in a chunk
+    :param bool resume: if False the first chunk starts with the two given positions, if True they are not yielded
+    again
+    :param None or bool use_jit: see verlet_integration
+    :return: generator of np.arrays of shape (k, 2) with consecutive positions of the rocket
+    """
+
+    if not isinstance(chunk_size, int) or chunk_size < 1:
+        raise TypeError('chunk_size must be a positive integer')
+    if n_steps is None and force_type == 'no_force':
+        raise ValueError('n_steps is required for no_force, because the rocket never leaves the box')
+
+    if not resume:
+        yield np.array(position[:2], dtype=float)
+
+    last_positions = np.array(position[:2], dtype=float)
+    steps_left = n_steps
+    while steps_left is None or steps_left > 0:
+        steps = chunk_size if steps_left is None else min(chunk_size, steps_left)
+        buffer = verlet_integration(force_type, last_positions, time_step, steps + 2, box_size, body_mass, g_acc_norm,
+                                    B_z, r_0, spring_constant, use_jit=use_jit)
+        chunk = buffer[2:]
+        if len(chunk):
+            yield chunk
+        # The rocket left the box:
+        if len(chunk) < steps:
+            return
+
+        last_positions = buffer[-2:].copy()
+        if steps_left is not None:
+            steps_left -= steps
+
+
+def acceleration_function(force_type, body_mass, g_acc_norm, B_z, r_0, spring_constant):
+    """
+    The function creates the function calculating the acceleration of the rocket for a given force type. The returned
+    function works on floats, so that it can be called at every step of the integrators without creating arrays.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :return: function (x, y, v_x, v_y) -> (a_x, a_y)
+    """
+
+    if force_type == 'gravity':
+        g_x, g_y = float(g_acc_norm[0][0]), float(g_acc_norm[0][1])
+        return lambda x, y, v_x, v_y: (g_x, g_y)
+
+    elif force_type == 'magnetic_field':
+        B_over_m = float(B_z) / body_mass
+        return lambda x, y, v_x, v_y: (v_y * B_over_m, - v_x * B_over_m)
+
+    elif force_type == 'harmonic_oscillator':
+        k_x, k_y = float(spring_constant[0][0]) / body_mass, float(spring_constant[0][1]) / body_mass
+        r_0_x, r_0_y = float(r_0[0]), float(r_0[1])
+        return lambda x, y, v_x, v_y: (- k_x * (x - r_0_x), - k_y * (y - r_0_y))
+
+    return lambda x, y, v_x, v_y: (0., 0.)
+
+
+def state_integration(force_type, position, time_step, max_simul_steps, box_size, body_mass, g_acc_norm, B_z, r_0,
+                      spring_constant, integrator='velocity_verlet'):
+    """
+    The function integrates the movement of a rocket with an integrator that keeps both the position and the velocity of
+    the rocket. The initial velocity is (position[1] - position[0]) / time_step and the integration starts at
+    position[1], so the result starts with the same two positions as the one of verlet_integration.
+    Available integrators:
+    - 'velocity_verlet' - velocity Verlet (the velocity dependent Lorentz force is evaluated at the half step velocity),
+    - 'boris' - Boris pusher, the magnetic field rotates the velocity exactly conserving its length, the remaining
+    forces are applied as half kicks before and after the rotation,
+    - 'rk4' - classical 4th order Runge-Kutta method.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body, np.array of shape (2, 2) (see random_initial_pos)
+    :param float time_step: the time step of the integration
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :param str integrator: one of ('velocity_verlet', 'boris', 'rk4')
+    :return: np.array of shape (number of steps, 2) with the positions of the rocket
+    """
+
+    assert integrator in ('velocity_verlet', 'boris', 'rk4') and ('integrator has to be one of '
+                                                                 '(\'velocity_verlet\', \'boris\', \'rk4\')')
+
+    buffer = np.empty((max(max_simul_steps, 2), 2))
+    buffer[:2] = position[:2]
+
+    x, y = float(position[1][0]), float(position[1][1])
+    v_x, v_y = (x - float(position[0][0])) / time_step, (y - float(position[0][1])) / time_step
+    dt = time_step
+
+    if integrator == 'boris' and force_type == 'magnetic_field':
+        # The magnetic field is handled by the rotation, so there are no other forces:
+        acceleration = acceleration_function('no_force', body_mass, g_acc_norm, B_z, r_0, spring_constant)
+        t = float(B_z) / body_mass * dt / 2
+    else:
+        acceleration = acceleration_function(force_type, body_mass, g_acc_norm, B_z, r_0, spring_constant)
+        t = 0.
+    s = 2 * t / (1 + t ** 2)
+
+    length = 2
+    for j in range(max_simul_steps - 2):
+
+        if integrator == 'velocity_verlet':
+            a_x, a_y = acceleration(x, y, v_x, v_y)
+            v_x, v_y = v_x + a_x * dt / 2, v_y + a_y * dt / 2
+            x, y = x + v_x * dt, y + v_y * dt
+            a_x, a_y = acceleration(x, y, v_x, v_y)
+            v_x, v_y = v_x + a_x * dt / 2, v_y + a_y * dt / 2
+
+        elif integrator == 'boris':
+            a_x, a_y = acceleration(x, y, v_x, v_y)
+            # half kick, rotation around z axis, half kick:
+            v_x, v_y = v_x + a_x * dt / 2, v_y + a_y * dt / 2
+            w_x, w_y = v_x + v_y * t, v_y - v_x * t
+            v_x, v_y = v_x + w_y * s, v_y - w_x * s
+            v_x, v_y = v_x + a_x * dt / 2, v_y + a_y * dt / 2
+            x, y = x + v_x * dt, y + v_y * dt
+
+        else:
+            k1_ax, k1_ay = acceleration(x, y, v_x, v_y)
+            k2_x, k2_y = v_x + k1_ax * dt / 2, v_y + k1_ay * dt / 2
+            k2_ax, k2_ay = acceleration(x + v_x * dt / 2, y + v_y * dt / 2, k2_x, k2_y)
+            k3_x, k3_y = v_x + k2_ax * dt / 2, v_y + k2_ay * dt / 2
+            k3_ax, k3_ay = acceleration(x + k2_x * dt / 2, y + k2_y * dt / 2, k3_x, k3_y)
+            k4_x, k4_y = v_x + k3_ax * dt, v_y + k3_ay * dt
+            k4_ax, k4_ay = acceleration(x + k3_x * dt, y + k3_y * dt, k4_x, k4_y)
+            x, y = x + (v_x + 2 * k2_x + 2 * k3_x + k4_x) * dt / 6, y + (v_y + 2 * k2_y + 2 * k3_y + k4_y) * dt / 6
+            v_x = v_x + (k1_ax + 2 * k2_ax + 2 * k3_ax + k4_ax) * dt / 6
+            v_y = v_y + (k1_ay + 2 * k2_ay + 2 * k3_ay + k4_ay) * dt / 6
+
+        # Check if the rocket hit the wall and make it bounce of it if it did:
+        if force_type == 'no_force':
+            if x < 0 or x > box_size:
+                x, v_x = x - v_x * dt, - v_x
+            if y < 0 or y > box_size:
+                y, v_y = y - v_y * dt, - v_y
+
+        buffer[j + 2, 0] = x
+        buffer[j + 2, 1] = y
+        length = j + 3
+
+        # If the rocket goes out of the box we finish the simulation:
+        if x < 0 or x > box_size or y < 0 or y > box_size:
+            break
+
+    return buffer[:length]
+
+
+def generate_trajectories_fast(force_type, time_step=0.01, max_simul_steps=30, box_size=1000, body_mass=1, rng=None,
+                               integrator='verlet', return_params=False):
+    """
+    The function generates a trajectory of a movement of a rocket with one of forces (force_type) acting on it. It
+    draws the random parameters in the same order as generate_trajectories and integrates them with
+    verlet_integration, so for the same random state both functions return the same trajectory. Other integrators
+    (see state_integration) can be chosen with the integrator parameter.
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :param str integrator: one of ('verlet', 'velocity_verlet', 'boris', 'rk4')
+    :param bool return_params: if True the float parameters (position, g_acc_norm, B_z, r_0, spring_constant) are
+    returned too, in the order of the arguments of trajectory_info (see trajectory_store.force_params)
+    :return: x and y np.arrays of the trajectory (np.array of shape (2, number of steps)) and dictionary with
+    information about generated trajectory (and the tuple of the parameters if return_params is True)
+    """
+
+    # Checking whether force type was chosen correctly:
+    assert force_type in FORCE_TYPES and ('variable force_type has to be one of (\'no_force\', \'gravity\', '
+                                          '\'magnetic_field\', \'harmonic_oscillator\')')
+    assert integrator in INTEGRATORS and ('integrator has to be one of (\'verlet\', \'velocity_verlet\', \'boris\', '
+                                          '\'rk4\')')
+
+    with stage('trajectory/parameters'):
+        g_acc_norm, B_z, r_0, spring_constant = random_force_parameters(box_size, rng=rng)
+
+        position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
+                                      high_starting_position_limit=0.6, low_starting_velocity_limit=-1,
+                                      high_starting_velocity_limit=1,
+                                      time_step=time_step, rng=rng)
+
+        info_dict = trajectory_info(force_type, position, g_acc_norm, B_z, r_0, spring_constant)
+        params = (np.array(position[:2], dtype=float), g_acc_norm, B_z, r_0, spring_constant)
+
+    with stage('trajectory/integration'):
+        if integrator == 'verlet':
+            position = verlet_integration(force_type, position, time_step, max_simul_steps, box_size, body_mass,
+                                          g_acc_norm, B_z, r_0, spring_constant)
+        else:
+            position = state_integration(force_type, position, time_step, max_simul_steps, box_size, body_mass,
+                                         g_acc_norm, B_z, r_0, spring_constant, integrator=integrator)
+    count('trajectory/steps', len(position))
+
+    if return_params:
+        return position.T.copy(), info_dict, params
+
+    return position.T.copy(), info_dict
+
+
+def generate_trajectories_batch(n_trajectories, force_type, time_step=0.01, max_simul_steps=30, box_size=1000,
+                                body_mass=1, rng=None, return_params=False):
+    """
+    The function generates n_trajectories trajectories at once. All the bodies are moved forward in lockstep with numpy
+    operations over a (n_trajectories, 2) state, the bodies that left the box are masked out and stop moving. The
+    parameters of the forces are drawn separately for every body.
+    :param int n_trajectories: number of trajectories to generate
+    :param str or list force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator') used for
+    all the bodies or a sequence of such strings of length n_trajectories (one force type per body)
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int max_simul_steps: maximum number of simulation steps
+    :param int box_size: size of the box the rockets are contained
+    :param float body_mass: mass of the rockets/bodies
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :param bool return_params: if True the float parameters of every trajectory are returned too (see
+    generate_trajectories_fast)
+    :return: positions - np.array of shape (n_trajectories, max_simul_steps, 2) padded with np.nan after the end of
+    each trajectory, lengths - np.array of shape (n_trajectories,) with the number of valid steps of each trajectory,
+    info_dicts - list of dictionaries with information about each trajectory (and the list of tuples of the parameters
+    of each trajectory if return_params is True)
+    """
+
+    # Checking whether the variables given are correct
+    if not isinstance(n_trajectories, int) or n_trajectories < 1:
+        raise TypeError('n_trajectories must be a positive integer')
+    if isinstance(force_type, str):
+        force_types = [force_type] * n_trajectories
+    else:
+        force_types = [str(body_force_type) for body_force_type in force_type]
+    if len(force_types) != n_trajectories:
+        raise ValueError('force_type must be a string or a sequence of length n_trajectories')
+    for body_force_type in force_types:
+        assert body_force_type in FORCE_TYPES and ('force_type has to be one of (\'no_force\', \'gravity\', '
+                                                   '\'magnetic_field\', \'harmonic_oscillator\')')
+
+    if rng is None:
+        rng = np.random
+
+    force_types_array = np.array(force_types)
+    is_free = force_types_array == 'no_force'
+    is_gravity = force_types_array == 'gravity'
+    is_magnetic = force_types_array == 'magnetic_field'
+    is_harmonic = force_types_array == 'harmonic_oscillator'
+
+    # Drawing vectors of parameters (the same distributions as in random_force_parameters):
+    g_acc = -1 + 2 * rng.random((n_trajectories, 2))
+    g_acc_norm = g_acc * 0.5 / np.linalg.norm(g_acc, axis=1, keepdims=True)
+    B_z = -2 + 4 * rng.random(n_trajectories)
+    r_0 = box_size * (0.4 + 0.2 * rng.random((n_trajectories, 2)))
+    spring_constant_x = 0.5 * rng.random(n_trajectories)
+    spring_constant = np.stack([spring_constant_x, np.sqrt(0.5 ** 2 - spring_constant_x ** 2)], axis=1)
+
+    # Drawing initial positions (the same distributions as in random_initial_pos):
+    velocity_0 = -1 + 2 * rng.random((n_trajectories, 2))
+    positions = np.full((n_trajectories, max(max_simul_steps, 2), 2), np.nan)
+    positions[:, 1] = box_size * (0.3 + 0.3 * rng.random((n_trajectories, 2)))
+    positions[:, 0] = positions[:, 1] - velocity_0 * time_step
+
+    info_dicts = [trajectory_info(force_types[n], positions[n, :2], g_acc_norm[n].reshape(1, 2), B_z[n], r_0[n],
+                                  spring_constant[n].reshape(1, 2)) for n in range(n_trajectories)]
+    params = [(positions[n, :2].copy(), g_acc_norm[n].reshape(1, 2), float(B_z[n]), r_0[n].copy(),
+               spring_constant[n].reshape(1, 2)) for n in range(n_trajectories)] if return_params else None
+
+    # Only the parameters of the chosen force are left non-zero, so one expression integrates all the force types:
+    g_term = np.where(is_gravity[:, None], body_mass * g_acc_norm * time_step ** 2 / body_mass, 0)
+    B_term = np.where(is_magnetic, B_z, 0) * time_step ** 2 / body_mass
+    k_term = np.where(is_harmonic[:, None], spring_constant, 0) * time_step ** 2 / body_mass
+
+    lengths = np.full(n_trajectories, positions.shape[1])
+    active = np.ones(n_trajectories, dtype=bool)
+    prev_position = positions[:, 0].copy()
+    curr_position = positions[:, 1].copy()
+
+    for j in range(max_simul_steps - 2):
+        velocity = (curr_position - prev_position) / time_step
+        next_position = (2 * curr_position - prev_position + g_term - k_term * (curr_position - r_0) +
+                         B_term[:, None] * np.stack([velocity[:, 1], -velocity[:, 0]], axis=1))
+
+        # Bodies without force bounce off the walls:
+        bounce = is_free[:, None] & ((next_position < 0) | (next_position > box_size))
+        next_position = np.where(bounce, curr_position - velocity * time_step, next_position)
+
+        positions[active, j + 2] = next_position[active]
+
+        # If a rocket goes out of the box we finish its simulation:
+        out_of_box = active & np.any((next_position < 0) | (next_position > box_size), axis=1)
+        lengths[out_of_box] = j + 3
+        active &= ~out_of_box
+        if not active.any():
+            break
+
+        prev_position, curr_position = curr_position, next_position
+
+    if return_params:
+        return positions, lengths, info_dicts, params
+
+    return positions, lengths, info_dicts
+
+
+def blend_sprite(frame, sprite, x_pos, y_pos):
+    """
+    The function alpha-blends the sprite into the frame (in place). Only the bounding box of the sprite is touched and
+    the parts of the sprite outside the frame are cropped, the same way as PIL.Image.Image.paste does it.
+    :param np.ndarray frame: uint8 array of shape (height, width, channels) the sprite is blended into
+    :param assets.Sprite sprite: the sprite with premultiplied alpha
+    :param int x_pos: x coordinate of the upper left corner of the sprite in the frame
+    :param int y_pos: y coordinate of the upper left corner of the sprite in the frame
+    :return: (top, bottom, left, right) bounding box of the changed part of the frame
+    """
+
+    top, left = max(y_pos, 0), max(x_pos, 0)
+    bottom = min(y_pos + sprite.shape[0], frame.shape[0])
+    right = min(x_pos + sprite.shape[1], frame.shape[1])
+    if top >= bottom or left >= right:
+        return 0, 0, 0, 0
+
+    rows, columns = slice(top - y_pos, bottom - y_pos), slice(left - x_pos, right - x_pos)
+    region = frame[top:bottom, left:right]
+    region[...] = (sprite.premultiplied[rows, columns, :frame.shape[2]] + region * sprite.inverse_alpha[rows, columns]
+                   + 127) // 255
+
+    return top, bottom, left, right
+
+
+def render_frames(x_pixels, y_pixels, background, rocket, with_boxes=False, angles=None):
+    """
+    The generator composites the rocket into the background at consecutive positions. A single frame buffer is reused:
+    before the rocket is drawn at a new position only its previous bounding box is restored from the background, so
+    the consumer has to copy the yielded frame if it wants to keep it.
+    :param np.ndarray x_pixels: x coordinates of the upper left corner of the rocket in pixels (truncated to integers),
+    or of the center of the rocket if rocket is a SpriteAtlas
+    :param np.ndarray y_pixels: y coordinates of the upper left corner of the rocket in pixels (truncated to integers),
+    or of the center of the rocket if rocket is a SpriteAtlas
+    :param np.ndarray background: uint8 array of shape (height, width, channels) with the background
+    :param np.ndarray or assets.Sprite or assets.SpriteAtlas rocket: uint8 array of shape (rocket_height,
+    rocket_width, 4) with the RGBA rocket sprite, the prepared sprite (see assets.simulation_assets) or the atlas of
+    rotated sprites placed with a sub-pixel precision (see assets.simulation_atlas)
+    :param None or np.ndarray angles: orientations of the rocket in radians (see rocket_orientations), used only with
+    a SpriteAtlas, if None the rocket points along the +x axis
+    :param bool with_boxes: if True also the (top, bottom, left, right) rectangle which changed since the previous
+    frame (or since the background for the first frame) is yielded with every frame
+    :return: generator of uint8 frames of shape (height, width, channels) (or of (frame, box) tuples)
+    """
+
+    atlas = rocket if isinstance(rocket, SpriteAtlas) else None
+    if atlas is None:
+        sprite = rocket if isinstance(rocket, Sprite) else Sprite(rocket)
+    if angles is None:
+        angles = np.zeros(len(x_pixels))
+
+    frame = background.copy()
+    top, bottom, left, right = 0, 0, 0, 0
+    for x_pos, y_pos, angle in zip(x_pixels, y_pixels, angles):
+        with stage('render/composite'):
+            frame[top:bottom, left:right] = background[top:bottom, left:right]
+            previous_box = (top, bottom, left, right)
+            if atlas is not None:
+                sprite, x_pos, y_pos = atlas.lookup(x_pos, y_pos, angle)
+            top, bottom, left, right = blend_sprite(frame, sprite, int(x_pos), int(y_pos))
+        if not with_boxes:
+            yield frame
+            continue
+
+        # the union of the restored and the newly drawn rectangles (the empty ones are skipped):
+        boxes = [box for box in (previous_box, (top, bottom, left, right)) if box[0] < box[1] and box[2] < box[3]]
+        if boxes:
+            yield frame, (min(box[0] for box in boxes), max(box[1] for box in boxes),
+                          min(box[2] for box in boxes), max(box[3] for box in boxes))
+        else:
+            yield frame, (0, 0, 0, 0)
+
+
+def trajectory_to_pixels(x, y, box_size, image_size, rocket_width, rocket_height):
+    """
+    The function scales the coordinates of the trajectory to the image of size image_size and converts them into the
+    coordinates of the upper left corner of the rocket image, so that the rocket is placed at its center.
+    :param np.ndarray x: array of x component of rocket trajectory
+    :param np.ndarray y: array of y component of rocket trajectory
+    :param int box_size: size of the box the rocket is moving in
+    :param int image_size: size of the (square) image in pixels
+    :param int rocket_width: the width of the rocket image in pixels
+    :param int rocket_height: the height of the rocket image in pixels
+    :return: x and y coordinates of the upper left corner of the rocket image in pixels
+    """
+
+    # scaling the x and y coordinates so that it fits to the image size:
+    x_scaled = x * image_size / box_size
+    y_scaled = y * image_size / box_size
+
+    # Adjust y-coordinates to match the image coordinate system
+    y_scaled = image_size - y_scaled
+
+    return x_scaled - rocket_width // 2, y_scaled - rocket_height // 2
+
+
+def frame_steps(length, frames_number=30, frame_times=None):
+    """
+    The function chooses the steps of a trajectory at which its frames are taken. The steps are fractional, the
+    positions between the steps are interpolated (see resample_trajectory), so there are always exactly frames_number
+    frames, also for a trajectory shorter than frames_number steps.
+    :param int length: number of steps of the trajectory
+    :param int frames_number: number of frames uniformly spread in time from the first to the last step
+    :param None or np.ndarray frame_times: increasing times of the frames as fractions of the duration of the trajectory
+    (0 - the first step, 1 - the last step), e.g. for a variable frame rate, if given frames_number is ignored
+    :return: np.array of the (float) steps of the frames
+    """
+
+    if not isinstance(length, (int, np.integer)) or length < 1:
+        raise TypeError('length must be a positive integer')
+
+    if frame_times is None:
+        if not isinstance(frames_number, int) or frames_number < 1:
+            raise TypeError('frames_number must be a positive integer')
+        return np.linspace(0, length - 1, frames_number)
+
+    frame_times = np.asarray(frame_times, dtype=float)
+    assert frame_times.ndim == 1 and len(frame_times) > 0 and 'frame_times must be a non-empty 1D array'
+    assert np.all((frame_times >= 0) & (frame_times <= 1)) and 'frame_times must be in [0, 1]'
+
+    return frame_times * (length - 1)
+
+
+def resample_trajectory(x, y, steps):
+    """
+    The function evaluates the trajectory at fractional steps by linear interpolation between the neighbouring steps.
+    :param np.ndarray x: array of x component of rocket trajectory
+    :param np.ndarray y: array of y component of rocket trajectory
+    :param np.ndarray steps: the (float) steps, e.g. from frame_steps
+    :return: x and y arrays of the positions at the steps
+    """
+
+    if not isinstance(x, np.ndarray) or not isinstance(y, np.ndarray):
+        raise TypeError('x and y must be numpy arrays')
+    assert x.shape == y.shape and 'x and y shapes don\'t match!'
+
+    trajectory_steps = np.arange(len(x))
+
+    return np.interp(steps, trajectory_steps, x), np.interp(steps, trajectory_steps, y)
+
+
+def rocket_orientations(x, y, frame_steps):
+    """
+    The function calculates the orientation of the rocket along its velocity (the central differences of the
+    trajectory, interpolated at fractional steps) at the steps of the frames. At the steps where the rocket doesn't
+    move the last orientation is kept.
+    :param np.ndarray x: array of x component of rocket trajectory
+    :param np.ndarray y: array of y component of rocket trajectory
+    :param np.ndarray frame_steps: the (float) steps of the frames, e.g. from frame_steps
+    :return: np.array of angles in radians, counterclockwise from the +x axis as seen in the frame (the y axis of the
+    frame points down, the angles don't change because the image is flipped)
+    """
+
+    if len(x) < 2:
+        return np.zeros(len(frame_steps))
+
+    velocity_x, velocity_y = resample_trajectory(np.gradient(x), np.gradient(y), frame_steps)
+    angles = np.arctan2(velocity_y, velocity_x)
+
+    moving = (velocity_x != 0) | (velocity_y != 0)
+    if not moving.any():
+        return np.zeros(len(frame_steps))
+    # the index of the last frame with a moving rocket (the first one for the frames before it):
+    last_moving = np.maximum.accumulate(np.where(moving, np.arange(len(moving)), np.argmax(moving)))
+
+    return angles[last_moving]
+
+
+def is_simulation_complete(simul_directory):
+    """
+    The function checks whether a simulation directory was completely written by generate_simulation_from_trajectory.
+    :param str simul_directory: path to the simulation directory
+    :return: True if the simulation directory is complete
+    """
+
+    return os.path.isfile(os.path.join(simul_directory, COMPLETE_MARKER))
+
+
 def generate_simulation_from_trajectory(x, y, box_size, save_path, img_name, simulation_directory_name,
-                                        rocket_img_path=r'images/rocket.png',
-                                        background_img_path=r'images/background.png', background_img_size=1000,
+                                        rocket_img_path=ROCKET_IMG_PATH, background_img_path=BACKGROUND_IMG_PATH,
+                                        background_img_size=1000,
                                         rocket_width=100, rocket_height=50, make_gif=False, frames_number=30,
-                                        info_dict=None):
+                                        info_dict=None, save_frames=True, return_frames=False, save_array=False,
+                                        resume=False, save_indexed=False, save_video=False, gif_duration=0.5,
+                                        oriented=False, frame_times=None):
     """
     The function creates images of a simulation of a rocket moving in the background according to the x, y arrays
     containing rocket trajectory
@@ -199,18 +795,34 @@ def generate_simulation_from_trajectory(x, y, box_size, save_path, img_name, sim
     saved
     :param str rocket_img_path: the path to the image of the rocket
     :param str background_img_path: the path to the image of the background
-    :param int background_img_size: the size of the image of the background (assuming it is a square) in pixels
-    :param int rocket_width: the width of the rocket image in pixels
-    :param int rocket_height: the height of the rocket image in pixels
+    :param int background_img_size: the size of the (square) frames in pixels, the background is scaled to it and the
+    rocket by the same factor, so the frames can be rendered directly at e.g. a training resolution
+    :param int rocket_width: the width of the rocket image in pixels of the full size background
+    :param int rocket_height: the height of the rocket image in pixels of the full size background
     :param bool make_gif: if True make also a gif out of simulation frames in the location where the jpgs are saved
-    :param int frames_number: number of frames of the simulation
+    :param int frames_number: number of frames of the simulation, uniformly spread in time over the trajectory
     :param None or dict info_dict: the dictionary with information about the trajectory from which simulation will be made.
     The dictionary will be saved in the simulation directory
-    :return: None
+    :param bool save_frames: if True every frame is saved as a png in the simulation_snapshots directory
+    :param bool return_frames: if True the frames are also returned as an np.array
+    :param bool save_array: if True all the frames are also saved as a single <img_name>_frames.npy array
+    :param bool save_indexed: if True all the frames are also saved as a compact <img_name>_indexed.npz file with
+    uint8 palette indices of the pixels and the palette (see encoding.FrameEncoder.save_indexed)
+    :param bool save_video: if True make also an <img_name>.mp4 video (needs the imageio-ffmpeg plugin)
+    :param float gif_duration: duration of every frame of the gif and the video in seconds
+    :param bool oriented: if True the rocket is rotated along its velocity and placed with a sub-pixel precision (see
+    assets.SpriteAtlas), otherwise it always points along the +x axis and its position is truncated to whole pixels
+    :param None or np.ndarray frame_times: times of the frames as fractions of the duration of the trajectory (see
+    frame_steps), e.g. for a variable frame rate, if given frames_number is ignored
+    :param bool resume: if False an existing simulation directory raises FileExistsError. If True a complete
+    simulation directory (see is_simulation_complete) is skipped and an incomplete one (e.g. left by an interrupted
+    run) is removed and generated again
+    :return: np.array of shape (number of frames, height, width, 4) with the frames if return_frames is True, number of
+    frames of the simulation otherwise (also for a skipped simulation)
     """
 
     # Path for the directory in which simulation data will be saved:
-    simul_directory = save_path + '\\' + simulation_directory_name
+    simul_directory = os.path.join(save_path, simulation_directory_name)
 
     # Checking whether the variables given are correct
     if not isinstance(x, np.ndarray):
@@ -229,7 +841,7 @@ def generate_simulation_from_trajectory(x, y, box_size, save_path, img_name, sim
         raise TypeError('rocket_img_path must be a string')
     if not isinstance(background_img_path, str):
         raise TypeError('background_img_path must be a string')
-    if not isinstance(background_img_size, int) or background_img_size < 0:
+    if not isinstance(background_img_size, int) or background_img_size < 1:
         raise TypeError('background_img_size must be a positive integer')
     if not isinstance(rocket_width, int) or rocket_width < 0:
         raise TypeError('rocket_width must be a positive integer')
@@ -239,64 +851,113 @@ def generate_simulation_from_trajectory(x, y, box_size, save_path, img_name, sim
         raise TypeError('img_name must be a string')
     if not isinstance(make_gif, bool):
         raise TypeError('make_gif must be a bool')
-    if not isinstance(frames_number, int):
-        raise TypeError('frames_number must be an int')
+    if not isinstance(frames_number, int) or frames_number < 1:
+        raise TypeError('frames_number must be a positive integer')
+    if not isinstance(save_frames, bool):
+        raise TypeError('save_frames must be a bool')
+    if not isinstance(return_frames, bool):
+        raise TypeError('return_frames must be a bool')
+    if not isinstance(save_array, bool):
+        raise TypeError('save_array must be a bool')
+    if not isinstance(save_indexed, bool):
+        raise TypeError('save_indexed must be a bool')
+    if not isinstance(save_video, bool):
+        raise TypeError('save_video must be a bool')
+    if not isinstance(resume, bool):
+        raise TypeError('resume must be a bool')
+    if not isinstance(oriented, bool):
+        raise TypeError('oriented must be a bool')
+
     if os.path.exists(simul_directory):
-        raise FileExistsError(f'The directory {simulation_directory_name} already exists.')
+        if not resume:
+            raise FileExistsError(f'The directory {simulation_directory_name} already exists.')
+        if is_simulation_complete(simul_directory) and not return_frames:
+            with open(os.path.join(simul_directory, COMPLETE_MARKER), 'r') as marker_file:
+                return int(marker_file.read())
+        rmtree(simul_directory)
 
     # Creating directory in which simulation data will be saved. It will raise error if the directory already
     # exists. Simulation snapshots will be saved in directory named: 'simulation_snapshots'
-    img_save_path = simul_directory + '\\' + 'simulation_snapshots'
+    img_save_path = os.path.join(simul_directory, 'simulation_snapshots')
     os.makedirs(simul_directory, exist_ok=False)
-    os.makedirs(img_save_path, exist_ok=False)
+    if save_frames:
+        os.makedirs(img_save_path, exist_ok=False)
 
     # Saving the info_dict dictionary if provided:
     if info_dict:
-        with open(simul_directory + '\\' + 'info_dict.txt', 'w') as json_file:
+        with stage('render/json'), open(os.path.join(simul_directory, 'info_dict.txt'), 'w') as json_file:
             dump(info_dict, json_file)
 
-    # loading in the background and the rocket images
-    background = Image.open(background_img_path)
-    rocket = Image.open(rocket_img_path)
+    # the background and the rocket scaled to the size of the frames (loaded once per process):
+    with stage('render/load_images'):
+        background, rocket = simulation_assets(background_img_path, rocket_img_path, background_img_size,
+                                               rocket_width=rocket_width, rocket_height=rocket_height)
+        atlas = simulation_atlas(background_img_path, rocket_img_path, background_img_size, rocket_width=rocket_width,
+                                 rocket_height=rocket_height) if oriented else None
 
     # saving the sliced x and y arrays to retain the original trajectory:
-    np.save(simul_directory + '\\' + img_name + '_x_coords.npy', x)
-    np.save(simul_directory + '\\' + img_name + '_y_coords.npy', y)
-
-    # taking every step element of x and y vector so to have the wanted number of frames
-    length = len(x)
-    step = int(length / frames_number)
-    x = x[::step]
-    y = y[::step]
-
-    # scaling the x and y coordinates so that it fits to the background size:
-    x_scaled = x * background_img_size / box_size
-    y_scaled = y * background_img_size / box_size
-
-    # Adjust y-coordinates to match the image coordinate system
-    y_scaled = background_img_size - y_scaled
+    with stage('render/save_coords'):
+        np.save(os.path.join(simul_directory, img_name + '_x_coords.npy'), x)
+        np.save(os.path.join(simul_directory, img_name + '_y_coords.npy'), y)
+
+    # the positions at exactly frames_number (or len(frame_times)) times, interpolated between the steps:
+    with stage('render/resample'):
+        steps = frame_steps(len(x), frames_number=frames_number, frame_times=frame_times)
+        angles = rocket_orientations(x, y, steps) if oriented else None
+        x, y = resample_trajectory(x, y, steps)
+
+    # scaling the x and y coordinates so that it fits to the background size (the atlas is placed by the center of the
+    # rocket):
+    if oriented:
+        x_scaled, y_scaled = trajectory_to_pixels(x, y, box_size, background_img_size, 0, 0)
+    else:
+        x_scaled, y_scaled = trajectory_to_pixels(x, y, box_size, background_img_size, rocket.width, rocket.height)
 
-    # adjusting the coordinates so that PIL.image.image.paste function will place the rocket at its center:
-    x_scaled = x_scaled - rocket_width // 2
-    y_scaled = y_scaled - rocket_height // 2
+    from PIL import Image
 
-    # list to store image file names
-    image_files = []
+    # the frames are streamed straight to the encoder (gif, video, indexed frames) and/or to the preallocated array of
+    # frames:
+    frames = np.empty((len(x_scaled),) + background.shape, dtype=np.uint8) if return_frames or save_array else None
+    with stage('render/encoder_setup'):
+        encoder = FrameEncoder(background, rocket.rgba, len(x_scaled),
+                               gif_path=os.path.join(simul_directory, img_name + '.gif') if make_gif else None,
+                               gif_duration=1000 * gif_duration,
+                               video_path=os.path.join(simul_directory, img_name + '.mp4') if save_video else None,
+                               video_fps=1 / gif_duration, indexed=save_indexed) \
+            if make_gif or save_video or save_indexed else None
 
     # creating images with the rocket at each point of the trajectory:
     i = 0
-    for x_coor, y_coor in zip(x_scaled, y_scaled):
-        img = background.copy()
-        img.paste(rocket, (int(x_coor), int(y_coor)), rocket)
-        img_save_path = simul_directory + '\\' + 'simulation_snapshots' + '\\' + img_name + f'_{i}.png'
-        img.save(img_save_path)
-        i = i + 1
-        if make_gif:
-            image_files.append(img_save_path)
-
-    # making a gif out of the images:
-    if make_gif:
-        with imageio.get_writer(simul_directory + '\\' + img_name + '.gif', mode='I', duration=0.5) as writer:
-            for filename in image_files:
-                image = imageio.imread(filename)
-                writer.append_data(image)
+    try:
+        for frame, box in render_frames(x_scaled, y_scaled, background, atlas if oriented else rocket,
+                                        with_boxes=True, angles=angles):
+            if save_frames:
+                with stage('render/png_encode'):
+                    Image.fromarray(frame).save(os.path.join(img_save_path, img_name + f'_{i}.png'))
+            if encoder is not None:
+                with stage('render/encode'):
+                    encoder.add_frame(frame, box)
+            if frames is not None:
+                frames[i] = frame
+            i = i + 1
+    finally:
+        if encoder is not None:
+            encoder.close()
+
+    if save_array:
+        with stage('render/save_array'):
+            np.save(os.path.join(simul_directory, img_name + '_frames.npy'), frames)
+    if save_indexed:
+        with stage('render/save_indexed'):
+            encoder.save_indexed(os.path.join(simul_directory, img_name + '_indexed.npz'))
+    count('render/frames', i)
+    count('render/simulations')
+
+    # The marker is written last, so a directory without it is known to be incomplete:
+    with open(os.path.join(simul_directory, COMPLETE_MARKER), 'w') as marker_file:
+        marker_file.write(str(i))
+
+    if return_frames:
+        return frames
+
+    return i
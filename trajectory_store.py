@@ -0,0 +1,392 @@
+"""Compact binary storage of many trajectories in a single directory"""
+
+import os
+import json
+import numpy as np
+from rocket_simulation import FORCE_TYPES, random_force_parameters, random_initial_pos, iter_trajectory_chunks
+
+
+# Typed parameters of a trajectory, the parameters not used by its force type are np.nan:
+PARAMS_DTYPE = np.dtype([('force_type', 'u1'), ('initial_position', '<f8', (2,)), ('g_constant', '<f8', (2,)),
+                         ('B_field', '<f8'), ('equilibrium_point', '<f8', (2,)), ('spring_constant', '<f8', (2,)),
+                         ('time_step', '<f8'), ('box_size', '<f8')])
+
+COORDS_FILE = 'coords.f8'
+OFFSETS_FILE = 'offsets.i8'
+PARAMS_FILE = 'params.bin'
+
+
+def parse_vector(value):
+    """
+    The function converts a vector saved in the info_dict (str of a numpy array, e.g. '[[1. 2.]]') into a flat array.
+    :param str or np.ndarray or float value: the vector to convert
+    :return: flat np.array of floats
+    """
+
+    if isinstance(value, str):
+        return np.array(value.replace('[', ' ').replace(']', ' ').split(), dtype=float)
+
+    return np.asarray(value, dtype=float).ravel()
+
+
+def force_params(force_type, position, g_acc_norm, B_z, r_0, spring_constant, time_step=np.nan, box_size=np.nan):
+    """
+    The function creates the typed record of a trajectory directly from the float parameters of its forces, so unlike
+    the info_dict (whose vectors are saved with the print precision) it keeps them exactly. Only the parameters of the
+    force of the given force_type are set (the same ones as in rocket_simulation.trajectory_info).
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param np.ndarray position: two first positions of the body (see random_initial_pos)
+    :param np.ndarray g_acc_norm: gravity acceleration vector of shape (1, 2)
+    :param float B_z: z component of the magnetic field
+    :param np.ndarray r_0: equilibrium point of the harmonic oscillator of shape (2,)
+    :param np.ndarray spring_constant: spring constant of the harmonic oscillator of shape (1, 2)
+    :param float time_step: the time step used to generate the trajectory
+    :param float box_size: the size of the box the trajectory was generated in
+    :return: np.array of shape () and dtype PARAMS_DTYPE
+    """
+
+    params = np.zeros((), dtype=PARAMS_DTYPE)
+    for name in PARAMS_DTYPE.names[1:]:
+        params[name] = np.nan
+
+    params['force_type'] = FORCE_TYPES.index(force_type)
+    params['initial_position'] = np.ravel(position[0])
+    params['time_step'] = time_step
+    params['box_size'] = box_size
+
+    if force_type == 'gravity':
+        params['g_constant'] = np.ravel(g_acc_norm)
+    elif force_type == 'magnetic_field':
+        params['B_field'] = B_z
+    elif force_type == 'harmonic_oscillator':
+        params['equilibrium_point'] = np.ravel(r_0)
+        params['spring_constant'] = np.ravel(spring_constant)
+
+    return params
+
+
+def info_dict_to_params(info_dict, time_step=np.nan, box_size=np.nan):
+    """
+    The function converts the info_dict created by rocket_simulation.generate_trajectories into a typed record. The
+    vectors of the info_dict are text with the print precision, so the records of new trajectories are made by
+    force_params instead, this is for the info_dict files of the simulation directories (see
+    import_simulation_directories).
+    :param dict info_dict: the dictionary with information about a trajectory
+    :param float time_step: the time step used to generate the trajectory
+    :param float box_size: the size of the box the trajectory was generated in
+    :return: np.array of shape () and dtype PARAMS_DTYPE
+    """
+
+    params = np.zeros((), dtype=PARAMS_DTYPE)
+    for name in PARAMS_DTYPE.names[1:]:
+        params[name] = np.nan
+
+    params['force_type'] = FORCE_TYPES.index(info_dict['force_type'])
+    params['time_step'] = info_dict.get('time_step', time_step)
+    params['box_size'] = info_dict.get('box_size', box_size)
+    for name in ('initial_position', 'g_constant', 'equilibrium_point', 'spring_constant'):
+        if name in info_dict:
+            params[name] = parse_vector(info_dict[name])
+    if 'B_field' in info_dict:
+        params['B_field'] = float(info_dict['B_field'])
+
+    return params
+
+
+def params_to_info_dict(params):
+    """
+    The function converts a typed record back into the info_dict format of rocket_simulation.generate_trajectories.
+    :param np.ndarray params: record of dtype PARAMS_DTYPE
+    :return: dictionary with information about the trajectory
+    """
+
+    force_type = FORCE_TYPES[int(params['force_type'])]
+    info_dict = {'force_type': force_type, 'initial_position': str(params['initial_position'])}
+
+    if force_type == 'gravity':
+        info_dict['g_constant'] = str(params['g_constant'].reshape(1, 2))
+    elif force_type == 'magnetic_field':
+        info_dict['B_field'] = str(float(params['B_field']))
+    elif force_type == 'harmonic_oscillator':
+        info_dict['equilibrium_point'] = str(params['equilibrium_point'])
+        info_dict['spring_constant'] = str(params['spring_constant'].reshape(1, 2))
+
+    return info_dict
+
+
+class TrajectoryStore:
+    """
+    Append-able store of many trajectories. All the coordinates are kept in one file as a concatenated (M, 2) float64
+    array, the offsets.i8 file holds the index of the first step of every trajectory (plus the total number of steps at
+    the end) and params.bin holds one PARAMS_DTYPE record per trajectory. The files are opened with np.memmap, so single
+    trajectories are sliced without copying. In the append mode the files stay open for writing and the memory maps are
+    extended only when the appended data are read.
+    """
+
+    def __init__(self, directory, mode='r'):
+        """
+        :param str directory: the directory of the store
+        :param str mode: 'r' to only read an existing store, 'a' to append to it (the store is created if it doesn't
+        exist)
+        """
+
+        if not isinstance(directory, str):
+            raise TypeError('directory must be a string')
+        if mode not in ('r', 'a'):
+            raise ValueError("mode must be 'r' or 'a'")
+
+        self.directory = directory
+        self.mode = mode
+
+        if mode == 'a' and not os.path.exists(os.path.join(directory, OFFSETS_FILE)):
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, COORDS_FILE), 'wb').close()
+            open(os.path.join(directory, PARAMS_FILE), 'wb').close()
+            np.zeros(1, dtype='<i8').tofile(os.path.join(directory, OFFSETS_FILE))
+        elif not os.path.exists(os.path.join(directory, OFFSETS_FILE)):
+            raise FileNotFoundError(f'There is no trajectory store in {directory}')
+
+        self._files = {}
+        if mode == 'a':
+            self._truncate_to_offsets()
+            # unbuffered, so nothing of a failed append is written after the files are truncated:
+            self._files = {file_name: open(os.path.join(directory, file_name), 'ab', buffering=0)
+                           for file_name in (COORDS_FILE, PARAMS_FILE, OFFSETS_FILE)}
+        self._open()
+
+    def _truncate_to_offsets(self):
+        """
+        Truncates the files to the trajectories recorded in offsets.i8. An interrupted append leaves coordinates and
+        possibly a params record behind without their offset, they would be read as the beginning of the next appended
+        trajectory.
+        """
+
+        offsets_path = os.path.join(self.directory, OFFSETS_FILE)
+        offsets_size = os.path.getsize(offsets_path)
+        if offsets_size % 8:
+            os.truncate(offsets_path, offsets_size - offsets_size % 8)
+
+        offsets = np.fromfile(offsets_path, dtype='<i8')
+        coords_size = int(offsets[-1]) * 2 * 8
+        params_size = (len(offsets) - 1) * PARAMS_DTYPE.itemsize
+        for file_name, size in ((COORDS_FILE, coords_size), (PARAMS_FILE, params_size)):
+            path = os.path.join(self.directory, file_name)
+            if os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _memmap(self, file_name, dtype):
+        path = os.path.join(self.directory, file_name)
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def _open(self):
+        """(Re)opens the memory maps of the store files"""
+        self._coords = self._memmap(COORDS_FILE, '<f8').reshape(-1, 2)
+        self._offsets = self._memmap(OFFSETS_FILE, '<i8')
+        self._params = self._memmap(PARAMS_FILE, PARAMS_DTYPE)
+        self._length = len(self._offsets) - 1
+        self._end = int(self._offsets[-1])
+
+    def _refresh(self):
+        """Remaps the files whose memory maps don't cover the appended data yet"""
+        if len(self._offsets) < self._length + 1:
+            self._offsets = self._memmap(OFFSETS_FILE, '<i8')
+            self._coords = self._memmap(COORDS_FILE, '<f8').reshape(-1, 2)
+            self._params = self._memmap(PARAMS_FILE, PARAMS_DTYPE)
+
+    @property
+    def coords(self):
+        """Memory map of the concatenated coordinates, np.array of shape (M, 2)"""
+        self._refresh()
+        return self._coords
+
+    @property
+    def offsets(self):
+        """Memory map of the offsets, np.array of shape (len(self) + 1,)"""
+        self._refresh()
+        return self._offsets
+
+    @property
+    def params(self):
+        """Memory map of the parameters, np.array of shape (len(self),) and dtype PARAMS_DTYPE"""
+        self._refresh()
+        return self._params
+
+    def close(self):
+        """The function closes the files opened for appending"""
+        for file in self._files.values():
+            file.close()
+        self._files = {}
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, idx):
+        """
+        :param int idx: index of the trajectory
+        :return: np.array of shape (number of steps, 2) - a read-only view of the trajectory
+        """
+
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('Index out of range')
+
+        self._refresh()
+        return self._coords[self._offsets[idx]:self._offsets[idx + 1]]
+
+    def xy(self, idx):
+        """
+        :param int idx: index of the trajectory
+        :return: x and y arrays of the trajectory (views)
+        """
+
+        trajectory = self[idx]
+        return trajectory[:, 0], trajectory[:, 1]
+
+    def lengths(self):
+        """
+        :return: np.array with the number of steps of every trajectory
+        """
+
+        return np.diff(self.offsets)
+
+    def info_dict(self, idx):
+        """
+        :param int idx: index of the trajectory
+        :return: the info_dict of the trajectory in the format of rocket_simulation.generate_trajectories
+        """
+
+        return params_to_info_dict(self.params[idx])
+
+    def append(self, x, y, info_dict, time_step=np.nan, box_size=np.nan):
+        """
+        The function appends a single trajectory to the store.
+        :param np.ndarray x: array of x component of the trajectory
+        :param np.ndarray y: array of y component of the trajectory
+        :param dict or np.ndarray info_dict: the info_dict of the trajectory or its PARAMS_DTYPE record
+        :param float time_step: the time step used to generate the trajectory
+        :param float box_size: the size of the box the trajectory was generated in
+        :return: index of the appended trajectory
+        """
+
+        if not isinstance(x, np.ndarray) or not isinstance(y, np.ndarray):
+            raise TypeError('x and y must be numpy arrays')
+        assert x.shape == y.shape and 'x and y shapes don\'t match!'
+
+        return self.append_chunks([np.stack([x, y], axis=1)], info_dict, time_step=time_step, box_size=box_size)
+
+    def append_chunks(self, chunks, info_dict, time_step=np.nan, box_size=np.nan):
+        """
+        The function appends a single trajectory given as an iterable of consecutive (k, 2) chunks of positions. The
+        chunks are written one after another, so the whole trajectory never has to be kept in memory.
+        :param chunks: iterable of np.arrays of shape (k, 2)
+        :param dict or np.ndarray info_dict: the info_dict of the trajectory or its PARAMS_DTYPE record
+        :param float time_step: the time step used to generate the trajectory
+        :param float box_size: the size of the box the trajectory was generated in
+        :return: index of the appended trajectory
+        """
+
+        if self.mode != 'a':
+            raise PermissionError("The store was opened in read only mode, use mode='a' to append")
+        if not self._files:
+            raise ValueError('The store was closed')
+
+        if isinstance(info_dict, dict):
+            params = info_dict_to_params(info_dict, time_step=time_step, box_size=box_size)
+        else:
+            params = np.asarray(info_dict, dtype=PARAMS_DTYPE).reshape(())
+
+        end = self._end
+        # The offset is written last, so an interrupted append leaves only data without an offset behind, which is
+        # truncated (here if the append raised, or when the store is opened again if the process was killed):
+        try:
+            for chunk in chunks:
+                chunk = np.ascontiguousarray(chunk, dtype='<f8')
+                assert chunk.ndim == 2 and chunk.shape[1] == 2 and 'chunks must be of shape (k, 2)'
+                self._files[COORDS_FILE].write(chunk.tobytes())
+                end += len(chunk)
+
+            self._files[PARAMS_FILE].write(params.tobytes())
+            self._files[OFFSETS_FILE].write(np.array([end], dtype='<i8').tobytes())
+        except BaseException:
+            self._truncate_to_offsets()
+            raise
+
+        self._length += 1
+        self._end = end
+
+        return self._length - 1
+
+
+def import_simulation_directories(root, store, time_step=np.nan, box_size=np.nan):
+    """
+    The function copies the trajectories saved by rocket_simulation.generate_simulation_from_trajectory (the
+    _x_coords.npy, _y_coords.npy and info_dict files of every simulation directory in root) into the store.
+    :param str root: the directory with the simulation directories, e.g. 'simulation_frames'
+    :param TrajectoryStore store: the store opened with mode='a'
+    :param float time_step: the time step used to generate the trajectories
+    :param float box_size: the size of the box the trajectories were generated in
+    :return: list of names of the imported simulation directories
+    """
+
+    imported = []
+    for simulation_directory_name in sorted(os.listdir(root)):
+        simul_directory = os.path.join(root, simulation_directory_name)
+        if not os.path.isdir(simul_directory):
+            continue
+
+        file_names = os.listdir(simul_directory)
+        x_files = [f for f in file_names if f.endswith('_x_coords.npy')]
+        info_files = [f for f in file_names if f.startswith('info_dict')]
+        if not x_files or not info_files:
+            continue
+
+        x = np.load(os.path.join(simul_directory, x_files[0]))
+        y = np.load(os.path.join(simul_directory, x_files[0].replace('_x_coords.npy', '_y_coords.npy')))
+        with open(os.path.join(simul_directory, info_files[0]), 'r') as json_file:
+            info_dict = json.load(json_file)
+
+        store.append(x, y, info_dict, time_step=time_step, box_size=box_size)
+        imported.append(simulation_directory_name)
+
+    return imported
+
+
+def stream_trajectory_to_store(store, force_type, n_steps, time_step=0.01, box_size=1000, body_mass=1,
+                               chunk_size=65536, rng=None):
+    """
+    The function generates a (possibly very long) trajectory in chunks (see rocket_simulation.iter_trajectory_chunks)
+    and writes them to the store as they are generated, so the whole trajectory is never kept in memory.
+    :param TrajectoryStore store: the store opened with mode='a'
+    :param str force_type: one of ('no_force', 'gravity', 'magnetic_field', 'harmonic_oscillator')
+    :param None or int n_steps: number of steps after the two initial positions (None - until the rocket leaves the
+    box)
+    :param float time_step: the time step used in Verlet integration algorithm
+    :param int box_size: size of the box the rocket is contained
+    :param float body_mass: mass of the rocket/body
+    :param int chunk_size: maximum number of steps in a chunk
+    :param rng: np.random.Generator used to draw random numbers, if None the global np.random is used
+    :return: index of the trajectory in the store
+    """
+
+    params = random_force_parameters(box_size, rng=rng)
+    position = random_initial_pos(box_size=box_size, low_starting_position_limit=0.3,
+                                  high_starting_position_limit=0.6, low_starting_velocity_limit=-1,
+                                  high_starting_velocity_limit=1, time_step=time_step, rng=rng)
+    record = force_params(force_type, position, *params, time_step=time_step, box_size=box_size)
+
+    chunks = iter_trajectory_chunks(force_type, position, time_step, n_steps, box_size, body_mass, *params,
+                                    chunk_size=chunk_size)
+
+    return store.append_chunks(chunks, record)
+
+
+'Usage example:'
+# store = TrajectoryStore('trajectory_store', mode='a')
+# import_simulation_directories('simulation_frames', store, time_step=0.01, box_size=10)
+# x, y = store.xy(0)
+# print(len(store), store.info_dict(0))
+# stream_trajectory_to_store(store, 'harmonic_oscillator', n_steps=10 ** 8, box_size=1000, chunk_size=65536)
+# store.close()
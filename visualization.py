@@ -1,14 +1,13 @@
 """These are scripts with visualisation tools"""
 
 import numpy as np
-import matplotlib.pyplot as plt
 import json
 
 
 def total_energy(info_dict_path, x, y, time_step=0.01, body_mass=1):
     """
-    This function loads the info_dict of a given simulation
-    :param str info_dict_path: path to the info_dict of a given simulation
+    This function loads the info_dict of a given simulation and calculates the total energy of the rocket at each step
+    :param str or dict info_dict_path: path to the info_dict of a given simulation or the info_dict itself
     :param np.ndarray x: array of x coordinates of the rocket
     :param np.ndarray y: array of y coordinates of the rocket
     :param float time_step: time step used to generate trajectory in rocket_simulation.generate_trajectories
@@ -16,8 +15,11 @@ def total_energy(info_dict_path, x, y, time_step=0.01, body_mass=1):
     :return np.ndarray containing total energy
     """
 
-    with open(info_dict_path, 'r') as json_file:
-        info_dict = json.load(json_file)
+    if isinstance(info_dict_path, dict):
+        info_dict = info_dict_path
+    else:
+        with open(info_dict_path, 'r') as json_file:
+            info_dict = json.load(json_file)
 
     force_type = info_dict['force_type']
 
@@ -32,11 +34,12 @@ def total_energy(info_dict_path, x, y, time_step=0.01, body_mass=1):
     if force_type == 'no_force' or force_type == 'magnetic_field':
         return kinetic_energy
     elif force_type == 'gravity':
-        g_x, g_y = np.fromstring(info_dict["g_constant"].strip("[]"), sep=" ")
-        return kinetic_energy + body_mass * (g_x * x + g_y * y)
+        g_x, g_y = np.array(info_dict["g_constant"].strip("[]").split(), dtype=float)
+        # the gravity force is body_mass * g, so the potential energy is - body_mass * g * r
+        return kinetic_energy - body_mass * (g_x * x + g_y * y)
     else:
-        k_x, k_y = np.fromstring(info_dict["spring_constant"].strip("[]"), sep=" ")
-        x_0, y_0 = np.fromstring(info_dict["equilibrium_point"].strip("[]"), sep=" ")
+        k_x, k_y = np.array(info_dict["spring_constant"].strip("[]").split(), dtype=float)
+        x_0, y_0 = np.array(info_dict["equilibrium_point"].strip("[]").split(), dtype=float)
         return kinetic_energy + 0.5 * (k_x * (x-x_0)**2 + k_y * (y-y_0)**2)
 
 
@@ -67,6 +70,8 @@ def visualize_trajectory(x_coord_path, y_coord_path, info_dict_path, box_size=10
     # calculating total energy at each step of the simulation:
     energy = total_energy(info_dict_path, x, y)
 
+    import matplotlib.pyplot as plt
+
     fig, (ax1, ax2) = plt.subplots(1, 2)
 
     ax1.scatter(x, y, s=0.5)
@@ -90,6 +95,8 @@ def visualise_batch(batch):
     :return:
     """
 
+    import matplotlib.pyplot as plt
+
     # Plot the images
     fig, axes = plt.subplots(1, 3)
 